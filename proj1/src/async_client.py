@@ -0,0 +1,279 @@
+import asyncio
+import itertools
+import logging
+import zmq
+import zmq.asyncio
+from communication.request import *
+from communication.reply import *
+from communication.compression import *
+from io_utils.client_io import *
+from io_utils.client_journal import *
+from client import REQUEST_TIMEOUT, REQUEST_RETRIES, BATCH_MAX_BYTES, server_endpoints, next_server_endpoint, skip_dropped
+
+MAX_PENDING_PUTS = 32   # PUTs waiting for a reply
+SEQUENCE_WINDOW = 64    # duplicate detection window of the server, the span of the sequences of the pending PUTs
+
+# Same operations and results as Client, as coroutines that can run concurrently over a single DEALER socket.
+# Each request is sent as [request_id, b"", message], the server returns the whole envelope, so the reply is matched
+# to its request by the first frame. A request without a reply in REQUEST_TIMEOUT is sent again with the same
+# request id and content, up to REQUEST_RETRIES times. The socket is kept, ZMQ reconnects it if the server restarts.
+# A retried PUT keeps its sequence, so the server refuses it if the first attempt was saved. While a PUT waits for
+# its reply, later PUTs may only take sequences within SEQUENCE_WINDOW of it, so it is still recognized when retried.
+class AsyncClient:
+    def __init__(self, client_dir, codec=JSON, max_pending_puts=MAX_PENDING_PUTS, flush_policy="flush"):
+        self.client_dir = client_dir
+        self.journal = ClientJournal(client_dir, flush_policy)
+        self.codec = codec
+        self.pending_puts = asyncio.Semaphore(max_pending_puts)
+        self.pending_sequences = set()
+        self.sequence_window = asyncio.Condition()
+        self.request_ids = itertools.count()
+        self.pending = {}
+        self.topic_locks = {}
+        self.unacked = {}
+
+    async def connect(self):
+        self.context = zmq.asyncio.Context()
+        self.client = self.context.socket(zmq.DEALER)
+        self.client.setsockopt(zmq.LINGER, 0)
+        logging.info("Connecting to server...")
+        self.endpoint = server_endpoints[0]
+        self.client.connect(self.endpoint)
+        self.receiver = asyncio.create_task(self.receive())
+
+        requested_codec, self.codec = self.codec, JSON
+        if requested_codec != JSON:
+            reply = await self.send_message(create_hello_request([requested_codec, JSON]))
+            if reply == None:
+                raise ConnectionError("Unable to setup initial server handshake")
+            if reply.reply_type == ReplyType.ACK and reply.body['codec'] in CODECS:
+                self.codec = reply.body['codec']
+        logging.info(f"Using {self.codec} codec")
+
+        self.client_id = ClientIO.read_client_id(self.client_dir)
+        if not self.client_id:
+            self.client_id = await self.request_id()
+            ClientIO.save_client_id(self.client_dir, self.client_id)
+        logging.info(f"Client id = {self.client_id}")
+
+        _, self.last_publications_read = self.journal.load()
+        return self
+
+    async def close(self):
+        logging.info("Disconnecting from server...")
+        self.receiver.cancel()
+        for future in self.pending.values():
+            future.cancel()
+        self.context.destroy()
+        self.journal.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def receive(self):
+        while True:
+            frames = await self.client.recv_multipart()
+            try:
+                reply = Reply.decode_multipart(frames[frames.index(b"") + 1:])
+            except (ValueError, KeyError, TypeError):
+                logging.error("Discarding malformed reply")
+                continue
+            future = self.pending.pop(frames[0], None)
+            if future != None and not future.done():   # replies to a request that was resent arrive twice
+                logging.info("Server replied (%s)", reply)
+                future.set_result(reply)
+
+    async def send_message(self, message, timeout=REQUEST_TIMEOUT):
+        request_id = next(self.request_ids).to_bytes(8, "big")
+        frames = [request_id, b"", message.encode(self.codec)]
+        logging.info("Sending (%s)", message)
+
+        for attempt in range(REQUEST_RETRIES):
+            if attempt > 0:
+                logging.info("Resending (%s)", message)
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = future
+            endpoint = self.endpoint
+            await self.client.send_multipart(frames)
+            try:
+                return await asyncio.wait_for(future, timeout / 1000)
+            except asyncio.TimeoutError:
+                logging.warning("No response from server")
+                self.failover(endpoint)
+            finally:
+                self.pending.pop(request_id, None)
+
+        logging.error("Server seems to be offline, abandoning")
+        return None
+
+    # Every request that times out on the same endpoint moves the socket to the next one only once
+    def failover(self, endpoint):
+        if len(server_endpoints) < 2 or endpoint != self.endpoint:
+            return
+        self.client.disconnect(self.endpoint)
+        self.endpoint = next_server_endpoint()
+        logging.info(f"Reconnecting to {self.endpoint}")
+        self.client.connect(self.endpoint)
+
+    async def request_id(self):
+        reply = await self.send_message(create_id_request())
+        if reply == None:
+            raise ConnectionError("Unable to setup initial server handshake")
+        return reply.body['id']
+
+    async def put(self, topic_id, publication):
+        succ, result = await self.put_batch(topic_id, [publication])
+        return succ, "" if succ else result
+
+    async def put_batch(self, topic_id, publications):
+        if len(publications) == 0:
+            return True, []
+
+        async with self.pending_puts:
+            async with self.sequence_window:
+                await self.sequence_window.wait_for(lambda: not self.pending_sequences or
+                                                    self.journal.sequence + 1 - min(self.pending_sequences) < SEQUENCE_WINDOW)
+                try:
+                    sequence = self.journal.next_sequence()
+                except IOError as e:
+                    return False, str(e)
+                self.pending_sequences.add(sequence)
+            try:
+                reply = await self.send_message(create_put_batch_request(topic_id, self.client_id, sequence, publications))
+            finally:
+                async with self.sequence_window:
+                    self.pending_sequences.discard(sequence)
+                    self.sequence_window.notify_all()
+
+        if reply == None:
+            return False, "Server is offline"
+        if reply.reply_type == ReplyType.NAK:
+            return False, reply.body["error_message"]
+        return True, reply.body['publication_ids']
+
+    @property
+    def accept(self):
+        return [ZLIB, FRAMES] if self.codec == BINARY else [FRAMES]
+
+    # Reads of a topic move its cursor, so they are serialized per topic
+    async def get(self, topic_id, wait_ms=0):
+        succ, publications = await self.get_batch(topic_id, 1, wait_ms=wait_ms)
+        return succ, publications[0] if succ else publications
+
+    # With a topic pattern, returns (topic, publication) pairs read from the matching topics
+    async def get_batch(self, topic_id, max_count, max_bytes=BATCH_MAX_BYTES, wait_ms=0):
+        if not topic_id in self.last_publications_read:
+            return False, "Client is not subscribed to topic " + topic_id
+        if is_pattern(topic_id):
+            return await self.get_pattern(topic_id, max_count, max_bytes)
+        if isinstance(self.last_publications_read[topic_id], str):
+            return await self.get_group(topic_id, max_count)
+
+        async with self.topic_locks.setdefault(topic_id, asyncio.Lock()):
+            request = create_get_batch_request(topic_id, self.client_id, self.last_publications_read[topic_id], max_count, max_bytes, wait_ms, self.accept)
+            reply = await self.send_message(request, REQUEST_TIMEOUT + wait_ms)
+
+            if reply == None:
+                return False, "Server is offline"
+            if reply.reply_type == ReplyType.NAK and 'first_publication_id' in reply.body:
+                return False, skip_dropped(self.journal, topic_id, reply)
+            if reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+            publications = reply.body['publications']
+            if len(publications) == 0:
+                return False, f"All publications from {topic_id} were already read"
+
+            try:
+                self.journal.save_cursor(topic_id, reply.body['last_publication_id'])
+            except IOError as e:
+                return False, str(e)
+            return True, [decompress(publication) for _, publication in publications]
+
+    # Same as Client.get_group, several coroutines of a member read one after the other so each read acknowledges the
+    # publications of the previous one
+    async def get_group(self, topic_id, max_count):
+        group_id = self.last_publications_read[topic_id]
+        async with self.topic_locks.setdefault(topic_id, asyncio.Lock()):
+            reply = await self.send_message(create_group_get_request(topic_id, self.client_id, group_id, max_count, self.unacked.get(topic_id, []), self.accept))
+
+            if reply == None:
+                return False, "Server is offline"
+            if reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+            publications = reply.body['publications']
+            self.unacked[topic_id] = [publication_id for publication_id, _ in publications]
+            if len(publications) == 0:
+                return False, f"All publications from {topic_id} were already read by group {group_id}"
+            return True, [decompress(publication) for _, publication in publications]
+
+    async def get_pattern(self, pattern, max_count, max_bytes=BATCH_MAX_BYTES):
+        async with self.topic_locks.setdefault(pattern, asyncio.Lock()):
+            reply = await self.send_message(create_pattern_get_request(pattern, self.client_id, self.last_publications_read[pattern], max_count, max_bytes, self.accept))
+
+            if reply == None:
+                return False, "Server is offline"
+            if reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+            try:
+                self.journal.save_cursors(pattern, reply.body['cursors'])
+            except IOError as e:
+                return False, str(e)
+            publications = reply.body['publications']
+            if len(publications) == 0:
+                return False, f"All publications from {pattern} were already read"
+            return True, [(topic_id, decompress(publication)) for topic_id, _, publication in publications]
+
+    async def subscribe(self, topic_id, group_id=None):
+        if topic_id in self.last_publications_read:
+            return False, f"Client is already subscribed to topic {topic_id}"
+
+        reply = await self.send_message(create_subscribe_request(topic_id, self.client_id, group_id))
+        if reply == None:
+            return False, "Server is offline"
+        if reply.reply_type == ReplyType.NAK:
+            return False, reply.body["error_message"]
+
+        try:
+            if is_pattern(topic_id):
+                self.journal.save_cursors(topic_id, reply.body['cursors'])
+            elif group_id:
+                self.journal.save_group(topic_id, group_id)
+            else:
+                self.journal.save_cursor(topic_id, int(reply.body['last_publication_id']))
+        except IOError as e:
+            return False, str(e)
+        except ValueError:
+            return False, "Unable to parse last_publication_id from response to integer"
+        return True, ""
+
+    async def unsubscribe(self, topic_id):
+        if topic_id not in self.last_publications_read:
+            return False, f"Client is not subscribed to topic {topic_id}"
+
+        group_id = self.last_publications_read[topic_id] if isinstance(self.last_publications_read[topic_id], str) else None
+        reply = await self.send_message(create_unsubscribe_request(topic_id, self.client_id, group_id, self.unacked.get(topic_id)))
+        if reply == None:
+            return False, "Server is offline"
+        if reply.reply_type == ReplyType.NAK:
+            return False, reply.body["error_message"]
+        self.unacked.pop(topic_id, None)
+
+        try:
+            self.journal.remove_topic(topic_id)
+        except IOError as e:
+            return False, str(e)
+        return True, ""
+
+    async def configure(self, topic_id, compression=None, retention=None):
+        reply = await self.send_message(create_config_request(topic_id, self.client_id, compression, retention))
+        if reply == None:
+            return False, "Server is offline"
+        if reply.reply_type == ReplyType.NAK:
+            return False, reply.body["error_message"]
+        return True, ""
@@ -0,0 +1,178 @@
+import argparse
+import logging
+import pathlib
+import signal
+import subprocess
+import sys
+import time
+import uuid
+import zlib
+import zmq
+from communication.reply import *
+from communication.request import *
+from io_utils.server_io import SERVER_DIR
+
+logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+ENDPOINT = "tcp://*:9001"
+SHARD_HOST = "tcp://127.0.0.1"
+SHARD_BASE_PORT = 9101
+POLL_TIMEOUT = 1000         # miliseconds
+RESTART_DELAY = 1           # seconds
+
+# Any option not known by the broker is given to every shard, e.g. --durability or --cache-size. Options naming an
+# endpoint are given to each shard with its own port.
+parser = argparse.ArgumentParser(description='Routing broker of a sharded pub/sub cluster')
+parser.add_argument('--shards', help='Number of server processes, each owning the topics that hash to it', type=int, default=4)
+parser.add_argument('--endpoint', help='Endpoint clients connect to', type=str, default=ENDPOINT)
+parser.add_argument('--shard-port', help='Port of the first shard, the others use the following ports', type=int, default=SHARD_BASE_PORT)
+parser.add_argument('--data-dir', help='Directory where the data of every shard is stored', type=str, default=SERVER_DIR)
+parser.add_argument('--metrics-endpoint', help='Metrics endpoint of the first shard, the others use the following ports', type=str)
+parser.add_argument('--replication-endpoint', help='Replication endpoint of the first shard, the others use the following ports', type=str)
+parser.add_argument('--backup-of', help='Replication endpoint of the first shard of a cluster to back up, shard by shard', type=str)
+
+SHARD_ENDPOINT_OPTIONS = ["metrics_endpoint", "replication_endpoint", "backup_of"]
+SHARD_BIND_OPTIONS = ["metrics_endpoint", "replication_endpoint"]
+
+# Each shard binds or connects to its own port, the port of the first shard plus its index
+def option_endpoint_of_shard(endpoint, index):
+    address, _, port = endpoint.rpartition(":")
+    if not address or not port.isdigit():
+        raise ValueError(f"Endpoint {endpoint} has no port, it can not be given to the shards of a cluster")
+    return f"{address}:{int(port) + index}"
+
+# Requests on a topic are forwarded to the shard `crc32(topic) % shards`, a server process with its own data
+# directory. The broker sends the whole envelope of the client through a DEALER socket, the shard adds the identity of
+# that socket in front and sends it back with the reply, so the broker only strips it to route the reply to the client.
+# REQUEST_ID and HELLO do not belong to any topic and are answered by the broker. Topic patterns may match topics of
+# every shard and are refused.
+class Broker:
+    def __init__(self, shards, endpoint, shard_port, data_dir, shard_args, endpoint_options={}):
+        self.data_dir = data_dir
+        self.shard_args = shard_args
+        self.per_shard_endpoints = {option: option_endpoint for option, option_endpoint in endpoint_options.items() if option_endpoint}
+        for option_endpoint in self.per_shard_endpoints.values():
+            option_endpoint_of_shard(option_endpoint, 0)
+        self.shard_endpoints = [f"{SHARD_HOST}:{shard_port + i}" for i in range(shards)]
+        self.check_port_ranges(shards, shard_port)
+        self.check_shard_count(shards)
+
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(endpoint)
+        self.shards = []
+        for shard_endpoint in self.shard_endpoints:
+            shard = self.context.socket(zmq.DEALER)
+            shard.setsockopt(zmq.LINGER, 0)
+            shard.connect(shard_endpoint)
+            self.shards.append(shard)
+        self.processes = [self.start_shard(i) for i in range(shards)]
+        self.exited = {}            # index of a shard that exited -> when it was seen exited
+
+    # Every shard binds its own port of each range, a range overlapping another would make two shards bind the same port
+    def check_port_ranges(self, shards, shard_port):
+        ranges = {"shard_port": shard_port}
+        for option in SHARD_BIND_OPTIONS:
+            if option in self.per_shard_endpoints:
+                ranges[option] = int(self.per_shard_endpoints[option].rpartition(":")[2])
+        options = sorted(ranges, key=ranges.get)
+        for option, next_option in zip(options, options[1:]):
+            if ranges[option] + shards > ranges[next_option]:
+                raise ValueError(f"Ports of --{option.replace('_', '-')} ({ranges[option]}-{ranges[option] + shards - 1}) and "
+                                 f"--{next_option.replace('_', '-')} ({ranges[next_option]}-{ranges[next_option] + shards - 1}) overlap")
+
+    # Topics are assigned by hash, so the data directories are only valid for the number of shards that wrote them
+    def check_shard_count(self, shards):
+        path = pathlib.Path(f"{self.data_dir}/shards.txt")
+        if path.exists() and int(path.read_text()) != shards:
+            raise ValueError(f"{self.data_dir} was written by {int(path.read_text())} shards, not {shards}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(str(shards))
+
+    def start_shard(self, index):
+        command = [sys.executable, str(pathlib.Path(__file__).parent / "server.py"),
+                   "--endpoint", self.shard_endpoints[index].replace("127.0.0.1", "*"),
+                   "--data-dir", f"{self.data_dir}/shard-{index}"] + self.shard_args
+        for option, option_endpoint in self.per_shard_endpoints.items():
+            command += [f"--{option.replace('_', '-')}", option_endpoint_of_shard(option_endpoint, index)]
+        logging.info(f"Starting shard {index} on {self.shard_endpoints[index]}")
+        return subprocess.Popen(command)
+
+    # A shard that exits is started again RESTART_DELAY later, without blocking the requests of the other shards.
+    # Clients retry the requests it did not answer.
+    def check_shards(self):
+        for index, process in enumerate(self.processes):
+            if index in self.exited:
+                if time.monotonic() - self.exited[index] >= RESTART_DELAY:
+                    del self.exited[index]
+                    self.processes[index] = self.start_shard(index)
+            elif process.poll() != None:
+                logging.error(f"Shard {index} exited with code {process.returncode}")
+                self.exited[index] = time.monotonic()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        self.context.destroy()
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        for shard in self.shards:
+            poller.register(shard, zmq.POLLIN)
+
+        while True:
+            events = dict(poller.poll(POLL_TIMEOUT))
+            for shard in self.shards:
+                if shard in events:
+                    self.frontend.send_multipart(shard.recv_multipart())
+            if self.frontend in events:
+                self.route_request()
+            self.check_shards()
+
+    def route_request(self):
+        frames = self.frontend.recv_multipart()
+        try:
+            delimiter = frames.index(b"")
+            envelope, payload = frames[:delimiter], frames[delimiter + 1]
+            codec, request = detect_codec(payload), Request.decode(payload)
+        except (ValueError, IndexError, KeyError, TypeError):
+            logging.error("Discarding malformed request")
+            return
+
+        if request.request_type == RequestType.REQUEST_ID:
+            self.frontend.send_multipart(envelope + [b"", create_id_ack(uuid.uuid4().hex).encode(codec)])
+        elif request.request_type == RequestType.HELLO:
+            codecs = request.body.get('codecs') if isinstance(request.body, dict) else None
+            self.frontend.send_multipart(envelope + [b"", create_hello_ack(choose_codec(codecs if isinstance(codecs, list) else [])).encode(codec)])
+        elif not isinstance(request.topic, str):
+            self.frontend.send_multipart(envelope + [b"", create_nak("Topic not found").encode(codec)])
+        elif is_pattern(request.topic):
+            self.frontend.send_multipart(envelope + [b"", create_nak("Topic patterns are not supported by a sharded cluster").encode(codec)])
+        else:
+            self.shards[self.shard_of(request.topic)].send_multipart(frames)
+
+    def shard_of(self, topic_id):
+        return zlib.crc32(topic_id.encode()) % len(self.shards)
+
+def main():
+    args, shard_args = parser.parse_known_args()
+    try:
+        broker = Broker(args.shards, args.endpoint, args.shard_port, args.data_dir, shard_args,
+                        {option: getattr(args, option) for option in SHARD_ENDPOINT_OPTIONS})
+    except (ValueError, IOError) as e:
+        logging.error(e)
+        exit(1)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 from client import Client
+from communication.codec import CODECS
+from io_utils.client_journal import FLUSH_POLICIES
 import argparse
 import logging
 
@@ -7,12 +9,16 @@ logging.disable()
 parser = argparse.ArgumentParser(description='Client for the server')
 parser.add_argument('client_data_dir', help='Directory where client data should be stored', type=str)
 parser.add_argument('-v', '--verbose', help='Verbose output', action='store_true')
+parser.add_argument('--wait', help='Miliseconds a GET waits for a new publication when all were already read', type=int, default=0)
+parser.add_argument('--flush', help='When the client state journal is written: fsynced on every change, handed to the OS on every change or every second', choices=FLUSH_POLICIES, default="flush")
+parser.add_argument('--servers', help='Comma separated server endpoints, requests fail over to the next one when a server does not reply', type=str)
+parser.add_argument('--codec', help='Message encoding to use if the server supports it', choices=CODECS, default="json")
 
 def main():
     args = parser.parse_args()
  
     try: 
-        client = Client(args.client_data_dir)
+        client = Client(args.client_data_dir, args.codec, args.flush, args.servers.split(",") if args.servers else None)
     except Exception as e: 
         print(e)
         exit(1)
@@ -23,7 +29,7 @@ def main():
     
     while True:
         command = input('Enter command: ')
-        execute_command(client, command)
+        execute_command(client, command, args.wait)
 
 def print_topics_subscribed(client): 
     print("You are subscribed to the following topics:")
@@ -32,13 +38,22 @@ def print_topics_subscribed(client):
 
 def print_help():
     print("Available commands:")
-    print("  GET topic_id")
+    print("  GET topic_id [max_count]")
     print("  PUT topic_id publication")
-    print("  SUB topic_id")
+    print("  SUB topic_id [group]")
     print("  UNSUB topic_id")
+    print("  LISTEN topic_id")
+    print("  COMPRESS topic_id zlib|none")
+    print("  RETAIN topic_id [max_bytes=N] [max_age=SECONDS] [max_count=N]")
     print("  EXIT")
 
-def execute_command(client, command):
+# Publications read through a topic pattern come with their topic
+def received(publication):
+    if isinstance(publication, tuple):
+        return f"Received from {publication[0]}: {publication[1]}"
+    return f"Received: {publication}"
+
+def execute_command(client, command, wait_ms=0):
     split_command = command.split(" ")
     operation = split_command[0]
 
@@ -48,19 +63,49 @@ def execute_command(client, command):
 
     topic_id = split_command[1]
 
-    if operation == "GET":
-        succ, publication = client.get(topic_id)
-        print(f"Received: {publication}" if succ else f"GET failed with: {publication}")
+    if operation == "GET" and len(split_command) > 2:
+        try:
+            max_count = int(split_command[2])
+        except ValueError:
+            max_count = 0
+        if max_count <= 0:
+            print("GET failed with: max_count must be a positive number")
+            return
+        succ, publications = client.get_batch(topic_id, max_count, wait_ms=wait_ms)
+        print("\n".join(received(publication) for publication in publications) if succ else f"GET failed with: {publications}")
+    elif operation == "GET":
+        succ, publication = client.get(topic_id, wait_ms)
+        print(received(publication) if succ else f"GET failed with: {publication}")
     elif operation == "PUT":
         publication = " ".join(split_command[2:])
         succ, error = client.put(topic_id, publication)
         print("PUT successful" if succ else f"PUT failed with: {error}")
     elif operation == "SUB":
-        succ, error = client.subscribe(topic_id)
-        print(f"SUB successful, you are now subscribed to {topic_id}" if succ else f"SUB failed with: {error}")
+        group_id = split_command[2] if len(split_command) > 2 else None
+        succ, error = client.subscribe(topic_id, group_id)
+        print(f"SUB successful, you are now subscribed to {topic_id}" + (f" as a member of group {group_id}" if group_id else "") if succ else f"SUB failed with: {error}")
     elif operation == "UNSUB":
         succ, error = client.unsubscribe(topic_id)
         print(f"UNSUB successful, you are now unsubscribed from {topic_id}" if succ else f"UNSUB failed with: {error}")
+    elif operation == "LISTEN":
+        try:
+            for publication in client.listen(topic_id):
+                print(f"Received: {publication}")
+        except KeyboardInterrupt:
+            print()
+        except (ValueError, IOError, ConnectionError) as e:
+            print(f"LISTEN failed with: {e}")
+    elif operation == "COMPRESS" and len(split_command) > 2:
+        succ, error = client.configure(topic_id, split_command[2])
+        print(f"COMPRESS successful, new publications of {topic_id} are stored with {split_command[2]}" if succ else f"COMPRESS failed with: {error}")
+    elif operation == "RETAIN":
+        try:
+            retention = {name: float(value) if name == "max_age" else int(value) for name, value in (limit.split("=") for limit in split_command[2:])}
+        except ValueError:
+            print("RETAIN failed with: limits must be given as name=number")
+            return
+        succ, error = client.configure(topic_id, retention=retention)
+        print(f"RETAIN successful, {topic_id} keeps " + (", ".join(f"{name} {value}" for name, value in retention.items()) or "every publication until read") if succ else f"RETAIN failed with: {error}")
     else:
         print(f"Operation {operation} not recognized")
 
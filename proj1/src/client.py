@@ -5,26 +5,44 @@ import sys
 import socket
 import os
 import pathlib
-import random 
 from communication.request import *
 from communication.reply import *
+from communication.compression import *
 from io_utils.client_io import * 
+from io_utils.client_journal import *
 
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
 REQUEST_TIMEOUT = 5000  # miliseconds
 REQUEST_RETRIES = 3
+BATCH_MAX_BYTES = 256 * 1024    # bytes
+PUSH_WINDOW = 100               # publications the server may push before they are acknowledged
 SERVER_ENDPOINT = "tcp://localhost:9001"
 
+# Requests go to the first endpoint, a request without reply is resent to the next one, e.g. from a primary to its backup
+server_endpoints = [SERVER_ENDPOINT]
+
+def set_server_endpoints(endpoints):
+    server_endpoints[:] = endpoints
+
+def next_server_endpoint():
+    server_endpoints.append(server_endpoints.pop(0))
+    return server_endpoints[0]
+
 class Client:
-    def __init__(self, client_dir):
+    def __init__(self, client_dir, codec=JSON, flush_policy="flush", endpoints=None):
+        if endpoints:
+            set_server_endpoints(endpoints)
         self.client_dir = client_dir
+        self.codec = JSON
+        self.journal = ClientJournal(client_dir, flush_policy)
         self.__connect()
 
         try:
+            self.__negotiate_codec(codec)
             self.__get_id()
-            self.operation_counter = ClientIO.read_client_counter(self.client_dir)
-            self.last_publications_read = ClientIO.read_client_topics(self.client_dir)
+            _, self.last_publications_read = self.journal.load()
+            self.unacked = {}   # publications of each consumer group returned by the last read, acknowledged by the next one
         except ConnectionError as e:
             raise e
         except IOError as e: 
@@ -36,8 +54,22 @@ class Client:
         self.context = zmq.Context()
         self.client = self.context.socket(zmq.REQ)
         logging.info("Connecting to server...")
-        self.client.connect(SERVER_ENDPOINT)
+        self.client.connect(server_endpoints[0])
     
+    # Servers that do not know HELLO reply with a NAK, in which case JSON is kept
+    def __negotiate_codec(self, codec):
+        if codec == JSON:
+            return
+
+        response = send_message(self.context, self.client, create_hello_request([codec, JSON]))
+        if not response:
+            raise ConnectionError("Unable to setup initial server handshake")
+
+        self.client, reply = response
+        if reply.reply_type == ReplyType.ACK and reply.body['codec'] in CODECS:
+            self.codec = reply.body['codec']
+        logging.info(f"Using {self.codec} codec")
+
     def __get_id(self):
         try:
             self.client_id = ClientIO.read_client_id(self.client_dir)
@@ -45,7 +77,7 @@ class Client:
             raise e
         
         if not self.client_id:
-            response = send_message(self.context, self.client, create_id_request())
+            response = send_message(self.context, self.client, create_id_request(), self.codec)
             
             if not response:
                 raise ConnectionError("Unable to setup initial server handshake")
@@ -61,15 +93,28 @@ class Client:
 
     def __del__(self):
         logging.info("Disconnecting from server...")
+        self.journal.close()
         if self.context: 
             self.context.destroy()
 
-    def get(self, topic_id):
+    # Only the binary codec keeps compressed publications apart from text ones, publications sent as frames are flagged
+    @property
+    def accept(self):
+        return [ZLIB, FRAMES] if self.codec == BINARY else [FRAMES]
+
+    # With wait_ms, the server holds the request for up to that long when there is nothing new to read
+    def get(self, topic_id, wait_ms=0):
         if not topic_id in self.last_publications_read:
             return False, "Client is not subscribed to topic " + topic_id
+        if is_pattern(topic_id):
+            succ, publications = self.get_pattern(topic_id, 1)
+            return succ, publications[0] if succ else publications
+        if isinstance(self.last_publications_read[topic_id], str):
+            succ, publications = self.get_group(topic_id, 1)
+            return succ, publications[0] if succ else publications
         
-        request = create_get_request(topic_id, self.client_id, self.last_publications_read[topic_id])
-        response = send_message(self.context, self.client, request)
+        request = create_get_request(topic_id, self.client_id, self.last_publications_read[topic_id], wait_ms, self.accept)
+        response = send_message(self.context, self.client, request, self.codec, REQUEST_TIMEOUT + wait_ms)
         
         if response:
             self.client, reply = response
@@ -78,36 +123,156 @@ class Client:
                 if publication_id == -1:
                     return False, f"All publications from {topic_id} were already read"
 
-                publication = reply.body['publication']
-                self.last_publications_read[topic_id] = publication_id
-                
+                publication = decompress(reply.body['publication'])
                 try: 
-                    ClientIO.save_client_topics(self.client_dir, self.last_publications_read)
+                    self.journal.save_cursor(topic_id, publication_id)
                 except IOError as e: 
                     return False, str(e)
 
                 return True, publication
             elif reply.reply_type == ReplyType.NAK:
+                if 'first_publication_id' in reply.body:
+                    return False, skip_dropped(self.journal, topic_id, reply)
                 return False, reply.body["error_message"]
     
         return False, "Server is offline"
 
-    def __randomize_client_counter(self):
-        while True:
-            new_counter = random.randint(1, 10000000)
-            if self.operation_counter != new_counter:
-                self.operation_counter = new_counter
-                break
+    def get_batch(self, topic_id, max_count, max_bytes=BATCH_MAX_BYTES, wait_ms=0):
+        if not topic_id in self.last_publications_read:
+            return False, "Client is not subscribed to topic " + topic_id
+        if is_pattern(topic_id):
+            return self.get_pattern(topic_id, max_count, max_bytes)
+        if isinstance(self.last_publications_read[topic_id], str):
+            return self.get_group(topic_id, max_count)
+
+        request = create_get_batch_request(topic_id, self.client_id, self.last_publications_read[topic_id], max_count, max_bytes, wait_ms, self.accept)
+        response = send_message(self.context, self.client, request, self.codec, REQUEST_TIMEOUT + wait_ms)
+
+        if response:
+            self.client, reply = response
+            if reply.reply_type == ReplyType.ACK:
+                publications = reply.body['publications']
+                if len(publications) == 0:
+                    return False, f"All publications from {topic_id} were already read"
+
+                try: 
+                    self.journal.save_cursor(topic_id, reply.body['last_publication_id'])
+                except IOError as e: 
+                    return False, str(e)
+
+                return True, [decompress(publication) for _, publication in publications]
+            elif reply.reply_type == ReplyType.NAK:
+                if 'first_publication_id' in reply.body:
+                    return False, skip_dropped(self.journal, topic_id, reply)
+                return False, reply.body["error_message"]
+
+        return False, "Server is offline"
+
+    # Returns (topic, publication) pairs read from the topics matching the pattern, the cursor of every topic is sent
+    # and the server adds the topics created since the last read
+    def get_pattern(self, pattern, max_count, max_bytes=BATCH_MAX_BYTES):
+        request = create_pattern_get_request(pattern, self.client_id, self.last_publications_read[pattern], max_count, max_bytes, self.accept)
+        response = send_message(self.context, self.client, request, self.codec)
+
+        if response:
+            self.client, reply = response
+            if reply.reply_type == ReplyType.ACK:
+                try:
+                    self.journal.save_cursors(pattern, reply.body['cursors'])
+                except IOError as e:
+                    return False, str(e)
+
+                publications = reply.body['publications']
+                if len(publications) == 0:
+                    return False, f"All publications from {pattern} were already read"
+                return True, [(topic_id, decompress(publication)) for topic_id, _, publication in publications]
+            elif reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+        return False, "Server is offline"
+
+    # Each publication of a topic read as a member of a consumer group is returned to a single member. Publications are
+    # acknowledged by the next read of the member, or when it leaves the group, and the server hands those a member does
+    # not acknowledge in time, e.g. because it crashed, to another member.
+    def get_group(self, topic_id, max_count):
+        group_id = self.last_publications_read[topic_id]
+        request = create_group_get_request(topic_id, self.client_id, group_id, max_count, self.unacked.get(topic_id, []), self.accept)
+        response = send_message(self.context, self.client, request, self.codec)
+
+        if response:
+            self.client, reply = response
+            if reply.reply_type == ReplyType.ACK:
+                publications = reply.body['publications']
+                self.unacked[topic_id] = [publication_id for publication_id, _ in publications]
+                if len(publications) == 0:
+                    return False, f"All publications from {topic_id} were already read by group {group_id}"
+                return True, [decompress(publication) for _, publication in publications]
+            elif reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+        return False, "Server is offline"
+
+    # Yields the publications of a topic as the server pushes them. Pushes go to a separate DEALER socket, if the
+    # server stays silent for REQUEST_TIMEOUT the PUSH request is sent again so a restarted server knows the client
+    def listen(self, topic_id, window=PUSH_WINDOW):
+        if not topic_id in self.last_publications_read:
+            raise ValueError("Client is not subscribed to topic " + topic_id)
+        if is_pattern(topic_id):
+            raise ValueError("Publications of a topic pattern can not be pushed")
+        if isinstance(self.last_publications_read[topic_id], str):
+            raise ValueError("Publications of a consumer group can not be pushed")
+
+        listener = self.context.socket(zmq.DEALER)
+        listener.setsockopt(zmq.LINGER, 0)
+        endpoint = server_endpoints[0]
+        listener.connect(endpoint)
+        try:
+            registered = False
+            while True:
+                if not registered:
+                    request = create_push_request(topic_id, self.client_id, self.last_publications_read[topic_id], window, self.accept)
+                    listener.send_multipart([b"", request.encode(self.codec)])
+
+                if (listener.poll(REQUEST_TIMEOUT) & zmq.POLLIN) == 0:
+                    logging.warning("No pushes from server, registering again")
+                    registered = False
+                    if len(server_endpoints) > 1:
+                        listener.disconnect(endpoint)
+                        endpoint = next_server_endpoint()
+                        listener.connect(endpoint)
+                    continue
+
+                reply = Reply.decode(listener.recv_multipart()[-1])
+                if reply.reply_type == ReplyType.NAK and 'first_publication_id' in reply.body:
+                    logging.warning(skip_dropped(self.journal, topic_id, reply))
+                    registered = False
+                    continue
+                if reply.reply_type == ReplyType.NAK:
+                    raise ConnectionError(reply.body["error_message"])
+                registered = True
+                if not 'publications' in reply.body:
+                    continue
+
+                # Pushes sent before a re-registration may arrive twice
+                publications = [decompress(publication) for publication_id, publication in reply.body['publications'] if publication_id > self.last_publications_read[topic_id]]
+                if len(publications) == 0:
+                    continue
+                self.journal.save_cursor(topic_id, reply.body['last_publication_id'])
+
+                ack = create_push_ack_request(topic_id, self.client_id, self.last_publications_read[topic_id], window)
+                listener.send_multipart([b"", ack.encode(self.codec)])
+                yield from publications
+        finally:
+            listener.close()
 
     def put(self, topic_id, publication):
-        self.__randomize_client_counter()
         try: 
-            ClientIO.save_client_counter(self.client_dir, self.operation_counter)
+            sequence = self.journal.next_sequence()
         except IOError as e: 
             return False, str(e)
 
-        request = create_put_request(topic_id, self.client_id, self.operation_counter, publication)
-        response = send_message(self.context, self.client, request)
+        request = create_put_request(topic_id, self.client_id, sequence, publication)
+        response = send_message(self.context, self.client, request, self.codec)
 
         if response:
             self.client, reply = response
@@ -118,20 +283,46 @@ class Client:
         
         return False, f"Server is offline"
 
-    def subscribe(self, topic_id):
+    def put_batch(self, topic_id, publications):
+        if len(publications) == 0:
+            return True, []
+
+        try: 
+            sequence = self.journal.next_sequence()
+        except IOError as e: 
+            return False, str(e)
+
+        request = create_put_batch_request(topic_id, self.client_id, sequence, publications)
+        response = send_message(self.context, self.client, request, self.codec)
+
+        if response:
+            self.client, reply = response
+            if reply.reply_type == ReplyType.ACK:
+                return True, reply.body['publication_ids']
+            elif reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+        return False, "Server is offline"
+
+    # With a group, the client joins that consumer group of the topic and shares its publications with the other members
+    def subscribe(self, topic_id, group_id=None):
         if topic_id in self.last_publications_read: 
             return False, f"Client is already subscribed to topic {topic_id}"
 
-        request = create_subscribe_request(topic_id, self.client_id)
-        response = send_message(self.context, self.client, request)
+        request = create_subscribe_request(topic_id, self.client_id, group_id)
+        response = send_message(self.context, self.client, request, self.codec)
 
         if response:
             self.client, reply = response
 
             if reply.reply_type == ReplyType.ACK:
                 try: 
-                    self.last_publications_read[topic_id] = int(reply.body['last_publication_id'])
-                    ClientIO.save_client_topics(self.client_dir, self.last_publications_read)
+                    if is_pattern(topic_id):
+                        self.journal.save_cursors(topic_id, reply.body['cursors'])
+                    elif group_id:
+                        self.journal.save_group(topic_id, group_id)
+                    else:
+                        self.journal.save_cursor(topic_id, int(reply.body['last_publication_id']))
                 except IOError as e: 
                     return False, str(e)
                 except ValueError: 
@@ -146,15 +337,16 @@ class Client:
         if topic_id not in self.last_publications_read: 
             return False, f"Client is not subscribed to topic {topic_id}"
 
-        request = create_unsubscribe_request(topic_id, self.client_id)
-        response = send_message(self.context, self.client, request)
+        group_id = self.last_publications_read[topic_id] if isinstance(self.last_publications_read[topic_id], str) else None
+        request = create_unsubscribe_request(topic_id, self.client_id, group_id, self.unacked.get(topic_id))
+        response = send_message(self.context, self.client, request, self.codec)
 
         if response:
             self.client, reply = response
             if(reply.reply_type == ReplyType.ACK):
-                self.last_publications_read.pop(topic_id, None)
                 try:
-                    ClientIO.save_client_topics(self.client_dir, self.last_publications_read)
+                    self.unacked.pop(topic_id, None)
+                    self.journal.remove_topic(topic_id)
                 except IOError as e:
                     return False, str(e)
                 return True, ""
@@ -163,20 +355,45 @@ class Client:
 
         return False, "Server is offline"
 
-def send_message(context, client, message):
-    request = str(message).encode()
-    logging.info("Sending (%s)", request)
+    # Publications PUT on the topic from then on are stored compressed with the compression, or as they are with none.
+    # The retention is a dict of the limits of the topic (max_bytes, max_age in seconds, max_count), an empty one removes them.
+    def configure(self, topic_id, compression=None, retention=None):
+        request = create_config_request(topic_id, self.client_id, compression, retention)
+        response = send_message(self.context, self.client, request, self.codec)
+
+        if response:
+            self.client, reply = response
+            if reply.reply_type == ReplyType.ACK:
+                return True, ""
+            elif reply.reply_type == ReplyType.NAK:
+                return False, reply.body["error_message"]
+
+        return False, "Server is offline"
+
+# A read behind the publications a topic still keeps is refused with the first one kept, the cursor is moved right
+# before it so the next read continues from there
+def skip_dropped(journal, topic_id, reply):
+    first_publication_id = reply.body['first_publication_id']
+    try:
+        journal.save_cursor(topic_id, first_publication_id - 1)
+    except IOError as e:
+        return str(e)
+    return f"Publications of {topic_id} before {first_publication_id} were dropped by its retention, reading continues from there"
+
+def send_message(context, client, message, codec=JSON, timeout=REQUEST_TIMEOUT):
+    request = message.encode(codec)
+    logging.info("Sending (%s)", message)
 
     if client == None or client.closed:
         client = context.socket(zmq.REQ)
-        client.connect(SERVER_ENDPOINT)
+        client.connect(server_endpoints[0])
 
     client.send(request)
     
     retries_left = REQUEST_RETRIES
     while True:
-        if (client.poll(REQUEST_TIMEOUT) & zmq.POLLIN) != 0:
-            reply = Reply.from_json(client.recv())
+        if (client.poll(timeout) & zmq.POLLIN) != 0:
+            reply = Reply.decode_multipart(client.recv_multipart())
             logging.info("Server replied (%s)", reply)
             break
 
@@ -192,8 +409,8 @@ def send_message(context, client, message):
 
         logging.info("Reconnecting to server...")   # Create new connection
         client = context.socket(zmq.REQ)
-        client.connect(SERVER_ENDPOINT)
-        logging.info("Resending (%s)", request)
+        client.connect(next_server_endpoint())
+        logging.info("Resending (%s)", message)
         client.send(request)
     
     return client, reply
\ No newline at end of file
@@ -0,0 +1,47 @@
+# Messages are encoded either as JSON text or in a compact binary format:
+#   Binary message:
+#   - magic byte (0xB1)
+#   - type code, the position of the type in RequestType or ReplyType
+#   - msgpack encoded fields (topic, client_id and body for a request, body for a reply)
+# JSON messages always start with '{', so the receiver finds the codec of a message from its first byte.
+# The client and the server agree on a codec with a HELLO request, sent in JSON, before using the binary format.
+
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+BINARY = "msgpack"
+CODECS = [BINARY, JSON] if msgpack else [JSON]
+
+BINARY_MAGIC = 0xB1
+BINARY_HEADER = struct.Struct("<BB")    # magic, type code
+
+def detect_codec(data):
+    return BINARY if len(data) > 0 and data[0] == BINARY_MAGIC else JSON
+
+def choose_codec(codecs):
+    for codec in codecs:
+        if codec in CODECS:
+            return codec
+    return JSON
+
+def encode_binary(type_code, fields):
+    return BINARY_HEADER.pack(BINARY_MAGIC, type_code) + msgpack.packb(fields, use_bin_type=True)
+
+# Raises ValueError for anything that is not a complete binary message
+def decode_binary(data):
+    if msgpack == None:
+        raise ValueError("Binary messages are not supported without msgpack")
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError("Truncated binary message")
+    magic, type_code = BINARY_HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Invalid binary message")
+    try:
+        return type_code, msgpack.unpackb(data[BINARY_HEADER.size:], raw=False)
+    except (msgpack.UnpackException, ValueError) as e:
+        raise ValueError(f"Invalid binary message: {e}")
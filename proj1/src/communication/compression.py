@@ -0,0 +1,43 @@
+# Publications of a topic with compression enabled are compressed once by the server when they are PUT and kept
+# compressed on disk and in memory. A compressed publication is a bytes object holding its UTF-8 text compressed
+# with zlib, a publication kept as is a str. Clients that list zlib in the ACCEPT field of a GET or PUSH request and
+# use the binary codec, where bytes and str stay distinct, receive compressed publications as they are stored and
+# decompress them, the others receive them decompressed by the server.
+
+import zlib
+
+NONE = "none"
+ZLIB = "zlib"
+COMPRESSIONS = [NONE, ZLIB]
+COMPRESSION_LEVEL = 6
+
+# Publications that do not shrink are kept as they are
+def compress(publication, level=COMPRESSION_LEVEL):
+    data = publication.encode()
+    compressed = zlib.compress(data, level)
+    return compressed if len(compressed) < len(data) else publication
+
+def decompress(publication):
+    if isinstance(publication, str):
+        return publication
+    return zlib.decompress(publication).decode()
+
+# Returns the (id, publication) pairs as the client of a request can read them
+def for_client(publications, accepts_compressed):
+    if accepts_compressed:
+        return publications
+    return [(publication_id, decompress(publication)) for publication_id, publication in publications]
+
+# As stored in a log or sent in a frame, a publication is its payload, text encoded as UTF-8 or compressed bytes, and
+# a flag telling them apart
+def to_payload(publication):
+    return (publication, True) if isinstance(publication, bytes) else (publication.encode(), False)
+
+def from_payload(payload, compressed):
+    return bytes(payload) if compressed else str(payload, "utf-8")
+
+# Same as for_client, on (id, payload, compressed) triples
+def payloads_for_client(payloads, accepts_compressed):
+    if accepts_compressed:
+        return payloads
+    return [(publication_id, zlib.decompress(payload) if compressed else payload, False) for publication_id, payload, compressed in payloads]
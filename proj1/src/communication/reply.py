@@ -1,25 +1,45 @@
 # GET:
 #   NAK -> NO_MESSAGES_LEFT_TO_READ
+#   NAK(FIRST_MESSAGE_ID) when the messages after LAST_MESSAGE_RECEIVED were dropped by the retention of the topic,
+#     reading continues from FIRST_MESSAGE_ID (also for PUSH)
 #   ACK(message, MESSAGE_ID)
+#   ACK([(MESSAGE_ID, message), ...], LAST_MESSAGE_ID) for a batch
+#   ACK([(MESSAGE_ID, COMPRESSED), ...], LAST_MESSAGE_ID) followed by a frame per message, for a batch with FRAMES accepted
+#   ACK([(topicA, MESSAGE_ID, message), ...], {topicA: LAST_MESSAGE_ID, ...}) for a topic pattern
 # SUB:
 #   ACK(LAST_MESSAGE_IN_TOPIC)
+#   ACK({topicA: LAST_MESSAGE_IN_TOPIC, ...}) for a topic pattern
 # PUT:
 #   ACK(CLIENT_COUNTER)
+#   ACK([MESSAGE_ID, ...]) for a batch
 #   NAK 
 # UNSUB: 
 #   ACK
+# HELLO:
+#   ACK(CODEC)
+# CONFIG:
+#   ACK(COMPRESSION, RETENTION) of the topic
+# PUSH:
+#   ACK(LAST_MESSAGE_ID), followed by ACK(topicA, [(MESSAGE_ID, message), ...], LAST_MESSAGE_ID) as publications arrive
 
 from enum import Enum
 import json
+from .codec import *
+from .compression import from_payload
+
+FRAMES = "frames"
 
 class ReplyType(str, Enum):
     ACK = 'ACK',
     NAK = 'NAK'
 
+REPLY_TYPES = list(ReplyType)
+
 class Reply: 
-    def __init__(self, reply_type, body=None): 
+    def __init__(self, reply_type, body=None, frames=None): 
         self._reply_type = reply_type
         self._body = body
+        self.frames = frames or []
     
     def from_json(reply_json):
         reply = json.loads(reply_json)
@@ -28,6 +48,26 @@ class Reply:
             reply.get('body', None)
         )
         
+    def decode(data):
+        if detect_codec(data) == BINARY:
+            type_code, body = decode_binary(data)
+            return Reply(REPLY_TYPES[type_code], body)
+        return Reply.from_json(data.decode())
+
+    # The publications listed under 'frames' follow the reply as frames of their own, they are put back in the body as
+    # the (id, publication) pairs of a batch
+    def decode_multipart(frames):
+        reply = Reply.decode(frames[0])
+        if reply.body and 'frames' in reply.body:
+            reply.body['publications'] = [(publication_id, from_payload(frame, compressed))
+                                          for (publication_id, compressed), frame in zip(reply.body.pop('frames'), frames[1:])]
+        return reply
+
+    def encode(self, codec=JSON):
+        if codec == BINARY:
+            return encode_binary(REPLY_TYPES.index(self._reply_type), self._body)
+        return str(self).encode()
+
     def __str__(self):
         d = {'type': self._reply_type}
         if self._body:
@@ -53,24 +93,56 @@ class Reply:
 def create_get_ack(publication, publication_id):
     return Reply(ReplyType.ACK, {'publication': publication, 'publication_id': publication_id})
 
+def create_get_batch_ack(publications, last_publication_id):
+    return Reply(ReplyType.ACK, {'publications': publications, 'last_publication_id': last_publication_id})
+
+# Payloads are (id, payload, compressed) triples, each payload is sent as is in a frame after the reply
+def create_framed_get_batch_ack(payloads, last_publication_id):
+    return Reply(ReplyType.ACK, {'frames': [[publication_id, compressed] for publication_id, _, compressed in payloads], 'last_publication_id': last_publication_id},
+                 [payload for _, payload, _ in payloads])
+
 def create_empty_get_ack(): 
     return Reply(ReplyType.ACK, {'publication_id': -1})
 
+def create_pattern_get_ack(publications, cursors):
+    return Reply(ReplyType.ACK, {'publications': publications, 'cursors': cursors})
+
 def create_sub_ack(last_publication):
     return Reply(ReplyType.ACK, {'last_publication_id': last_publication})
 
+def create_pattern_sub_ack(cursors):
+    return Reply(ReplyType.ACK, {'cursors': cursors})
+
 def create_unsub_ack():
     return Reply(ReplyType.ACK, {})
 
 def create_put_ack(counter):
     return Reply(ReplyType.ACK, {'current_publication_id': counter})
 
+def create_put_batch_ack(publication_ids):
+    return Reply(ReplyType.ACK, {'publication_ids': publication_ids})
+
 def create_nak(error_message=""):
     return Reply(ReplyType.NAK, {"error_message": error_message})
 
+def create_skip_nak(first_publication_id):
+    return Reply(ReplyType.NAK, {"error_message": "Publications were dropped by the retention of the topic", "first_publication_id": first_publication_id})
+
 def create_id_ack(id):
     return Reply(ReplyType.ACK, {'id': id})
 
+def create_push_ack(last_publication_id):
+    return Reply(ReplyType.ACK, {'last_publication_id': last_publication_id})
+
+def create_push_delivery(topic, publications):
+    return Reply(ReplyType.ACK, {'topic': topic, 'publications': publications, 'last_publication_id': publications[-1][0]})
+
+def create_hello_ack(codec):
+    return Reply(ReplyType.ACK, {'codec': codec})
+
+def create_config_ack(compression, retention):
+    return Reply(ReplyType.ACK, {'compression': compression, 'retention': retention})
+
 if __name__ == '__main__':
     d = {
         'type': ReplyType.ACK
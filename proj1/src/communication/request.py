@@ -1,7 +1,20 @@
-# PUT sends (topicA, CLIENT_A_ID, CLIENT_COUNTER=0, msg)
-# GET sends (topicA, CLIENT_ID, LAST_MESSAGE_RECEIVED or 0 if first GET)
+# PUT sends (topicA, CLIENT_A_ID, SEQUENCE, msg) or (topicA, CLIENT_A_ID, SEQUENCE, [msg, ...]) for a batch,
+#   SEQUENCE increases by one on every PUT of the client and is kept when a PUT is retried
+# GET sends (topicA, CLIENT_ID, LAST_MESSAGE_RECEIVED or 0 if first GET, optionally MAX_COUNT and MAX_BYTES for a batch
+#   and WAIT_MS to be held by the server until a new message arrives)
 # SUB sends (topicA, CLIENT_ID)
 # UNSUB sends (topicA, CLIENT_ID)
+# HELLO sends (CODECS supported by the client)
+# PUSH sends (topicA, CLIENT_ID, LAST_MESSAGE_RECEIVED, WINDOW) to have publications pushed as they arrive
+# PUSH_ACK sends (topicA, CLIENT_ID, LAST_MESSAGE_RECEIVED, WINDOW) and gets no reply
+# CONFIG sends (topicA, CLIENT_ID, COMPRESSION, RETENTION) to choose how the publications PUT from then on are stored
+#   and the limits on the publications the topic keeps ({max_bytes, max_age, max_count}), either may be left out
+# GET and PUSH may also send ACCEPT, the compressions of publications the client can read and FRAMES if a batch of
+#   publications may be sent as frames following the reply
+# SUB, UNSUB and GET also accept a topic pattern, like sensor.*.temp or sensor.eu.**, instead of a topic: a GET then
+#   sends ({topicA: LAST_MESSAGE_RECEIVED, ...}, MAX_COUNT, MAX_BYTES) for the matching topics it knows of
+# SUB, UNSUB and GET may also send GROUP to join, leave or read as a member of a consumer group of the topic: a GET then
+#   sends (GROUP, MAX_COUNT, [MESSAGE_ID, ...]) acknowledging the messages the member processed, as does UNSUB
 
 # Message:
 #   Header:
@@ -15,6 +28,7 @@
 
 from enum import Enum
 import json
+from .codec import *
 
 class RequestType(str, Enum):
     GET = 'GET'
@@ -22,6 +36,19 @@ class RequestType(str, Enum):
     SUB = 'SUB'
     UNSUB = 'UNSUB'
     REQUEST_ID = 'REQUEST_ID'
+    HELLO = 'HELLO'
+    PUSH = 'PUSH'
+    PUSH_ACK = 'PUSH_ACK'
+    CONFIG = 'CONFIG'
+
+REQUEST_TYPES = list(RequestType)
+
+TOPIC_SEPARATOR = "."
+ANY_LEVEL = "*"
+ANY_LEVELS = "**"
+
+def is_pattern(topic_id):
+    return "*" in topic_id
 
 class Request:
     def __init__(self, request_type, topic, client_id, body):
@@ -39,6 +66,17 @@ class Request:
             request['body']
         )
     
+    def decode(data):
+        if detect_codec(data) == BINARY:
+            type_code, (topic, client_id, body) = decode_binary(data)
+            return Request(REQUEST_TYPES[type_code], topic, client_id, body)
+        return Request.from_json(data.decode())
+
+    def encode(self, codec=JSON):
+        if codec == BINARY:
+            return encode_binary(REQUEST_TYPES.index(self._request_type), [self._topic, self._client_id, self._body])
+        return str(self).encode()
+    
     def __str__(self):
         return json.dumps({
             'type': self._request_type,
@@ -80,17 +118,62 @@ class Request:
     def body(self, body):
         self._body = body
         
-def create_get_request(topic, client_id, last_publication_received):
-    return Request(RequestType.GET, topic, client_id, {'last_publication_id': last_publication_received})
+def create_get_request(topic, client_id, last_publication_received, wait_ms=0, accept=None):
+    body = {'last_publication_id': last_publication_received}
+    if wait_ms > 0:
+        body['wait_ms'] = wait_ms
+    if accept:
+        body['accept'] = accept
+    return Request(RequestType.GET, topic, client_id, body)
+
+def create_get_batch_request(topic, client_id, last_publication_received, max_count, max_bytes, wait_ms=0, accept=None):
+    request = create_get_request(topic, client_id, last_publication_received, wait_ms, accept)
+    request.body.update({'max_count': max_count, 'max_bytes': max_bytes})
+    return request
+
+def create_pattern_get_request(pattern, client_id, cursors, max_count, max_bytes, accept=None):
+    body = {'cursors': cursors, 'max_count': max_count, 'max_bytes': max_bytes}
+    if accept:
+        body['accept'] = accept
+    return Request(RequestType.GET, pattern, client_id, body)
 
 def create_put_request(topic, client_id, client_counter, publication):
     return Request(RequestType.PUT, topic, client_id, {'counter': client_counter, 'publication': publication})
 
-def create_subscribe_request(topic, client_id): 
-    return Request(RequestType.SUB, topic, client_id, {})
+def create_put_batch_request(topic, client_id, client_counter, publications):
+    return Request(RequestType.PUT, topic, client_id, {'counter': client_counter, 'publications': publications})
 
-def create_unsubscribe_request(topic, client_id):
-    return Request(RequestType.UNSUB, topic, client_id, {})
+def create_subscribe_request(topic, client_id, group=None): 
+    return Request(RequestType.SUB, topic, client_id, {'group': group} if group else {})
+
+def create_unsubscribe_request(topic, client_id, group=None, acks=None):
+    return Request(RequestType.UNSUB, topic, client_id, {'group': group, 'acks': acks or []} if group else {})
+
+def create_group_get_request(topic, client_id, group, max_count, acks, accept=None):
+    body = {'group': group, 'max_count': max_count, 'acks': acks}
+    if accept:
+        body['accept'] = accept
+    return Request(RequestType.GET, topic, client_id, body)
 
 def create_id_request():
-    return Request(RequestType.REQUEST_ID, "", "", {})
\ No newline at end of file
+    return Request(RequestType.REQUEST_ID, "", "", {})
+
+def create_push_request(topic, client_id, last_publication_received, window, accept=None):
+    body = {'last_publication_id': last_publication_received, 'window': window}
+    if accept:
+        body['accept'] = accept
+    return Request(RequestType.PUSH, topic, client_id, body)
+
+def create_push_ack_request(topic, client_id, last_publication_received, window):
+    return Request(RequestType.PUSH_ACK, topic, client_id, {'last_publication_id': last_publication_received, 'window': window})
+
+def create_hello_request(codecs):
+    return Request(RequestType.HELLO, "", "", {'codecs': codecs})
+
+def create_config_request(topic, client_id, compression=None, retention=None):
+    body = {}
+    if compression:
+        body['compression'] = compression
+    if retention != None:
+        body['retention'] = retention
+    return Request(RequestType.CONFIG, topic, client_id, body)
\ No newline at end of file
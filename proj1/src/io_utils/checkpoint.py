@@ -0,0 +1,35 @@
+import struct
+
+# Checkpoints are compact binary snapshots of a state that is otherwise rebuilt by replaying a csv log.
+# Once a checkpoint is written its log is truncated, so startup only replays what was appended afterwards.
+# Replaying a log on top of a newer checkpoint is harmless, as every log line overwrites the entry it refers to.
+# Entries are either a single value or, for client sequences, a tuple of values.
+MAGIC = b"SDC1"
+SEQUENCES_MAGIC = b"SDC2"
+HEADER = struct.Struct("<4sqI")         # magic, head publication id, number of entries
+ENTRY = struct.Struct("<Hq")            # key length, value
+SEQUENCE_ENTRY = struct.Struct("<HqQq") # key length, highest sequence, bitmap of the sequences seen below it, last activity
+ENTRY_FORMATS = {MAGIC: ENTRY, SEQUENCES_MAGIC: SEQUENCE_ENTRY}
+
+def encode_checkpoint(entries, head_id=0, magic=MAGIC):
+    entry = ENTRY_FORMATS[magic]
+    data = bytearray(HEADER.pack(magic, head_id, len(entries)))
+    for key, value in entries.items():
+        key = key.encode()
+        data += entry.pack(len(key), *value) if isinstance(value, tuple) else entry.pack(len(key), value)
+        data += key
+    return bytes(data)
+
+def decode_checkpoint(data):
+    magic, head_id, n_entries = HEADER.unpack_from(data, 0)
+    if magic not in ENTRY_FORMATS:
+        raise ValueError("Invalid checkpoint format")
+
+    entry, entries, position = ENTRY_FORMATS[magic], {}, HEADER.size
+    for _ in range(n_entries):
+        key_length, *value = entry.unpack_from(data, position)
+        value = value[0] if len(value) == 1 else tuple(value)
+        position += entry.size
+        entries[data[position:position + key_length].decode()] = value
+        position += key_length
+    return entries, head_id
@@ -23,16 +23,6 @@ class ClientIO:
         except IOError:
             raise IOError("Failed to read client id")
 
-    def save_client_counter(client_dir, counter):
-        if not pathlib.Path(client_dir).exists():
-            pathlib.Path(client_dir).mkdir(parents=True)
-        
-        try: 
-            open(f"{client_dir}/counter.txt", "w").write(str(counter))
-        except IOError:
-            return IOError("Could not save client counter")
-        return True
-
     def read_client_counter(client_dir):
         path = f"{client_dir}/counter.txt"
         if not pathlib.Path(path).exists():
@@ -45,14 +35,6 @@ class ClientIO:
         except IOError:
             raise IOError("Could not read client counter")
 
-    def save_client_topics(client_dir, last_publications_read):
-        if not pathlib.Path(client_dir).exists():
-            pathlib.Path(client_dir).mkdir(parents=True)
-
-        result, error_str = FileIO.write_lines(f"{client_dir}/topics.csv", [f"{topic_id},{last_publication}" for topic_id, last_publication in last_publications_read.items()])
-        if not result:
-            raise IOError(error_str)
-
     def read_client_topics(client_dir):
         path = f"{client_dir}/topics.csv"
         if not pathlib.Path(path).exists():
@@ -64,9 +46,25 @@ class ClientIO:
         else:
             last_publications_read = {}
             for line in lines:
-                topic_id, last_publication = line.strip().split(",")
+                fields = line.strip().split(",")
                 try:
-                    last_publications_read[topic_id] = int(last_publication)
+                    if len(fields) == 2 and fields[1].startswith("group="):
+                        last_publications_read[fields[0]] = fields[1][len("group="):]
+                    elif len(fields) == 2:
+                        last_publications_read[fields[0]] = int(fields[1])
+                    else:
+                        cursors = last_publications_read.setdefault(fields[0], {})
+                        if len(fields) == 3:
+                            cursors[fields[1]] = int(fields[2])
                 except ValueError as e:
                     raise ValueError("Could not parse last publication read from a topic to integer type")
-            return last_publications_read
\ No newline at end of file
+            return last_publications_read
+
+    # A topic pattern takes one line with the pattern alone and one line per matching topic, a topic read as a member of
+    # a consumer group one line with the group
+    def topic_lines(topic_id, last_publication):
+        if isinstance(last_publication, str):
+            return f"{topic_id},group={last_publication}\n"
+        if isinstance(last_publication, dict):
+            return f"{topic_id}\n" + "".join(f"{topic_id},{pattern_topic},{cursor}\n" for pattern_topic, cursor in last_publication.items())
+        return f"{topic_id},{last_publication}\n"
@@ -0,0 +1,176 @@
+from .client_io import ClientIO
+from .file_io import FileIO
+import os
+import pathlib
+import threading
+import time
+
+FLUSH_POLICIES = ["always", "flush", "interval"]
+FLUSH_INTERVAL = 1000               # miliseconds
+JOURNAL_MAX_SIZE = 64 * 1024        # bytes
+SEQUENCE_BLOCK = 1000               # PUT sequences reserved at once
+
+# Every change to the client state is appended as one line to journal.log:
+#   cursor,TOPIC,LAST_PUBLICATION_ID
+#   pattern,PATTERN and pattern,PATTERN,TOPIC,LAST_PUBLICATION_ID for the cursor of each topic matching a pattern
+#   group,TOPIC,GROUP for a topic read as a member of a consumer group, which keeps the cursor on the server
+#   unsub,TOPIC
+#   counter,LAST_RESERVED_SEQUENCE
+# Once the journal reaches JOURNAL_MAX_SIZE the state is compacted into topics.csv and counter.txt, each replaced
+# atomically, and the journal is emptied. Replaying a journal over files that already include it gives the same state,
+# so a crash at any point of the compaction loses nothing.
+# With the "always" policy each line is fsynced, with "flush" it is handed to the OS, which survives the process being
+# killed, and with "interval" lines are buffered and handed to the OS at most every FLUSH_INTERVAL, by a timer when no
+# later change does it, so no line stays buffered for longer than FLUSH_INTERVAL.
+# PUT sequences are reserved in blocks, only the end of a block is journaled and always handed to the OS right away,
+# so a restarted client continues after every sequence it may have used whatever the policy.
+class ClientJournal:
+    def __init__(self, client_dir, flush_policy="flush", flush_interval=FLUSH_INTERVAL):
+        self.client_dir = client_dir
+        self.path = pathlib.Path(f"{client_dir}/journal.log")
+        self.flush_policy = flush_policy
+        self.flush_interval = flush_interval / 1000
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.size = 0                   # tracked instead of calling tell(), which flushes the buffered lines
+        self.lock = threading.RLock()   # the timer flushes from its own thread
+        self.timer = None
+
+    # Returns the client counter and the last publication read of each subscribed topic
+    def load(self):
+        counter = ClientIO.read_client_counter(self.client_dir)
+        last_publications_read = ClientIO.read_client_topics(self.client_dir)
+
+        result, data = FileIO.read_bytes(self.path) if self.path.exists() else (True, b"")
+        if not result:
+            raise IOError(data)
+
+        # A crash can leave the last line incomplete, it is ignored
+        for line in data.decode(errors="replace").split("\n")[:-1]:
+            try:
+                operation, value = line.split(",", 1)
+                if operation == "cursor":
+                    topic_id, last_publication = value.rsplit(",", 1)
+                    last_publications_read[topic_id] = int(last_publication)
+                elif operation == "pattern":
+                    pattern, *cursor = value.split(",")
+                    cursors = last_publications_read.setdefault(pattern, {})
+                    if cursor:
+                        cursors[cursor[0]] = int(cursor[1])
+                elif operation == "group":
+                    topic_id, group_id = value.rsplit(",", 1)
+                    last_publications_read[topic_id] = group_id
+                elif operation == "unsub":
+                    last_publications_read.pop(value, None)
+                elif operation == "counter":
+                    counter = int(value)
+            except ValueError:
+                continue
+
+        self.counter, self.last_publications_read = counter, last_publications_read
+        self.sequence = counter
+        self.open()
+        return counter, last_publications_read
+
+    def open(self):
+        pathlib.Path(self.client_dir).mkdir(parents=True, exist_ok=True)
+        try:
+            self.file = open(self.path, "a", buffering=1024 * 1024 if self.flush_policy == "interval" else -1)
+            self.size = self.path.stat().st_size
+        except IOError:
+            raise IOError("Could not open the client journal")
+
+    def save_cursor(self, topic_id, last_publication_id):
+        self.last_publications_read[topic_id] = last_publication_id
+        self.append(f"cursor,{topic_id},{last_publication_id}")
+
+    # Only the cursors that moved are journaled
+    def save_cursors(self, pattern, cursors):
+        if pattern not in self.last_publications_read:
+            self.last_publications_read[pattern] = {}
+            self.append(f"pattern,{pattern}")
+        known = self.last_publications_read[pattern]
+        for topic_id, last_publication_id in cursors.items():
+            if known.get(topic_id) != last_publication_id:
+                known[topic_id] = last_publication_id
+                self.append(f"pattern,{pattern},{topic_id},{last_publication_id}")
+
+    def save_group(self, topic_id, group_id):
+        self.last_publications_read[topic_id] = group_id
+        self.append(f"group,{topic_id},{group_id}")
+
+    def remove_topic(self, topic_id):
+        self.last_publications_read.pop(topic_id, None)
+        self.append(f"unsub,{topic_id}")
+
+    def next_sequence(self):
+        self.sequence += 1
+        if self.sequence > self.counter:
+            self.save_counter(self.sequence + SEQUENCE_BLOCK - 1)
+        return self.sequence
+
+    def save_counter(self, counter):
+        self.counter = counter
+        self.append(f"counter,{counter}")
+        self.flush(force=True)
+
+    def append(self, line):
+        try:
+            with self.lock:
+                self.file.write(f"{line}\n")
+                self.size += len(line.encode()) + 1
+                self.flush()
+                if self.size >= JOURNAL_MAX_SIZE:
+                    self.compact()
+        except IOError:
+            raise IOError("Could not write to the client journal")
+
+    def flush(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if self.flush_policy == "interval" and not force and now - self.last_flush < self.flush_interval:
+                self.schedule_flush(self.last_flush + self.flush_interval - now)
+                return
+            self.file.flush()
+            if self.flush_policy == "always":
+                os.fsync(self.file.fileno())
+            self.last_flush = now
+
+    def schedule_flush(self, delay):
+        if self.timer == None:
+            self.timer = threading.Timer(delay, self.flush_buffered)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_buffered(self):
+        with self.lock:
+            self.timer = None
+            if self.file != None and not self.file.closed:
+                try:
+                    self.flush(force=True)
+                except IOError:
+                    pass    # the next change writes the buffered lines again
+
+    def compact(self):
+        self.flush(force=True)
+        if self.flush_policy != "always":
+            os.fsync(self.file.fileno())
+
+        topics = "".join(ClientIO.topic_lines(topic_id, last_publication) for topic_id, last_publication in self.last_publications_read.items())
+        for file_name, data in [("topics.csv", topics), ("counter.txt", str(self.counter))]:
+            result, error_str = FileIO.write_atomic(f"{self.client_dir}/{file_name}", data.encode())
+            if not result:
+                raise IOError(error_str)
+
+        self.file.truncate(0)
+        self.file.seek(0)
+        self.size = 0
+
+    def close(self):
+        with self.lock:
+            if self.timer != None:
+                self.timer.cancel()
+                self.timer = None
+            if self.file != None and not self.file.closed:
+                self.flush(force=True)
+                self.file.close()
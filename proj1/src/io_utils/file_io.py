@@ -1,4 +1,17 @@
+from .group_commit import GroupCommitter
+import os
+import pathlib
+import shutil
+
+committer = None
+
 class FileIO:
+    # Once started, appends are queued and written by the group commit thread instead of opening the file on every call
+    def start_group_commit(mode, interval, replicator=None):
+        global committer
+        committer = GroupCommitter(mode, interval, replicator)
+        committer.start()
+
     def read_lines(file_path):
         lines = []
         try:
@@ -10,6 +23,8 @@ class FileIO:
         return True, lines
     
     def write_lines(file_path, lines):
+        if committer:
+            committer.flush()
         try: 
             with open(file_path, "w") as f:
                 for line in lines: 
@@ -18,11 +33,86 @@ class FileIO:
             return False, f"IO error when writing lines to file with file_path '{file_path}'"
         return True, ""
 
+    # The file is either fully replaced or left untouched, even if the process crashes while writing it
+    def write_atomic(file_path, data):
+        tmp_path = f"{file_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except IOError:
+            return False, f"IO error when writing file with file_path '{file_path}'"
+        FileIO.record("write", file_path, data)
+        return True, ""
+
+    def truncate(file_path, size=0):
+        FileIO.close(file_path)
+        try:
+            os.truncate(file_path, size)
+        except IOError:
+            return False, f"IO error when truncating file with file_path '{file_path}'"
+        FileIO.record("truncate", file_path, str(size).encode())
+        return True, ""
+
+    def touch(file_path):
+        pathlib.Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        pathlib.Path(file_path).touch(exist_ok=True)
+        FileIO.record("touch", file_path)
+
+    # Removes a file or a whole directory, open files must be closed with FileIO.close first
+    def remove(path):
+        path = pathlib.Path(path)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+        FileIO.record("remove", path)
+
+    # Operations done directly on the files are queued after the appends made before them, so a replica applies both in order
+    def record(operation, file_path, data=b""):
+        if committer:
+            committer.record(operation, file_path, data)
+
+    def read_bytes(file_path):
+        try:
+            return True, open(file_path, "rb").read()
+        except FileNotFoundError:
+            return False, f"file with file_path '{file_path}' not found"
+        except IOError:
+            return False, f"IO error when reading file with file_path '{file_path}'"
+
     def append_line(file_path, line):
+        return FileIO.append_bytes(file_path, f"{line}\n".encode())
+
+    # Queued appends always succeed here, a group that cannot be written stops the server (see GroupCommitter)
+    def append_bytes(file_path, data):
+        if committer:
+            committer.append(file_path, data)
+            return True, ""
         try: 
-            open(file_path, "a").write(f"{line}\n")
+            with open(file_path, "ab") as f:
+                f.write(data)
         except FileNotFoundError:
             return False, f"file with file_path '{file_path}' not found"
         except IOError:
-            return False, f"IO error when appending line to file with file_path '{file_path}'"
-        return True, ""
\ No newline at end of file
+            return False, f"IO error when appending to file with file_path '{file_path}'"
+        return True, ""
+
+    # Waits for pending appends to the file before closing it, so it can be safely deleted
+    def close(file_path):
+        if committer:
+            committer.close(file_path)
+            committer.flush()
+
+    def flush():
+        if committer:
+            return committer.flush()
+        return True
+
+    def after_flush(callback):
+        if committer:
+            committer.after_flush(callback)
+        else:
+            callback(True)
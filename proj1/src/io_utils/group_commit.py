@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+DURABILITY_MODES = ["always", "interval", "os"]
+MAX_OPEN_FILES = 256
+
+# Appends from every thread are coalesced and written by a single thread, one write (and fsync) per file and per group.
+# Durability modes:
+#   always   -> every group is fsynced as soon as it is written
+#   interval -> appends are grouped during `interval` miliseconds and then written and fsynced
+#   os       -> groups are written to the OS buffers without fsync
+# With a replicator, every group is also sent to the backup, together with the operations done directly on the files
+# since the previous group, before the callbacks waiting for it are called.
+# Appends are applied to the in-memory state of the server before they reach the disk, so when a group cannot be
+# written the process stops without calling its callbacks: no reply built on that state is released, and a restart
+# recovers the state from what is on disk.
+class GroupCommitter(threading.Thread):
+    def __init__(self, mode="always", interval=5, replicator=None):
+        super().__init__(name="group-commit", daemon=True)
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Invalid durability mode '{mode}'")
+        self.mode = mode
+        self.interval = interval / 1000
+        self.replicator = replicator
+        self.handles = OrderedDict()
+        self.condition = threading.Condition()
+        self.pending = []
+        self.callbacks = []
+        self.in_flight = False
+
+    def append(self, file_path, data):
+        with self.condition:
+            self.pending.append(("append", str(file_path), data))
+            self.condition.notify()
+
+    def close(self, file_path):
+        with self.condition:
+            self.pending.append(("close", str(file_path), None))
+            self.condition.notify()
+
+    # Operations already done on the files by the caller, only kept in order for the replicator
+    def record(self, operation, file_path, data):
+        if self.replicator is None:
+            return
+        with self.condition:
+            self.pending.append((operation, str(file_path), data))
+            self.condition.notify()
+
+    # callback(success) is called once every append made before it was registered reached the disk
+    def after_flush(self, callback):
+        with self.condition:
+            if not self.pending and not self.in_flight:
+                callback(True)
+                return
+            self.callbacks.append(callback)
+            self.condition.notify()
+
+    def flush(self):
+        flushed = threading.Event()
+        results = []
+        self.after_flush(lambda success: (results.append(success), flushed.set()))
+        flushed.wait()
+        return results[0]
+
+    def run(self):
+        while True:
+            # The replicator sends heartbeats while there is nothing to commit
+            with self.condition:
+                while not self.pending and not self.callbacks:
+                    if not self.condition.wait(self.replicator.heartbeat_interval if self.replicator else None):
+                        break
+                # Appends notify the condition, only the end of the interval closes the group
+                if self.mode == "interval":
+                    deadline, remaining = time.monotonic() + self.interval, self.interval
+                    while remaining > 0:
+                        self.condition.wait(remaining)
+                        remaining = deadline - time.monotonic()
+                pending, callbacks = self.pending, self.callbacks
+                self.pending, self.callbacks = [], []
+                self.in_flight = True
+
+            if not self.commit(pending):
+                logging.critical("Stopping, the server state no longer matches its files")
+                os._exit(1)
+            for callback in callbacks:
+                callback(True)
+
+            with self.condition:
+                self.in_flight = False
+
+    def commit(self, pending):
+        started = time.perf_counter()
+        groups = OrderedDict()
+        if self.replicator:
+            self.replicator.sync()
+        try:
+            for operation, file_path, data in pending:
+                if operation == "close":
+                    self.write(groups)
+                    groups.clear()
+                    self.close_handle(file_path)
+                elif operation == "append":
+                    groups.setdefault(file_path, []).append(data)
+            self.write(groups)
+        except OSError as e:
+            logging.error(f"Group commit of {len(pending)} appends failed: {e}")
+            return False
+        # A backup out of sync is not waited for, the replies are released without it (see Replicator)
+        if self.replicator:
+            self.replicator.replicate(pending)
+        logging.debug(f"Committed {len(pending)} appends in {(time.perf_counter() - started) * 1000:.2f}ms")
+        return True
+
+    def write(self, groups):
+        for file_path, chunks in groups.items():
+            handle = self.handle(file_path)
+            handle.write(b"".join(chunks))
+            handle.flush()
+            if self.mode != "os":
+                os.fsync(handle.fileno())
+
+    def handle(self, file_path):
+        if file_path in self.handles:
+            self.handles.move_to_end(file_path)
+        else:
+            self.handles[file_path] = open(file_path, "ab")
+            if len(self.handles) > MAX_OPEN_FILES:
+                self.close_handle(next(iter(self.handles)))
+        return self.handles[file_path]
+
+    def close_handle(self, file_path):
+        handle = self.handles.pop(file_path, None)
+        if handle:
+            try:
+                handle.close()
+            except OSError:
+                pass
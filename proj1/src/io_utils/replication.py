@@ -0,0 +1,232 @@
+from .file_io import FileIO
+import logging
+import os
+import pathlib
+import shutil
+import time
+import zmq
+
+HEARTBEAT_INTERVAL = 0.1    # seconds
+HEARTBEAT_TIMEOUT = 1       # seconds without news from the primary before the backup takes over
+ACK_TIMEOUT = 1             # seconds the primary waits for the backup to apply a group before it falls out of sync
+
+# Replication messages, between the ROUTER of the primary and the DEALER of the backup:
+#   backup  -> primary: SYNC, asks for a snapshot
+#   primary -> backup:  OPS, SEQUENCE, then (OPERATION, PATH, DATA) frames for each operation
+#   backup  -> primary: ACK, SEQUENCE once the operations of the group are on disk
+#   primary -> backup:  HEARTBEAT, SEQUENCE of the last group sent
+# Paths are relative to the data directory. A snapshot is a group starting with a reset operation followed by a write
+# of every file. The backup asks for a new snapshot when it notices a missing sequence number.
+
+def encode_sequence(sequence):
+    return sequence.to_bytes(8, "big")
+
+def decode_sequence(data):
+    return int.from_bytes(data, "big")
+
+# Runs on the group commit thread: the backup receives every group before the replies waiting for it are released.
+# Without a backup the primary keeps serving on its own. With an ack timeout, a backup that does not acknowledge a group
+# in time falls out of sync: it is still sent every group but replies no longer wait for it, so publications
+# acknowledged meanwhile can be missing from it at failover, trading durability for availability. Once it acknowledges
+# groups again, the primary waits for it to apply every group sent before sending the next one and it is back in sync.
+# Without an ack timeout (0) replies always wait for a connected backup, and the primary stalls while the backup does.
+class Replicator:
+    def __init__(self, endpoint, server_dir, ack_timeout=ACK_TIMEOUT):
+        self.endpoint = endpoint
+        self.server_dir = server_dir
+        self.ack_timeout = ack_timeout
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.socket = None
+        self.backup = None
+        self.needs_snapshot = False
+        self.in_sync = False
+        self.sequence = 0           # last group sent
+        self.acked = 0              # last group the backup acknowledged
+        self.acked_at_timeout = 0   # last group acknowledged when the backup fell out of sync
+        self.last_sent = 0
+
+    def bind(self):
+        self.socket = zmq.Context.instance().socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.socket.bind(self.endpoint)
+        logging.info(f"Replicating to backups connecting to {self.endpoint}")
+
+    # Called before a group is written, so the snapshot holds exactly the groups replicated before it
+    def sync(self):
+        if self.socket is None:
+            self.bind()
+        while self.socket.poll(0):
+            self.receive()
+        if self.needs_snapshot:
+            self.needs_snapshot = False
+            self.send_snapshot()
+
+    def receive(self):
+        frames = self.socket.recv_multipart()
+        if frames[1] == b"SYNC":
+            logging.info("Backup connected, sending snapshot")
+            self.backup = frames[0]
+            self.needs_snapshot = True
+            return None
+        if frames[1] == b"ACK" and frames[0] == self.backup:
+            sequence = decode_sequence(frames[2])
+            self.acked = max(self.acked, sequence)
+            return sequence
+        return None
+
+    # Groups sent to the backup that it did not acknowledge yet
+    def lag(self):
+        return self.sequence - self.acked if self.backup else None
+
+    def stats(self):
+        return {"backup": self.backup != None, "in_sync": self.in_sync, "sequence": self.sequence, "acked": self.acked, "lag": self.lag()}
+
+    def send_snapshot(self):
+        frames = [b"reset", b"", b""]
+        for path in sorted(pathlib.Path(self.server_dir).rglob("*")):
+            if path.is_dir() or path.suffix == ".tmp":
+                continue
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            frames += [b"write", self.relative(path), data]
+        self.in_sync = True
+        self.send(frames)
+
+    def replicate(self, pending):
+        if self.backup is None:
+            return True
+
+        frames = []
+        for operation, file_path, data in pending:
+            if operation != "close":
+                frames += [operation.encode(), self.relative(file_path), data or b""]
+        if frames:
+            return self.send(frames)
+        if time.monotonic() - self.last_sent >= self.heartbeat_interval:
+            self.forward([b"HEARTBEAT", encode_sequence(self.sequence)])
+        return True
+
+    # A backup that disconnected is forgotten until it asks for a snapshot again
+    def forward(self, frames):
+        try:
+            self.socket.send_multipart([self.backup] + frames)
+        except zmq.ZMQError:
+            logging.error("Backup disconnected, replicating again once it reconnects")
+            self.backup, self.in_sync = None, False
+            return False
+        self.last_sent = time.monotonic()
+        return True
+
+    def send(self, frames):
+        if not self.in_sync and self.acked > self.acked_at_timeout:
+            self.catch_up()
+        self.sequence += 1
+        if not self.forward([b"OPS", encode_sequence(self.sequence)] + frames):
+            return False
+        if not self.in_sync:
+            return False
+        if self.wait_ack(self.sequence):
+            return True
+        if self.backup != None and not self.needs_snapshot:
+            logging.warning(f"Backup did not acknowledge group {self.sequence} in {self.ack_timeout}s, replies no longer wait for it")
+            self.in_sync, self.acked_at_timeout = False, self.acked
+        return False
+
+    # The backup acknowledges groups again, it is waited for until it applied every group sent
+    def catch_up(self):
+        if self.wait_ack(self.sequence):
+            logging.info(f"Backup caught up at group {self.sequence}")
+            self.in_sync = True
+        else:
+            self.acked_at_timeout = self.acked
+
+    # Without an ack timeout, heartbeats are sent while waiting so a backup that disconnected is noticed
+    def wait_ack(self, sequence):
+        deadline = time.monotonic() + self.ack_timeout if self.ack_timeout else None
+        while self.acked < sequence:
+            timeout = self.heartbeat_interval if deadline == None else deadline - time.monotonic()
+            if timeout <= 0:
+                return False
+            if self.socket.poll(timeout * 1000):
+                self.receive()
+                if self.needs_snapshot:
+                    return False
+            elif deadline == None and not self.forward([b"HEARTBEAT", encode_sequence(self.sequence)]):
+                return False
+        return True
+
+    def relative(self, file_path):
+        return os.path.relpath(file_path, self.server_dir).encode()
+
+# Keeps a copy of the data directory of the primary until its heartbeats stop
+class Backup:
+    def __init__(self, primary_endpoint, server_dir, durability="always"):
+        self.primary_endpoint = primary_endpoint
+        self.server_dir = pathlib.Path(server_dir)
+        self.durability = durability
+        self.applied = None
+
+    # Returns once the primary is considered dead, after at least one snapshot was received
+    def run(self):
+        socket = zmq.Context.instance().socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self.primary_endpoint)
+        logging.info(f"Backing up {self.primary_endpoint}")
+
+        last_heard, last_sync = time.monotonic(), 0
+        while True:
+            if self.applied is None and time.monotonic() - last_sync >= HEARTBEAT_TIMEOUT:
+                socket.send_multipart([b"SYNC"])
+                last_sync = time.monotonic()
+
+            if socket.poll(HEARTBEAT_INTERVAL * 1000):
+                frames = socket.recv_multipart()
+                last_heard = time.monotonic()
+                sequence = decode_sequence(frames[1])
+                if frames[0] == b"OPS" and (frames[2] == b"reset" or self.applied is not None and sequence == self.applied + 1):
+                    self.apply(frames[2:])
+                    self.applied = sequence
+                    socket.send_multipart([b"ACK", frames[1]])
+                elif self.applied is not None and sequence != self.applied:
+                    logging.warning(f"Missed replication groups {self.applied + 1} to {sequence}, asking for a snapshot")
+                    self.applied, last_sync = None, 0
+            elif time.monotonic() - last_heard >= HEARTBEAT_TIMEOUT and self.applied is not None:
+                logging.error(f"No heartbeat from {self.primary_endpoint} in {HEARTBEAT_TIMEOUT}s, taking over")
+                socket.close()
+                return
+
+    def apply(self, frames):
+        appended = {}
+        try:
+            for i in range(0, len(frames), 3):
+                operation, path, data = frames[i].decode(), self.server_dir / frames[i + 1].decode(), frames[i + 2]
+                if operation == "reset":
+                    shutil.rmtree(self.server_dir, ignore_errors=True)
+                    self.server_dir.mkdir(parents=True, exist_ok=True)
+                    continue
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if operation == "append":
+                    if path not in appended:
+                        appended[path] = open(path, "ab")
+                    appended[path].write(data)
+                    continue
+                if path in appended:
+                    appended.pop(path).close()
+                if operation == "write":
+                    FileIO.write_atomic(path, data)
+                elif operation == "truncate":
+                    path.touch(exist_ok=True)
+                    os.truncate(path, int(data))
+                elif operation == "touch":
+                    path.touch(exist_ok=True)
+                elif operation == "remove":
+                    FileIO.remove(path)
+        finally:
+            for handle in appended.values():
+                handle.flush()
+                if self.durability != "os":
+                    os.fsync(handle.fileno())
+                handle.close()
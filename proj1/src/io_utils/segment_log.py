@@ -0,0 +1,209 @@
+from .file_io import FileIO
+import bisect
+import mmap
+import pathlib
+import struct
+import time
+
+SEGMENT_SIZE = 1024 * 1024      # bytes
+INDEX_INTERVAL = 4096           # bytes of records between two index entries
+
+RECORD_HEADER = struct.Struct("<QI")     # publication id, payload length with COMPRESSED_FLAG set for compressed payloads
+COMPRESSED_FLAG = 1 << 31
+INDEX_ENTRY = struct.Struct("<QQ")       # publication id, byte offset in the segment
+
+# Publications of a topic are stored in fixed-size segment files named after the id of their first publication.
+# Each segment has a sparse index file mapping some publication ids to their byte offset inside the segment.
+class SegmentLog:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.bases = sorted(int(segment.stem) for segment in self.path.glob("*.log"))
+        self.indexes = {}
+        self.sizes = {}             # sealed segments never change, so their size is only read once
+        self.sealed_bytes = 0       # sum of self.sizes
+        self.head_id = 0
+        self.active_size = 0
+        self.last_indexed = 0
+        if self.bases:
+            self.recover()
+            for base in self.bases[:-1]:
+                self.seal(base, self.read_size(base))
+
+    def segment_path(self, base):
+        return self.path / f"{base:020d}.log"
+
+    def index_path(self, base):
+        return self.path / f"{base:020d}.index"
+
+    # Indexes of sealed segments never change, so they are only read once
+    def read_index(self, base):
+        if base in self.indexes:
+            return self.indexes[base]
+        try:
+            data = open(self.index_path(base), "rb").read()
+        except FileNotFoundError:
+            return []
+        index = [INDEX_ENTRY.unpack_from(data, i) for i in range(0, len(data) - len(data) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+        if base != self.bases[-1]:
+            self.indexes[base] = index
+        return index
+
+    # Segments are mapped on every read, up to their current size, and not kept mapped since each mapping holds a file
+    # descriptor. A mapping stays valid while any slice of it is in use, even after its segment is dropped.
+    def map_segment(self, base):
+        try:
+            with open(self.segment_path(base), "rb") as f:
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, ValueError):    # mapping an empty file is a ValueError
+            return None
+
+    # Only the index and the active segment are read, every other segment ends right before the next one starts
+    def recover(self):
+        base = self.bases[-1]
+        size = self.segment_path(base).stat().st_size
+        index = [entry for entry in self.read_index(base) if entry[1] < size]
+        self.head_id, offset = (index[-1][0] - 1, index[-1][1]) if index else (base - 1, 0)
+
+        with open(self.segment_path(base), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            pub_id, length = RECORD_HEADER.unpack_from(data, position)
+            length &= ~COMPRESSED_FLAG
+            if position + RECORD_HEADER.size + length > len(data):
+                break
+            self.head_id = pub_id
+            position += RECORD_HEADER.size + length
+
+        # Discard a record that was only partially written before a crash, and the index entries from its offset on, so the
+        # entries written for the new records follow the ones kept
+        self.active_size = offset + position
+        if position < len(data):
+            result, error_str = FileIO.truncate(self.segment_path(base), self.active_size)
+            if not result:
+                raise IOError(error_str)
+        index = [entry for entry in index if entry[1] < self.active_size]
+        self.last_indexed = index[-1][1] if index else 0
+        index_path = self.index_path(base)
+        if index_path.exists() and index_path.stat().st_size > len(index) * INDEX_ENTRY.size:
+            result, error_str = FileIO.truncate(index_path, len(index) * INDEX_ENTRY.size)
+            if not result:
+                raise IOError(error_str)
+
+    @property
+    def first_id(self):
+        return self.bases[0] if self.bases else self.head_id + 1
+
+    # Publications are (publication id, payload, compressed) triples
+    def append(self, publications):
+        if not publications:
+            return
+        if not self.bases or self.active_size >= SEGMENT_SIZE:
+            if self.bases:
+                self.seal(self.bases[-1], self.active_size)
+            self.bases.append(publications[0][0])
+            self.active_size = 0
+            self.last_indexed = 0
+
+        base = self.bases[-1]
+        records, index = bytearray(), bytearray()
+        for pub_id, payload, compressed in publications:
+            offset = self.active_size + len(records)
+            if offset == 0 or offset - self.last_indexed >= INDEX_INTERVAL:
+                index += INDEX_ENTRY.pack(pub_id, offset)
+                self.last_indexed = offset
+            records += RECORD_HEADER.pack(pub_id, len(payload) | (COMPRESSED_FLAG if compressed else 0))
+            records += payload
+
+        result, error_str = FileIO.append_bytes(self.segment_path(base), records)
+        if result and index:
+            result, error_str = FileIO.append_bytes(self.index_path(base), index)
+        if not result:
+            raise IOError(error_str)
+        self.active_size += len(records)
+        self.head_id = publications[-1][0]
+
+    # Yields every (publication id, payload, compressed) with an id greater than last_publication_id, the first one is found with
+    # a binary search over the segments and then over the sparse index of its segment. Payloads are memoryviews of the mapped
+    # segment, so only the records actually consumed are paged in and none is copied.
+    def read(self, last_publication_id):
+        first_segment = max(bisect.bisect_right(self.bases, last_publication_id + 1) - 1, 0)
+        for base in self.bases[first_segment:]:
+            index = self.read_index(base)
+            entry = bisect.bisect_right(index, (last_publication_id + 1, float("inf"))) - 1
+            position = index[entry][1] if entry >= 0 else 0
+
+            data = self.map_segment(base)
+            if data is None:
+                continue
+
+            while position + RECORD_HEADER.size <= len(data):
+                pub_id, length = RECORD_HEADER.unpack_from(data, position)
+                compressed, length = bool(length & COMPRESSED_FLAG), length & ~COMPRESSED_FLAG
+                position += RECORD_HEADER.size
+                if position + length > len(data):
+                    break
+                if pub_id > last_publication_id:
+                    yield pub_id, data[position:position + length], compressed
+                position += length
+
+    def read_size(self, base):
+        try:
+            return self.segment_path(base).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def seal(self, base, size):
+        self.sizes[base] = size
+        self.sealed_bytes += size
+
+    # Highest publication id the retention limits allow to drop, so only whole segments go: the oldest ones until the
+    # rest holds at most max_bytes and max_count publications, and those last appended to more than max_age seconds ago.
+    # The active segment is always kept. Runs on every PUT, so the segments are walked from the oldest one and only
+    # those dropped are visited.
+    def retention_limit(self, max_bytes=None, max_age=None, max_count=None):
+        limit = self.head_id - max_count if max_count != None else 0
+        kept_bytes = self.sealed_bytes + self.active_size
+        now = time.time()
+        for i in range(len(self.bases) - 1):
+            base = self.bases[i]
+            if not ((max_bytes != None and kept_bytes > max_bytes) or (max_age != None and now - self.last_modified(base) > max_age)):
+                break
+            kept_bytes -= self.sizes[base]
+            limit = max(limit, self.bases[i + 1] - 1)
+        return limit
+
+    def last_modified(self, base):
+        try:
+            return self.segment_path(base).stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    # Removes whole segments whose publications all have an id lower or equal to last_publication_id
+    def drop_until(self, last_publication_id):
+        reclaimed = 0
+        while len(self.bases) > 1 and self.bases[1] - 1 <= last_publication_id:
+            base = self.bases.pop(0)
+            self.indexes.pop(base, None)
+            self.sealed_bytes -= self.sizes.pop(base, 0)
+            for path in (self.segment_path(base), self.index_path(base)):
+                FileIO.close(path)
+                if path.exists():
+                    reclaimed += path.stat().st_size
+                    FileIO.remove(path)
+        return reclaimed
+
+    def close(self):
+        for base in self.bases:
+            FileIO.close(self.segment_path(base))
+            FileIO.close(self.index_path(base))
+
+    # Only uses what is kept in memory, so it can be called from any thread
+    def stored_bytes(self):
+        return self.sealed_bytes + self.active_size
+
+    def size(self):
+        return sum(segment.stat().st_size for segment in self.path.glob("*.log"))
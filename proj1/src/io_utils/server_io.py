@@ -1,87 +1,187 @@
 from .file_io import FileIO
+from .segment_log import SegmentLog
+from .checkpoint import *
+from communication.compression import to_payload, from_payload
 import pathlib
-import shutil
-from collections import OrderedDict
 import os
+import struct
 
 SERVER_DIR = "./src/server_data"
 TOPICS_DIR = SERVER_DIR + "/topics"
 
+topic_logs = {}
+client_counters_log_number = 0
+
 class ServerIO:
 
+    # Must be called before any other ServerIO function, each shard of a cluster keeps its data in its own directory
+    def set_server_dir(server_dir):
+        global SERVER_DIR, TOPICS_DIR
+        SERVER_DIR = server_dir
+        TOPICS_DIR = SERVER_DIR + "/topics"
+
     def create_server_dir():
         pathlib.Path(TOPICS_DIR).mkdir(parents=True, exist_ok=True)
-        pathlib.Path(f"{SERVER_DIR}/client_counters.csv").touch(exist_ok=True)
+        FileIO.touch(f"{SERVER_DIR}/client_counters.csv")
+        FileIO.touch(f"{SERVER_DIR}/patterns.csv")
+
+    # ============================= CHECKPOINTS =============================
+
+    def read_checkpoint(path):
+        if not pathlib.Path(path).exists():
+            return {}, 0
+
+        result, data = FileIO.read_bytes(path)
+        if not result:
+            raise IOError(data)
+        try:
+            return decode_checkpoint(data)
+        except (ValueError, struct.error, UnicodeDecodeError):
+            raise IOError(f"Invalid checkpoint '{path}'")
+
+    # The log is only truncated after its checkpoint is safely on disk
+    def write_checkpoint(path, log_path, entries, head_id=0, magic=MAGIC):
+        result, error_str = FileIO.write_atomic(path, encode_checkpoint(entries, head_id, magic))
+        if result:
+            result, error_str = FileIO.truncate(log_path)
+        if not result:
+            print(f"Error when writing checkpoint '{path}': {error_str}")
+        return result
 
     # ============================= TOPICS =============================
 
     def create_topic_dir(topic_id):
-        topic_path = f"{TOPICS_DIR}/{topic_id}"
-        pathlib.Path(topic_path).mkdir(parents=True, exist_ok=True)
-        pathlib.Path(f"{topic_path}/publications.csv").touch(exist_ok=True)
-        pathlib.Path(f"{topic_path}/subscribers.csv").touch(exist_ok=True)
+        FileIO.touch(f"{TOPICS_DIR}/{topic_id}/subscribers.csv")
 
     def delete_topic_dir(topic_id):
-        shutil.rmtree(pathlib.Path(f"{TOPICS_DIR}/{topic_id}"))
+        log = topic_logs.pop(topic_id, None)
+        if log:
+            log.close()
+        FileIO.close(f"{TOPICS_DIR}/{topic_id}/subscribers.csv")
+        FileIO.close(f"{TOPICS_DIR}/{topic_id}/groups.csv")
+        FileIO.remove(f"{TOPICS_DIR}/{topic_id}")
 
     # ============================= PUBLICATIONS =============================
 
-    def read_publications(topic_id):
-        result, lines = FileIO.read_lines(f"{TOPICS_DIR}/{topic_id}/publications.csv")
+    def topic_log(topic_id):
+        if topic_id not in topic_logs:
+            log = SegmentLog(f"{TOPICS_DIR}/{topic_id}/log")
+            ServerIO.import_legacy_publications(topic_id, log)
+            topic_logs[topic_id] = log
+        return topic_logs[topic_id]
+
+    # Moves publications stored by older versions in a single publications.csv file into the segmented log
+    def import_legacy_publications(topic_id, log):
+        path = pathlib.Path(f"{TOPICS_DIR}/{topic_id}/publications.csv")
+        if not path.exists():
+            return
+
+        result, lines = FileIO.read_lines(path)
         if not result:
-            print(f"Error when reading topic '{topic_id}': {lines}")
-            return None
-        
-        topic_publications = OrderedDict()
+            raise IOError(lines)
+
+        publications = []
         for line in lines:
             topic_line = line.split(',')
             pub_id, publication = topic_line[0], ",".join(topic_line[1:])
             try:
-                topic_publications[int(pub_id)] = publication
+                pub_id = int(pub_id)
             except ValueError:
-                print(f"Invalid message ID format (not int)")
-                return None
-        return topic_publications
+                raise IOError("Invalid message ID format (not int)")
+            if pub_id > log.head_id:
+                publications.append((pub_id, publication.encode(), False))
+        log.append(publications)
+        FileIO.remove(path)
+
+    # Yields the (id, publication) pairs with an id greater than last_publication_id, raises IOError if the log is unreadable
+    # Compressed publications are returned as bytes, the others as str
+    def read_publications(topic_id, last_publication_id=0):
+        try:
+            for pub_id, payload, compressed in ServerIO.topic_log(topic_id).read(last_publication_id):
+                yield pub_id, from_payload(payload, compressed)
+        except (IOError, UnicodeDecodeError) as e:
+            print(f"Error when reading topic '{topic_id}': {e}")
+            raise IOError(f"Unable to read publications of topic '{topic_id}'")
+
+    # Same as read_publications, as (id, payload, compressed) with the payloads left in the mapped log
+    def read_payloads(topic_id, last_publication_id=0):
+        try:
+            yield from ServerIO.topic_log(topic_id).read(last_publication_id)
+        except IOError as e:
+            print(f"Error when reading topic '{topic_id}': {e}")
+            raise IOError(f"Unable to read publications of topic '{topic_id}'")
+
+    def head_id(topic_id):
+        return ServerIO.topic_log(topic_id).head_id
 
-    def read_all_publications():
+    # Only the index and active segment of each topic are read
+    def read_all_head_ids():
         if not pathlib.Path(TOPICS_DIR).exists():
             return {}
 
-        publications = {}
+        head_ids = {}
         for topic in os.listdir(TOPICS_DIR):
-            topic_publications = ServerIO.read_publications(topic)
-            if topic_publications == None:
+            try:
+                head_ids[topic] = ServerIO.head_id(topic)
+            except IOError as e:
+                print(f"Error when opening topic '{topic}': {e}")
                 return None
-            publications[topic] = topic_publications
-        return publications
+        return head_ids
 
-    def save_publication(topic_id, pub_id, publication):
-        result, error_str = FileIO.append_line(f"{TOPICS_DIR}/{topic_id}/publications.csv", f"{pub_id},{publication}")
-        if not result:
-            print(f"Error when appending publication '{pub_id}' to topic '{topic_id}': {error_str}")
-        return result
+    def save_publications(topic_id, publications):
+        try:
+            ServerIO.topic_log(topic_id).append([(pub_id, *to_payload(publication)) for pub_id, publication in publications])
+        except IOError as e:
+            print(f"Error when appending {len(publications)} publications to topic '{topic_id}': {e}")
+            return False
+        return True
 
-    # Garbage collection
+    # Garbage collection, only whole segments that every subscriber has read are deleted
     def clean_publications(topic_id, last_publication_received):
-        publications = ServerIO.read_publications(topic_id)
-        if publications == None:
+        try:
+            return ServerIO.topic_log(topic_id).drop_until(last_publication_received)
+        except IOError as e:
+            print(f"Error when cleaning publications of topic '{topic_id}': {e}")
             return None
-        
-        result, error_str = FileIO.write_lines(f"{TOPICS_DIR}/{topic_id}/publications.csv", [f"{pub_id},{publication}" for pub_id, publication in publications.items() if pub_id > last_publication_received])
-        if not result:
-            print(f"Error when writing publications of topic '{topic_id}': {error_str}")
+
+    # Drops the segments beyond the retention limits of the topic, read or not, returns the bytes reclaimed
+    def apply_retention(topic_id, max_bytes=None, max_age=None, max_count=None):
+        try:
+            log = ServerIO.topic_log(topic_id)
+            return log.drop_until(log.retention_limit(max_bytes, max_age, max_count))
+        except (IOError, OSError) as e:
+            print(f"Error when applying the retention of topic '{topic_id}': {e}")
             return None
-        return publications
+
+    # Lowest publication id still kept by the topic
+    def first_id(topic_id):
+        return ServerIO.topic_log(topic_id).first_id
+
+    # Metrics of a topic whose log was opened by its worker, None otherwise. Neither opens a log nor touches the files.
+    def loaded_first_id(topic_id):
+        log = topic_logs.get(topic_id)
+        return log.first_id if log else None
+
+    def loaded_log_bytes(topic_id):
+        log = topic_logs.get(topic_id)
+        return log.stored_bytes() if log else None
 
     # ============================= SUBSCRIBERS =============================
     
     def read_subscribers(topic_id):
+        try:
+            subscribers, head_id = ServerIO.read_checkpoint(f"{TOPICS_DIR}/{topic_id}/subscribers.bin")
+            if ServerIO.topic_log(topic_id).head_id < head_id:
+                print(f"Warning when reading topic '{topic_id}': publications up to {head_id} were checkpointed but the log ends at {ServerIO.topic_log(topic_id).head_id}")
+        except IOError as e:
+            print(f"Error when reading subscribers checkpoint from topic '{topic_id}': {e}")
+            return None
+
         result, lines = FileIO.read_lines(f"{TOPICS_DIR}/{topic_id}/subscribers.csv")
         if not result:
             print(f"Error when reading subscribers from topic '{topic_id}': {lines}")
             return None
 
-        subscribers = {}
         for line in lines:
             subscriber_line = line.split(",")
             try:
@@ -115,9 +215,10 @@ class ServerIO:
 
         subscribers = {}
         for topic in os.listdir(TOPICS_DIR):
-            topic_subscribers = ServerIO.clean_subscribers(topic)
+            topic_subscribers = ServerIO.read_subscribers(topic)
             if topic_subscribers == None:
-                return None
+                print(f"Skipping topic '{topic}', its directory is left as it is")
+                continue
             subscribers[topic] = topic_subscribers
         return subscribers
 
@@ -139,55 +240,195 @@ class ServerIO:
             print(f"Error when appending update of client '{client_id}' subscription to topic '{topic_id}': {error_str}")
         return result
 
-    # Garbage collection
-    def clean_subscribers(topic_id):
-        subscribers = ServerIO.read_subscribers(topic_id)
-        if subscribers == None:
+    def subscribers_size(topic_id):
+        paths = [pathlib.Path(f"{TOPICS_DIR}/{topic_id}/subscribers.{extension}") for extension in ("csv", "bin")]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+    # ============================= PATTERNS =============================
+
+    # Returns the clients subscribed to each topic pattern
+    def read_patterns():
+        if not pathlib.Path(f"{SERVER_DIR}/patterns.csv").exists():
+            return {}
+
+        result, lines = FileIO.read_lines(f"{SERVER_DIR}/patterns.csv")
+        if not result:
+            print(f"Error when reading pattern subscriptions: {lines}")
             return None
-        
-        result, error_str = FileIO.write_lines(f"{TOPICS_DIR}/{topic_id}/subscribers.csv", [f"SUB,{client_id},{last_publication_received}" for client_id, last_publication_received in subscribers.items()])
+
+        patterns = {}
+        for line in lines:
+            try:
+                operation, client_id, pattern = line.split(",", 2)
+            except ValueError:
+                print("Invalid pattern subscription format")
+                return None
+            if operation == 'SUB':
+                patterns.setdefault(pattern, set()).add(client_id)
+            elif operation == 'UNSUB':
+                patterns.get(pattern, set()).discard(client_id)
+        return {pattern: client_ids for pattern, client_ids in patterns.items() if client_ids}
+
+    def add_pattern_subscriber(pattern, client_id):
+        result, error_str = FileIO.append_line(f"{SERVER_DIR}/patterns.csv", f"SUB,{client_id},{pattern}")
+        if not result:
+            print(f"Error when appending subscription of client '{client_id}' to pattern '{pattern}': {error_str}")
+        return result
+
+    def remove_pattern_subscriber(pattern, client_id):
+        result, error_str = FileIO.append_line(f"{SERVER_DIR}/patterns.csv", f"UNSUB,{client_id},{pattern}")
         if not result:
-            print(f"Error when writing subcriptions of topic '{topic_id}': {error_str}")
+            print(f"Error when appending unsubscription of client '{client_id}' from pattern '{pattern}': {error_str}")
+        return result
+
+    # ============================= CONSUMER GROUPS =============================
+
+    # Returns the members of each consumer group of every topic
+    def read_all_group_members():
+        if not pathlib.Path(TOPICS_DIR).exists():
+            return {}
+
+        members = {}
+        for topic in os.listdir(TOPICS_DIR):
+            path = f"{TOPICS_DIR}/{topic}/groups.csv"
+            if not pathlib.Path(path).exists():
+                continue
+            result, lines = FileIO.read_lines(path)
+            if not result:
+                print(f"Error when reading the consumer groups of topic '{topic}': {lines}")
+                return None
+
+            groups = {}
+            for line in lines:
+                try:
+                    operation, client_id, group_id = line.split(",", 2)
+                except ValueError:
+                    print("Invalid consumer group membership format")
+                    return None
+                if operation == 'JOIN':
+                    groups.setdefault(group_id, set()).add(client_id)
+                elif operation == 'LEAVE':
+                    groups.get(group_id, set()).discard(client_id)
+            members[topic] = groups
+        return members
+
+    def add_group_member(topic_id, group_id, client_id):
+        result, error_str = FileIO.append_line(f"{TOPICS_DIR}/{topic_id}/groups.csv", f"JOIN,{client_id},{group_id}")
+        if not result:
+            print(f"Error when appending client '{client_id}' joining group '{group_id}' of topic '{topic_id}': {error_str}")
+        return result
+
+    def remove_group_member(topic_id, group_id, client_id):
+        result, error_str = FileIO.append_line(f"{TOPICS_DIR}/{topic_id}/groups.csv", f"LEAVE,{client_id},{group_id}")
+        if not result:
+            print(f"Error when appending client '{client_id}' leaving group '{group_id}' of topic '{topic_id}': {error_str}")
+        return result
+
+    # Settings chosen for a topic with CONFIG, like its compression, are one line each in their own file. Returns None
+    # if the setting was never chosen.
+    def read_setting(topic_id, name):
+        path = f"{TOPICS_DIR}/{topic_id}/{name}.txt"
+        if not pathlib.Path(path).exists():
             return None
-        return subscribers
+        result, data = FileIO.read_bytes(path)
+        if not result:
+            raise IOError(data)
+        return data.decode().strip()
+
+    def read_all_settings(name):
+        if not pathlib.Path(TOPICS_DIR).exists():
+            return {}
+
+        settings = {}
+        for topic in os.listdir(TOPICS_DIR):
+            try:
+                setting = ServerIO.read_setting(topic, name)
+            except (IOError, UnicodeDecodeError) as e:
+                print(f"Error when reading the {name} of topic '{topic}': {e}")
+                return None
+            if setting != None:
+                settings[topic] = setting
+        return settings
+
+    def save_setting(topic_id, name, value):
+        result, error_str = FileIO.write_atomic(f"{TOPICS_DIR}/{topic_id}/{name}.txt", value.encode())
+        if not result:
+            print(f"Error when saving the {name} of topic '{topic_id}': {error_str}")
+        return result
+
+    # Every file of the topic: publication segments, their indexes and the subscribers checkpoint and log
+    # Garbage collection
+    def checkpoint_subscribers(topic_id, subscribers, head_id):
+        topic_path = f"{TOPICS_DIR}/{topic_id}"
+        return ServerIO.write_checkpoint(f"{topic_path}/subscribers.bin", f"{topic_path}/subscribers.csv", subscribers, head_id)
 
     # ============================= COUNTERS =============================
     
+    # Sequences are logged to numbered logs: a checkpoint holds every sequence logged before its log number, so the log
+    # is switched while the sequences are copied and the checkpoint is written without blocking the PUTs logging to the
+    # next one. The first log, client_counters.csv, is the one older versions used.
+    def client_counters_log(log_number):
+        return f"{SERVER_DIR}/client_counters.csv" if log_number == 0 else f"{SERVER_DIR}/client_counters.{log_number}.csv"
+
+    def client_counters_logs():
+        logs = {}
+        for path in pathlib.Path(SERVER_DIR).glob("client_counters*.csv"):
+            log_number = path.name[len("client_counters."):-len(".csv")]
+            if log_number == "" or log_number.isdigit():
+                logs[int(log_number or 0)] = path
+        return logs
+
     def save_client_counter(client_id, counter):        
-        result, error_str = FileIO.append_line(f"{SERVER_DIR}/client_counters.csv", f"{client_id},{counter}")
+        result, error_str = FileIO.append_line(ServerIO.client_counters_log(client_counters_log_number), f"{client_id},{counter}")
         if not result:
             print(f"Error when saving client counter of client '{client_id}': {error_str}")
         return result
     
+    # Returns the checkpointed client sequences and the (client_id, counter) pairs logged after the checkpoint, in order.
+    # Checkpoints written by older versions only hold the last counter of each client.
     def read_client_counters():
-        if not pathlib.Path(f"{SERVER_DIR}/client_counters.csv").exists():
-            return {}
-        
-        result, lines = FileIO.read_lines(f"{SERVER_DIR}/client_counters.csv")
-        if not result:
-            print(f"Error when reading client counters: {lines}")
+        global client_counters_log_number
+        try:
+            client_counters, first_log = ServerIO.read_checkpoint(f"{SERVER_DIR}/client_counters.bin")
+        except IOError as e:
+            print(f"Error when reading client counters checkpoint: {e}")
             return None
-        
-        client_counters = {}
-        for i in range(len(lines)-1, -1, -1):
-            line = lines[i].split(",")
-            try:
-                client_id, counter = line[0], int(line[1])
-            except ValueError:
-                print("Invalid client counter format (not int)")
+
+        logs = ServerIO.client_counters_logs()
+        client_counters_log_number = max([first_log] + list(logs))
+        logged = []
+        for log_number in sorted(log_number for log_number in logs if log_number >= first_log):
+            result, lines = FileIO.read_lines(logs[log_number])
+            if not result:
+                print(f"Error when reading client counters: {lines}")
                 return None
-            if client_id not in client_counters:
-                client_counters[client_id] = counter
-        return client_counters
+            for line in lines:
+                line = line.split(",")
+                try:
+                    logged.append((line[0], int(line[1])))
+                except (ValueError, IndexError):
+                    print("Invalid client counter format (not int)")
+                    return None
+        return client_counters, logged
 
-    # Garbage collection
-    def clean_client_counters():
-        client_counters = ServerIO.read_client_counters()
-        if client_counters == None:
-            return None
-        
-        result, error_str = FileIO.write_lines(f"{SERVER_DIR}/client_counters.csv", [f"{client_id},{counter}" for client_id, counter in client_counters.items()])
+    def client_counters_size():
+        paths = list(ServerIO.client_counters_logs().values()) + [pathlib.Path(f"{SERVER_DIR}/client_counters.bin")]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+    # Called with the sequences copied, PUTs log to a new log from then on. Returns the number of that log.
+    def switch_client_counters_log():
+        global client_counters_log_number
+        client_counters_log_number += 1
+        return client_counters_log_number
+
+    # Garbage collection, the logs before first_log are only removed once the checkpoint is on disk
+    def checkpoint_client_counters(client_sequences, first_log):
+        result, error_str = FileIO.write_atomic(f"{SERVER_DIR}/client_counters.bin", encode_checkpoint(client_sequences, first_log, SEQUENCES_MAGIC))
         if not result:
-            print(f"Error when writing client counters: {error_str}")
-            return None
-        return client_counters
\ No newline at end of file
+            print(f"Error when writing checkpoint of client counters: {error_str}")
+            return False
+        for log_number, path in ServerIO.client_counters_logs().items():
+            if log_number < first_log:
+                FileIO.close(path)
+                FileIO.remove(path)
+        return True
@@ -0,0 +1,49 @@
+import argparse
+import json
+import zmq
+
+TIMEOUT = 5000  # miliseconds
+
+parser = argparse.ArgumentParser(description='Reads the metrics of a server started with --metrics-endpoint')
+parser.add_argument('endpoint', help='Metrics endpoint of the server, e.g. tcp://localhost:9003', type=str)
+parser.add_argument('--max-lag', help='Only list the subscribers more than this many publications behind and a backup out of sync, exits with 2 if there is any', type=int)
+
+def fetch_metrics(endpoint):
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send(b"")
+        if not socket.poll(TIMEOUT):
+            return None
+        return json.loads(socket.recv())
+    finally:
+        context.destroy()
+
+def lagging_subscribers(metrics, max_lag):
+    return [(topic_id, client_id, lag) for topic_id, topic in metrics["topics"].items()
+            for client_id, lag in topic["subscribers"].items() if lag > max_lag]
+
+def main():
+    args = parser.parse_args()
+    metrics = fetch_metrics(args.endpoint)
+    if metrics == None:
+        print(f"No reply from {args.endpoint}")
+        exit(1)
+
+    if args.max_lag == None:
+        print(json.dumps(metrics, indent=2))
+        return
+
+    lagging = lagging_subscribers(metrics, args.max_lag)
+    for topic_id, client_id, lag in lagging:
+        print(f"Client {client_id} is {lag} publications behind on topic {topic_id}")
+    replication = metrics.get("replication")
+    out_of_sync = replication != None and replication["backup"] and not replication["in_sync"]
+    if out_of_sync:
+        print(f"Backup is out of sync, {replication['lag']} groups behind")
+    exit(2 if lagging or out_of_sync else 0)
+
+if __name__ == "__main__":
+    main()
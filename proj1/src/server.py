@@ -1,63 +1,210 @@
+import argparse
 import logging
 import zmq
 import uuid
-import sched
 import time
+import threading
+from contextlib import contextmanager
 from communication.reply import *
 from communication.request import *
 from io_utils.server_io import *
+from io_utils.group_commit import DURABILITY_MODES
+from io_utils.replication import *
+from server_utils.dispatcher import *
+from server_utils.garbage_collector import *
+from server_utils.publication_cache import *
+from server_utils.push import *
+from server_utils.long_poll import *
+from server_utils.client_sequences import *
+from server_utils.metrics import *
+from server_utils.patterns import *
+from communication.compression import *
+from server_utils.retention import *
+from server_utils.consumer_groups import *
 
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
 ENDPOINT = "tcp://*:9001"
-GARBAGE_COLLECT_DELAY = 5*60    # seconds
+POLL_TIMEOUT = 1000             # miliseconds
+MAX_BATCH_COUNT = 1000
+MAX_BATCH_BYTES = 1024 * 1024   # bytes
+
+parser = argparse.ArgumentParser(description='Pub/sub server')
+parser.add_argument('--endpoint', help='Endpoint the server binds to', type=str, default=ENDPOINT)
+parser.add_argument('--data-dir', help='Directory where the server data is stored', type=str, default=SERVER_DIR)
+parser.add_argument('--metrics-endpoint', help='Endpoint of a REP socket answering every request with the server metrics as JSON', type=str)
+parser.add_argument('--replication-endpoint', help='Endpoint a backup connects to, to receive every change to the server data', type=str)
+parser.add_argument('--replication-ack-timeout', help='Seconds replies wait for the backup to acknowledge a group before it falls out of sync and replies stop waiting for it, 0 to always wait', type=float, default=ACK_TIMEOUT)
+parser.add_argument('--backup-of', help='Replication endpoint of a primary to back up, the backup binds --endpoint once the primary stops', type=str)
+parser.add_argument('--durability', help='When appends are fsynced: on every group commit, every commit interval or never (OS buffered)', choices=DURABILITY_MODES, default="always")
+parser.add_argument('--commit-interval', help='Commit interval in miliseconds for the interval durability mode', type=int, default=5)
+parser.add_argument('--cache-size', help='Memory ceiling of the publication cache in megabytes', type=int, default=CACHE_MAX_BYTES // (1024 * 1024))
+parser.add_argument('--compression', help='Compression of the publications of topics without one chosen by a CONFIG request', choices=COMPRESSIONS, default=NONE)
+parser.add_argument('--compression-level', help='zlib compression level, from 1 (fastest) to 9 (smallest)', type=int, default=COMPRESSION_LEVEL)
+parser.add_argument('--retention-bytes', help='Bytes of publications a topic without its own retention keeps on disk, read or not', type=int)
+parser.add_argument('--retention-age', help='Seconds a topic without its own retention keeps its publications, read or not', type=float)
+parser.add_argument('--retention-count', help='Publications a topic without its own retention keeps, read or not', type=int)
+parser.add_argument('--lease-timeout', help='Seconds a member of a consumer group has to acknowledge a publication before it goes to another member', type=float, default=LEASE_TIMEOUT)
+parser.add_argument('--topic-store', help='In-memory representation of cached publications: a list of strings or a single bytearray per topic', choices=TOPIC_STORES.keys(), default="list")
+
+# max_bytes is optional in batch GET requests
+def batch_bytes(body):
+    return MAX_BATCH_BYTES if body.get('max_bytes') == None else min(int(body['max_bytes']), MAX_BATCH_BYTES)
 
 class Server:
-    def __init__(self):
-        self.context, self.server = self.bind()
+    def __init__(self, durability="always", commit_interval=5, cache_size=CACHE_MAX_BYTES, topic_store="list", endpoint=ENDPOINT, replicator=None, metrics_endpoint=None,
+                 compression=NONE, compression_level=COMPRESSION_LEVEL, retention=Retention(), lease_timeout=LEASE_TIMEOUT):
+        self.startup_times = {}
+        self.metrics = Metrics()
+        self.compression = compression
+        self.compression_level = compression_level
+        self.retention = retention
+        with self.startup_phase("bind"):
+            self.context, self.server = self.bind(endpoint)
+            self.dispatcher = Dispatcher(self.context)
+            self.replies = self.dispatcher.bind()
+            self.counters_lock = threading.Lock()
 
         # File handling
         ServerIO.create_server_dir()
 
-        self.publications = ServerIO.read_all_publications()
-        if self.publications == None:
-            raise IOError
+        # Publications are read from the logs on demand, only the head id of each topic is needed to start
+        with self.startup_phase("publications"):
+            head_ids = ServerIO.read_all_head_ids()
+            self.compressions = ServerIO.read_all_settings("compression")
+            retentions = ServerIO.read_all_settings("retention")
+            if head_ids == None or self.compressions == None or retentions == None:
+                raise IOError
+            try:
+                self.retentions = {topic_id: Retention.decode(retention) for topic_id, retention in retentions.items()}
+            except ValueError as e:
+                logging.error(f"Unable to read the retention of the topics: {e}")
+                raise IOError
+            self.publications = PublicationCache(head_ids, cache_size, TOPIC_STORES[topic_store])
+            self.push = PushManager(self.publications, self.dispatcher)
+            self.long_poll = LongPoll()
 
-        self.subscribers = ServerIO.read_all_subscribers()
-        if self.subscribers == None:
-            raise IOError
+        # Subscribers and client counters are loaded from their checkpoints, only the log lines written afterwards are replayed
+        with self.startup_phase("subscribers"):
+            self.subscribers = ServerIO.read_all_subscribers()
+            patterns = ServerIO.read_patterns()
+            group_members = ServerIO.read_all_group_members()
+            if self.subscribers == None or patterns == None or group_members == None:
+                raise IOError
+            for topic_id in set(self.publications.topics()) - set(self.subscribers):   # skipped, see read_all_subscribers
+                self.publications.remove(topic_id)
+            self.patterns = PatternSubscriptions(patterns)
+            self.lease_timeout = lease_timeout
+            self.groups = load_groups(self.subscribers, group_members, lease_timeout)
 
-        self.client_counters = ServerIO.read_client_counters()
-        if self.client_counters == None:
-            raise IOError
+        with self.startup_phase("client sequences"):
+            client_counters = ServerIO.read_client_counters()
+            if client_counters == None:
+                raise IOError
+            self.client_sequences = ClientSequences(*client_counters)
+
+        self.replicator = replicator
+        FileIO.start_group_commit(durability, commit_interval, replicator)
         
-        # Setup scheduler
-        self.scheduler = sched.scheduler(time.time, time.sleep)
-        self.scheduler.enter(GARBAGE_COLLECT_DELAY, 0, self.garbage_collect)
-        self.scheduler.enter(0, 1, self.handle_request)
+        self.garbage_collector = GarbageCollector(self)
+        self.metrics_endpoint = MetricsEndpoint(self, metrics_endpoint) if metrics_endpoint else None
+        self.report_startup()
+
+    @contextmanager
+    def startup_phase(self, phase):
+        started = time.perf_counter()
+        yield
+        self.startup_times[phase] = time.perf_counter() - started
 
-    def bind(self):
+    def report_startup(self):
+        phases = ", ".join(f"{phase} {duration * 1000:.2f}ms" for phase, duration in self.startup_times.items())
+        logging.info(f"Server started in {sum(self.startup_times.values()) * 1000:.2f}ms ({phases}) with {len(self.publications)} topics and {len(self.client_sequences)} clients")
+
+    def bind(self, endpoint):
         context = zmq.Context()
-        server = context.socket(zmq.REP)
-        server.bind(ENDPOINT)
+        server = context.socket(zmq.ROUTER)
+        server.bind(endpoint)
         return context, server
 
     def run(self): 
+        poller = zmq.Poller()
+        poller.register(self.server, zmq.POLLIN)
+        poller.register(self.replies, zmq.POLLIN)
+        self.garbage_collector.start()
+        if self.metrics_endpoint:
+            self.metrics_endpoint.start()
         while True:
-            self.scheduler.run()
+            events = dict(poller.poll(self.long_poll.next_timeout(POLL_TIMEOUT)))
+            if self.replies in events:
+                self.server.send_multipart(self.replies.recv_multipart(copy=False), copy=False)
+            if self.server in events:
+                self.handle_request()
+            for topic in self.long_poll.expired_topics():
+                self.dispatcher.dispatch(topic, lambda topic=topic: self.expire_parked(topic))
     
     def handle_request(self):
-        request = self.server.recv()    # This action is blocking, garbage collection is only executed after a request has been received
-        request = Request.from_json(request.decode())
+        frames = self.server.recv_multipart()
+        received = time.perf_counter()
+        try:
+            delimiter = frames.index(b"")
+            envelope, payload = frames[:delimiter], frames[delimiter + 1]
+            codec, request = detect_codec(payload), Request.decode(payload)
+            if not isinstance(request.request_type, str):
+                raise TypeError("Invalid request type")
+        except (ValueError, IndexError, KeyError, TypeError):
+            logging.error("Discarding malformed request")
+            return
         logging.info(f"Received request: {request}")
-        reply = self.process_request(request)
-        self.server.send(str(reply).encode())
-        self.scheduler.enter(0, 1, self.handle_request)
-        
-            
-    def process_request(self, request):
-        if request.request_type == RequestType.GET:
-            return self.process_get(request) 
+        self.metrics.received(request)
+        # Topics are dispatched by their hash, a request without a valid one is answered by the router itself
+        if not isinstance(request.topic, str):
+            logging.info(f"Topic not found: {request.topic}")
+            self.server.send_multipart(envelope + [b"", create_nak("Topic not found").encode(codec)])
+            return
+        deadline = self.long_poll.schedule(request)
+        self.dispatcher.dispatch(request.topic, lambda: self.execute_request(envelope, request, codec, deadline, received))
+
+    # Replies are only released once everything written before them is durable, so no client sees a state that could be lost
+    # Replies use the same codec as their request, requests without reply return None
+    # A request that fails unexpectedly still gets a reply, so its client does not wait for it until it times out
+    def execute_request(self, envelope, request, codec, deadline=None, received=None):
+        try:
+            reply = self.process_request(request, envelope, codec, deadline)
+        except Exception:
+            logging.exception(f"Unexpected error processing request {request}")
+            reply = create_nak("Internal server error")
+        if reply != None:
+            self.send_reply(envelope, reply, codec, request, received)
+
+    def send_reply(self, envelope, reply, codec, request=None, received=None):
+        def release(success):
+            if success:
+                self.dispatcher.send(envelope, reply.encode(codec), reply.frames)
+            else:
+                self.dispatcher.send(envelope, create_nak("Unable to update server status").encode(codec))
+            if received != None:
+                self.metrics.replied(request, received, not success or reply.reply_type == ReplyType.NAK)
+        FileIO.after_flush(release)
+
+    # Parked GET requests are answered again once their topic has new publications or their deadline passes
+    def wake_parked(self, topic):
+        for parked in self.long_poll.wake(topic):
+            reply = self.process_get(parked.request, parked.envelope, parked.codec, parked.deadline)
+            if reply != None:
+                self.send_reply(parked.envelope, reply, parked.codec)
+
+    def expire_parked(self, topic):
+        for parked in self.long_poll.expire(topic):
+            self.send_reply(parked.envelope, self.process_get(parked.request, parked.envelope, parked.codec, 0), parked.codec)
+
+    def process_request(self, request, envelope=None, codec=JSON, deadline=None):
+        if not isinstance(request.body, dict):
+            logging.error("Request body is not an object")
+            return create_nak("Invalid message format")
+        if is_pattern(request.topic) and request.request_type in (RequestType.GET, RequestType.SUB, RequestType.UNSUB):
+            return self.process_pattern(request, envelope, codec)
+        elif request.request_type == RequestType.GET:
+            return self.process_get(request, envelope, codec, deadline)
         elif request.request_type == RequestType.PUT:
             return self.process_put(request)
         elif request.request_type == RequestType.SUB:
@@ -66,72 +213,177 @@ class Server:
             return self.process_unsub(request)
         elif request.request_type == RequestType.REQUEST_ID:
             return self.process_id_request(request)
+        elif request.request_type == RequestType.HELLO:
+            return create_hello_ack(choose_codec(request.body.get('codecs', [])))
+        elif request.request_type == RequestType.PUSH:
+            return self.process_push(request, envelope, codec)
+        elif request.request_type == RequestType.PUSH_ACK:
+            return self.process_push_ack(request)
+        elif request.request_type == RequestType.CONFIG:
+            return self.process_config(request)
         return create_nak("Invalid operation type")
 
-    def process_get(self, request):
+    # Compressed publications are sent as they are stored to clients using the binary codec that can read them
+    def accepts_compressed(self, request, codec):
+        return codec == BINARY and ZLIB in (request.body.get('accept') or [])
+
+    # A GET with a deadline from a subscriber that already read everything is parked until a publication arrives
+    # instead of getting an empty reply, the deadline of a parked request is kept when it is processed again
+    def process_get(self, request, envelope=None, codec=JSON, deadline=None):
         if request.topic not in self.publications:
             logging.info(f"Topic not found: {request.topic}")
             return create_nak("Topic not found")
+        if request.body.get('group') != None:
+            return self.process_group_get(request, codec)
 
-        for publication_id, publication in self.publications[request.topic].items():
-            try: 
-                last_publication_id = int(request.body['last_publication_id'])
-            except ValueError:
-                logging.error("Unable to parse last_publication_id from request to integer")
-                return create_nak("Invalid message format")
+        try: 
+            last_publication_id = int(request.body['last_publication_id'])
+        except (ValueError, TypeError, KeyError):
+            logging.error("Unable to parse last_publication_id from request to integer")
+            return create_nak("Invalid message format")
+
+        first_publication_id = ServerIO.first_id(request.topic)
+        if last_publication_id + 1 < first_publication_id:
+            logging.warning(f"Client {request.client_id} is behind the publications kept by topic {request.topic}")
+            return create_skip_nak(first_publication_id)
+
+        if deadline != None and deadline > time.monotonic() and last_publication_id >= self.publications.head_id(request.topic):
+            self.long_poll.park(envelope, request, codec, deadline)
+            return None
 
-            if publication_id > last_publication_id:
-                if not ServerIO.update_subscriber(request.topic, request.client_id, last_publication_id):
-                    return create_nak("Unable to update server status")
-                self.subscribers[request.topic][request.client_id] = last_publication_id
-                return create_get_ack(publication, publication_id)
+        if 'max_count' in request.body:
+            return self.process_get_batch(request, last_publication_id, codec)
+
+        try:
+            publications = self.publications.read(request.topic, last_publication_id)
+        except IOError:
+            return create_nak("Unable to read publications")
+
+        for publication_id, publication in publications:
+            if not self.update_subscriber(request.topic, request.client_id, last_publication_id):
+                return create_nak("Unable to update server status")
+            return create_get_ack(publication if self.accepts_compressed(request, codec) else decompress(publication), publication_id)
 
         logging.info(f"All messages already read.")
         return create_empty_get_ack()
+
+    def process_get_batch(self, request, last_publication_id, codec=JSON):
+        try:
+            max_count = min(int(request.body['max_count']), MAX_BATCH_COUNT)
+            max_bytes = batch_bytes(request.body)
+        except (ValueError, TypeError, KeyError):
+            logging.error("Unable to parse batch limits from request to integer")
+            return create_nak("Invalid message format")
+
+        # Clients that accept frames get the payloads read from the logs as frames, without decoding or copying them
+        framed = FRAMES in (request.body.get('accept') or [])
+        try:
+            if framed:
+                publications = self.publications.read_payloads(request.topic, last_publication_id, max_count, max_bytes)
+            else:
+                publications = self.publications.read(request.topic, last_publication_id, max_count, max_bytes)
+        except IOError:
+            return create_nak("Unable to read publications")
+
+        if not self.update_subscriber(request.topic, request.client_id, last_publication_id):
+            return create_nak("Unable to update server status")
+        last_publication_id = publications[-1][0] if publications else last_publication_id
+        if framed:
+            return create_framed_get_batch_ack(payloads_for_client(publications, self.accepts_compressed(request, codec)), last_publication_id)
+        return create_get_batch_ack(for_client(publications, self.accepts_compressed(request, codec)), last_publication_id)
+
+    def update_subscriber(self, topic_id, client_id, last_publication_id):
+        if self.subscribers.get(topic_id, {}).get(client_id) == last_publication_id:
+            return True
+        if not ServerIO.update_subscriber(topic_id, client_id, last_publication_id):
+            return False
+        self.subscribers[topic_id][client_id] = last_publication_id
+        return True
         
     def process_put(self, request):    
         # verify if the topic exists 
         if not request.topic in self.publications:
-            print(self.publications)
             logging.log(logging.ERROR, f"Topic {request.topic} does not exist")
             return create_nak("Topic not found")
 
-        # verify if client_counter is not repeated
-        if request.client_id in self.client_counters and self.client_counters[request.client_id] == request.body["counter"]:
-            logging.log(logging.ERROR, f"Client {request.client_id} already sent a message with counter {request.body['counter']}")
-            return create_nak("Duplicated message")
+        if 'publications' in request.body:
+            publications = request.body['publications']
+            if not isinstance(publications, list) or len(publications) == 0:
+                return create_nak("Invalid message format")
+        else:
+            publications = [request.body.get('publication')]
+        if not all(isinstance(publication, str) for publication in publications):   # bytes are compressed publications
+            return create_nak("Invalid message format")
 
+        # Publications are compressed once, the same bytes are stored, cached and sent to the clients that accept them
+        if self.compressions.get(request.topic, self.compression) == ZLIB:
+            publications = [compress(publication, self.compression_level) for publication in publications]
+
+        publication_ids = self.save_put(request, publications)
+        if not isinstance(publication_ids, list):
+            return publication_ids
+        self.apply_retention(request.topic)
+        self.push.deliver(request.topic)
+        self.wake_parked(request.topic)
+
+        if 'publications' in request.body:
+            return create_put_batch_ack(publication_ids)
+        return create_put_ack(publication_ids[0])
+
+    # Every PUT, of one or many publications, carries the next sequence of its client. The sequence is marked as seen
+    # before the publications are saved, so a retry arriving meanwhile on another topic is refused, and unmarked on failure.
+    def save_put(self, request, publications):
+        try:
+            sequence = int(request.body['counter'])
+        except (ValueError, TypeError, KeyError):
+            return create_nak("Invalid message format")
+
+        with self.counters_lock:
+            error = self.client_sequences.check(request.client_id, sequence)
+            if error:
+                logging.log(logging.ERROR, f"Client {request.client_id} sent sequence {sequence}: {error}")
+                return create_nak(error)
+            self.client_sequences.mark(request.client_id, sequence)
+
+        publication_ids = self.save_new_publications(request, publications, sequence)
+        if not isinstance(publication_ids, list):
+            with self.counters_lock:
+                self.client_sequences.unmark(request.client_id, sequence)
+        return publication_ids
+
+    def save_new_publications(self, request, publications, sequence):
         # obtain highest message id for publication
-        last_publication_id = 0
-        if request.topic in self.publications and len(self.publications[request.topic].keys()) > 0:
-            last_publication_id = list(self.publications[request.topic].keys())[-1]
-        current_publication_id = last_publication_id + 1
+        last_publication_id = self.publications.head_id(request.topic)
+        publication_ids = list(range(last_publication_id + 1, last_publication_id + len(publications) + 1))
             
-        # write publication and client counter to file
-        if not ServerIO.save_publication(request.topic, current_publication_id, request.body['publication']):
-            logging.log(logging.ERROR, f"Could not save publication {request.body['publication']} to topic {request.topic}")
+        # write publications and client sequence to file, with a single write each
+        if not ServerIO.save_publications(request.topic, list(zip(publication_ids, publications))):
+            logging.log(logging.ERROR, f"Could not save {len(publications)} publications to topic {request.topic}")
             return create_nak("Unable to update server status")
         
-        if not ServerIO.save_client_counter(request.client_id, request.body['counter']):
-            logging.log(logging.ERROR, f"Could not save client counter {request.body['counter']} for client {request.client_id}")
+        if not ServerIO.save_client_counter(request.client_id, sequence):
+            logging.log(logging.ERROR, f"Could not save sequence {sequence} for client {request.client_id}")
             return create_nak("Unable to update server status") 
 
-        # save publication and client counter to memory
-        self.publications[request.topic][current_publication_id] = request.body['publication']
-
-        self.client_counters[request.client_id] = request.body['counter']
+        # save publications to memory
+        self.publications.append(request.topic, list(zip(publication_ids, publications)))
         
-        return create_put_ack(current_publication_id)
+        return publication_ids
     
     def process_sub(self, request):
+        if request.body.get('group') != None and not valid_group(request.body['group']):
+            return create_nak("Invalid consumer group")
+
         ServerIO.create_topic_dir(request.topic)    # Create topic if it does not exist
         if not request.topic in self.publications:
-            self.publications[request.topic] = {}   # Create topic in memory if it does not exist
+            self.publications.create(request.topic, ServerIO.head_id(request.topic))   # Create topic in memory if it does not exist
+            for pattern, client_id in self.patterns.matching(request.topic):
+                self.add_subscriber(request.topic, pattern_subscriber(client_id, pattern))
+
+        if request.body.get('group') != None:
+            return self.join_group(request.topic, request.body['group'], request.client_id)
 
-        last_publication_id = 0
-        if request.topic in self.publications and len(self.publications[request.topic].keys()) > 0:
-            logging.error(f"{self.publications[request.topic]}, {self.publications[request.topic].keys()}")
-            last_publication_id = max(self.publications[request.topic], key=int)
+        last_publication_id = self.publications.head_id(request.topic)
 
         if not ServerIO.add_subscriber(request.topic, request.client_id, last_publication_id):
             return create_nak("Unable to update server status")
@@ -149,54 +401,344 @@ class Server:
             logging.log(logging.ERROR, f"Topic {request.topic} does not exist")
             return create_nak("Topic not found")
 
+        if request.body.get('group') != None:
+            return self.leave_group(request)
+
         if not request.client_id in self.subscribers[request.topic]:
             logging.log(logging.ERROR, f"Client {request.client_id} is not subscribed to topic {request.topic}")
             return create_nak("Client is not subscribed to topic")
 
-        if not ServerIO.remove_subscriber(request.topic, request.client_id):
-            logging.log(logging.ERROR, f"Could not save client unsubscribe from {request.topic} for client {request.client_id}")
+        if not self.remove_subscriber(request.topic, request.client_id):
             return create_nak("Unable to update server status") 
-            
-        self.subscribers[request.topic].pop(request.client_id)
-
-        if len(self.subscribers[request.topic]) == 0:
-            ServerIO.delete_topic_dir(request.topic)
-            self.subscribers.pop(request.topic)
-            self.publications.pop(request.topic, None)
-    
         return create_unsub_ack()
 
+    # Returns the cursor of the subscriber, None if the topic does not exist or the subscription could not be saved
+    def add_subscriber(self, topic_id, client_id):
+        if topic_id not in self.publications:
+            return None
+        if client_id in self.subscribers.get(topic_id, {}):
+            return self.subscribers[topic_id][client_id]
+
+        last_publication_id = self.publications.head_id(topic_id)
+        if not ServerIO.add_subscriber(topic_id, client_id, last_publication_id):
+            return None
+        self.subscribers.setdefault(topic_id, {})[client_id] = last_publication_id
+        return last_publication_id
+
+    # The topic is deleted with its last subscriber
+    def remove_subscriber(self, topic_id, client_id):
+        if not ServerIO.remove_subscriber(topic_id, client_id):
+            logging.log(logging.ERROR, f"Could not save client unsubscribe from {topic_id} for client {client_id}")
+            return False
+
+        self.subscribers[topic_id].pop(client_id)
+        self.push.stop(topic_id, client_id)
+
+        if len(self.subscribers[topic_id]) == 0:
+            ServerIO.delete_topic_dir(topic_id)
+            self.subscribers.pop(topic_id)
+            self.publications.remove(topic_id)
+            self.push.remove_topic(topic_id)
+            self.compressions.pop(topic_id, None)
+            self.retentions.pop(topic_id, None)
+            self.groups.pop(topic_id, None)
+        return True
+
+    # Requests on a topic pattern visit each matching topic on the worker that owns it and are answered once every
+    # topic was visited, or right away with a NAK
+    def process_pattern(self, request, envelope, codec):
+        if not valid_pattern(request.topic):
+            return create_nak("Invalid topic pattern")
+        if request.body.get('group') != None:
+            return create_nak("Consumer groups are not supported on topic patterns")
+
+        subscribed = (request.topic, request.client_id) in self.patterns
+        if request.request_type != RequestType.SUB and not subscribed:
+            logging.error(f"Client {request.client_id} is not subscribed to pattern {request.topic}")
+            return create_nak("Client is not subscribed to topic")
+
+        subscriber_id = pattern_subscriber(request.client_id, request.topic)
+        topic_ids = self.publications.match(request.topic)
+        answer = lambda reply: self.send_reply(envelope, reply, codec)
+
+        if request.request_type == RequestType.SUB:
+            if not subscribed and not ServerIO.add_pattern_subscriber(request.topic, request.client_id):
+                return create_nak("Unable to update server status")
+            self.patterns.add(request.topic, request.client_id)
+            FanOut(self.dispatcher, topic_ids, lambda topic_id: self.add_subscriber(topic_id, subscriber_id),
+                   lambda cursors: answer(create_pattern_sub_ack({topic_id: cursor for topic_id, cursor in cursors.items() if cursor != None})))
+
+        elif request.request_type == RequestType.UNSUB:
+            if not ServerIO.remove_pattern_subscriber(request.topic, request.client_id):
+                return create_nak("Unable to update server status")
+            self.patterns.remove(request.topic, request.client_id)
+            FanOut(self.dispatcher, topic_ids, lambda topic_id: subscriber_id in self.subscribers.get(topic_id, {}) and self.remove_subscriber(topic_id, subscriber_id),
+                   lambda _: answer(create_unsub_ack()))
+
+        else:
+            try:
+                cursors = {topic_id: int(cursor) for topic_id, cursor in request.body['cursors'].items()}
+                max_count = min(int(request.body['max_count']), MAX_BATCH_COUNT)
+                max_bytes = batch_bytes(request.body)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                logging.error("Unable to parse pattern GET request")
+                return create_nak("Invalid message format")
+            accepts_compressed = self.accepts_compressed(request, codec)
+            FanOut(self.dispatcher, topic_ids, lambda topic_id: self.read_topic(topic_id, subscriber_id, cursors.get(topic_id), max_count, max_bytes, accepts_compressed),
+                   lambda reads: answer(create_pattern_get_ack(*interleave({topic_id: read for topic_id, read in reads.items() if read != None}, max_count, max_bytes))))
+        return None
+
+    # Moves the cursor of the subscriber to the one sent by the client, the server keeps the cursor of the topics
+    # created since the client last read. Returns the cursor and the publications after it.
+    def read_topic(self, topic_id, client_id, last_publication_id, max_count, max_bytes, accepts_compressed=False):
+        if client_id not in self.subscribers.get(topic_id, {}):
+            return None
+        if last_publication_id == None:
+            last_publication_id = self.subscribers[topic_id][client_id]
+        if last_publication_id + 1 < ServerIO.first_id(topic_id):
+            logging.warning(f"Client {client_id} skips the publications of topic {topic_id} dropped by its retention")
+            last_publication_id = ServerIO.first_id(topic_id) - 1
+
+        if not self.update_subscriber(topic_id, client_id, last_publication_id):
+            return None
+        try:
+            return last_publication_id, for_client(self.publications.read(topic_id, last_publication_id, max_count, max_bytes), accepts_compressed)
+        except IOError:
+            logging.error(f"Unable to read publications of topic {topic_id}")
+            return None
+
+    # Registers the sending socket to have the publications after last_publication_id pushed to it as they arrive
+    def process_push(self, request, envelope, codec):
+        if request.client_id not in self.subscribers.get(request.topic, {}):
+            logging.error(f"Client {request.client_id} is not subscribed to topic {request.topic}")
+            return create_nak("Client is not subscribed to topic")
+
+        try:
+            last_publication_id, window = int(request.body['last_publication_id']), int(request.body['window'])
+        except (ValueError, TypeError, KeyError):
+            logging.error("Unable to parse push request")
+            return create_nak("Invalid message format")
+
+        first_publication_id = ServerIO.first_id(request.topic)
+        if last_publication_id + 1 < first_publication_id:
+            logging.warning(f"Client {request.client_id} is behind the publications kept by topic {request.topic}")
+            return create_skip_nak(first_publication_id)
+
+        if not self.update_subscriber(request.topic, request.client_id, last_publication_id):
+            return create_nak("Unable to update server status")
+
+        self.push.start(request.topic, request.client_id, envelope, codec, last_publication_id, window, self.accepts_compressed(request, codec))
+        reply = create_push_ack(last_publication_id)
+        FileIO.after_flush(lambda success: self.dispatcher.send(envelope, reply.encode(codec)) if success else None)
+        self.push.deliver(request.topic)
+        return None
+
+    # Acknowledgements move the subscriber cursor like a GET and give the subscriber credit for more publications
+    def process_push_ack(self, request):
+        if request.client_id not in self.subscribers.get(request.topic, {}):
+            return None
+
+        try:
+            last_publication_id, window = int(request.body['last_publication_id']), int(request.body['window'])
+        except (ValueError, TypeError, KeyError):
+            logging.error("Unable to parse push acknowledgement")
+            return None
+
+        if not self.update_subscriber(request.topic, request.client_id, last_publication_id):
+            logging.error(f"Unable to update cursor of client {request.client_id} on topic {request.topic}")
+        if self.push.ack(request.topic, request.client_id, last_publication_id, window):
+            self.push.deliver(request.topic)
+        return None
+
+    # Chooses how the publications PUT on the topic from then on are stored, the ones already stored are kept as they are
+    def process_config(self, request):
+        if request.topic not in self.publications:
+            logging.error(f"Topic {request.topic} does not exist")
+            return create_nak("Topic not found")
+
+        compression = request.body.get('compression')
+        if compression != None:
+            if compression not in COMPRESSIONS:
+                return create_nak("Invalid compression")
+            if not ServerIO.save_setting(request.topic, "compression", compression):
+                return create_nak("Unable to update server status")
+            self.compressions[request.topic] = compression
+
+        if request.body.get('retention') != None:
+            try:
+                retention = Retention.from_dict(request.body['retention'])
+            except ValueError as e:
+                return create_nak(str(e))
+            if not ServerIO.save_setting(request.topic, "retention", retention.encode()):
+                return create_nak("Unable to update server status")
+            self.retentions[request.topic] = retention
+            self.apply_retention(request.topic, True)
+
+        return create_config_ack(self.compressions.get(request.topic, self.compression), self.retention_of(request.topic).to_dict())
+
+    # Topics without a retention of their own chosen with CONFIG use the one of the server
+    def retention_of(self, topic_id):
+        return self.retentions.get(topic_id, self.retention)
+
+    # Runs on the worker of the topic, after every PUT and on every garbage collection of the topic. Limits on bytes and
+    # count can only be exceeded by a new segment, so only the garbage collection, less frequent, also checks the age.
+    # Returns the bytes reclaimed, None on failure.
+    def apply_retention(self, topic_id, check_age=False):
+        retention = self.retention_of(topic_id)
+        if not retention.limited():
+            return 0
+        reclaimed = ServerIO.apply_retention(topic_id, retention.max_bytes, retention.max_age if check_age else None, retention.max_count)
+        if reclaimed == None:
+            logging.error(f"Unable to apply the retention of topic {topic_id}")
+        elif reclaimed > 0:
+            self.publications.trim(topic_id, ServerIO.first_id(topic_id) - 1)
+            logging.info(f"Retention of topic {topic_id} dropped {reclaimed} bytes, publications start at {ServerIO.first_id(topic_id)}")
+        return reclaimed
+
     def process_id_request(self, request):
         new_id = ""
-        while True:
-            new_id = uuid.uuid4().hex
-            if new_id not in self.client_counters:
-                break
-        self.client_counters[new_id] = -1   # new id registered
+        with self.counters_lock:
+            while True:
+                new_id = uuid.uuid4().hex
+                if new_id not in self.client_sequences:
+                    break
+            self.client_sequences.register(new_id)
         return create_id_ack(new_id)
 
-    def garbage_collect(self):
-        logging.info("Starting garbage collection process")
-        self.scheduler.enter(GARBAGE_COLLECT_DELAY, 1, self.garbage_collect)
-
-        if ServerIO.clean_client_counters() == None: 
-            logging.error("Unable to clean client_counters")
+    # Clients without a PUT for CLIENT_EXPIRY are forgotten, so the checkpoint only holds the active ones. The lock only
+    # covers copying the sequences, the checkpoint is written while PUTs go on
+    def collect_client_counters(self):
+        with self.counters_lock:
+            expired = self.client_sequences.expire()
+            entries = self.client_sequences.entries()
+            first_log = ServerIO.switch_client_counters_log()
+        if expired > 0:
+            logging.info(f"Forgot {expired} inactive clients")
+        size = ServerIO.client_counters_size()
+        if not ServerIO.checkpoint_client_counters(entries, first_log): 
+            logging.error("Unable to checkpoint client_counters")
             return None
+        return max(size - ServerIO.client_counters_size(), 0)
 
-        for topic_id in self.subscribers: 
-            if ServerIO.clean_subscribers(topic_id) == None:
-                logging.error("Unable to clean the subscribers for " + topic_id)
-                return None
+    # The group is a subscriber of the topic, created by its first member at the head of the topic
+    def join_group(self, topic_id, group_id, client_id):
+        cursor = self.add_subscriber(topic_id, group_subscriber(group_id))
+        if cursor == None:
+            return create_nak("Unable to update server status")
+        group = self.groups.setdefault(topic_id, {}).setdefault(group_id, ConsumerGroup(cursor, lease_timeout=self.lease_timeout))
+
+        if client_id not in group.members:
+            if not ServerIO.add_group_member(topic_id, group_id, client_id):
+                return create_nak("Unable to update server status")
+            group.members.add(client_id)
+        return create_sub_ack(group.cursor)
+
+    # Acknowledges the publications the member processed and leases it the next ones, the cursor sent by the client is
+    # not used since the group keeps its own
+    def process_group_get(self, request, codec):
+        if not valid_group(request.body['group']):
+            return create_nak("Invalid consumer group")
+        group = self.groups.get(request.topic, {}).get(request.body['group'])
+        if group == None or request.client_id not in group.members:
+            logging.error(f"Client {request.client_id} is not a member of group {request.body['group']} of topic {request.topic}")
+            return create_nak("Client is not a member of the consumer group")
+
+        try:
+            max_count = min(int(request.body.get('max_count', 1)), MAX_BATCH_COUNT)
+            acks = [int(publication_id) for publication_id in request.body.get('acks', [])]
+        except (ValueError, TypeError):
+            logging.error("Unable to parse consumer group GET request")
+            return create_nak("Invalid message format")
+
+        if group.skip_to(ServerIO.first_id(request.topic)):
+            logging.warning(f"Group {request.body['group']} skips the publications of topic {request.topic} dropped by its retention")
+        group.ack(acks)
+        publication_ids = group.lease(request.client_id, max_count, self.publications.head_id(request.topic), time.monotonic())
+        try:
+            publications = self.read_ids(request.topic, publication_ids)
+        except IOError:
+            return create_nak("Unable to read publications")   # the leases expire and the publications go to another member
+
+        if not self.update_subscriber(request.topic, group_subscriber(request.body['group']), group.cursor):
+            return create_nak("Unable to update server status")
+        return create_get_batch_ack(for_client(publications, self.accepts_compressed(request, codec)), group.cursor)
+
+    # Reads the publications with the given sorted ids, one read per run of consecutive ids
+    def read_ids(self, topic_id, publication_ids):
+        publications = []
+        start = 0
+        for i in range(1, len(publication_ids) + 1):
+            if i == len(publication_ids) or publication_ids[i] != publication_ids[i - 1] + 1:
+                publications += self.publications.read(topic_id, publication_ids[start] - 1, i - start)
+                start = i
+        return publications
 
-        for topic_id in self.publications:
-            last_publication_received = min(self.subscribers[topic_id].values())
-            if ServerIO.clean_publications(topic_id, last_publication_received) == None: 
+    # The publications still leased to the member go to the others, the group is removed with its last member
+    def leave_group(self, request):
+        group_id = request.body['group']
+        if not valid_group(group_id):
+            return create_nak("Invalid consumer group")
+        group = self.groups.get(request.topic, {}).get(group_id)
+        if group == None or request.client_id not in group.members:
+            logging.error(f"Client {request.client_id} is not a member of group {group_id} of topic {request.topic}")
+            return create_nak("Client is not a member of the consumer group")
+
+        try:
+            group.ack([int(publication_id) for publication_id in request.body.get('acks', [])])
+        except (ValueError, TypeError):
+            return create_nak("Invalid message format")
+        if not ServerIO.remove_group_member(request.topic, group_id, request.client_id):
+            return create_nak("Unable to update server status")
+        group.members.discard(request.client_id)
+        group.release(request.client_id)
+
+        if group.members:
+            if not self.update_subscriber(request.topic, group_subscriber(group_id), group.cursor):
+                return create_nak("Unable to update server status")
+        else:
+            self.groups[request.topic].pop(group_id)
+            if not self.remove_subscriber(request.topic, group_subscriber(group_id)):
+                return create_nak("Unable to update server status")
+        return create_unsub_ack()
+
+    # Runs on the worker of the topic, returns None when there is nothing to collect
+    def collect_topic(self, topic_id, last_watermark):
+        retained = (self.apply_retention(topic_id, True) or 0) if topic_id in self.publications else 0
+        if topic_id not in self.subscribers or len(self.subscribers[topic_id]) == 0:
+            return (last_watermark, retained) if retained else None
+
+        watermark = min(self.subscribers[topic_id].values())
+        size = ServerIO.subscribers_size(topic_id)
+        if watermark == last_watermark and size < CHECKPOINT_LOG_SIZE:
+            return (watermark, retained) if retained else None
+
+        if not ServerIO.checkpoint_subscribers(topic_id, self.subscribers[topic_id], self.publications.head_id(topic_id)):
+            logging.error("Unable to checkpoint the subscribers for " + topic_id)
+            return None
+        reclaimed = max(size - ServerIO.subscribers_size(topic_id), 0)
+
+        if topic_id in self.publications:
+            publications_reclaimed = ServerIO.clean_publications(topic_id, watermark)
+            if publications_reclaimed == None: 
                 logging.error("Unable to clean received publications for " + topic_id)
                 return None
+            reclaimed += publications_reclaimed
+            self.publications.trim(topic_id, watermark)
+
+        return watermark, reclaimed + retained
 
 def main():
+    args = parser.parse_args()
+    ServerIO.set_server_dir(args.data_dir)
+
+    # A backup only starts serving once the primary is gone, with the copy of the data it received
+    if args.backup_of:
+        Backup(args.backup_of, args.data_dir, args.durability).run()
+
+    replicator = Replicator(args.replication_endpoint, args.data_dir, args.replication_ack_timeout) if args.replication_endpoint else None
     try:
-        server = Server()
+        server = Server(args.durability, args.commit_interval, args.cache_size * 1024 * 1024, args.topic_store, args.endpoint, replicator, args.metrics_endpoint,
+                        args.compression, args.compression_level, Retention(args.retention_bytes, args.retention_age, args.retention_count), args.lease_timeout)
     except IOError:
         exit(1)
     server.run()
@@ -0,0 +1,80 @@
+import time
+
+DEDUPE_WINDOW = 64                      # sequences tracked below the highest one of each client
+CLIENT_EXPIRY = 7 * 24 * 60 * 60        # seconds without PUTs before a client is forgotten
+
+DUPLICATED = "Duplicated message"
+TOO_OLD = "Sequence is older than the duplicate detection window"
+
+# Each client numbers its PUTs with increasing sequences, a batch is identified by the last sequence of its range.
+# The highest sequence of a client and a bitmap of which of the DEDUPE_WINDOW sequences below it were already seen are
+# enough to detect a retried PUT, even if several PUTs of the client are in flight and arrive out of order.
+class ClientSequence:
+    __slots__ = ("high", "seen", "last_active")
+
+    def __init__(self, high=0, seen=0, last_active=None):
+        self.high = high
+        self.seen = seen
+        self.last_active = time.time() if last_active == None else last_active
+
+    # Returns None if the sequence is new, else the reason it is refused
+    def check(self, sequence):
+        if sequence > self.high:
+            return None
+        if sequence <= self.high - DEDUPE_WINDOW:
+            return TOO_OLD
+        return DUPLICATED if self.seen >> (self.high - sequence) & 1 else None
+
+    def mark(self, sequence):
+        if sequence > self.high:
+            shift = sequence - self.high
+            self.seen = (self.seen << shift | 1) & ((1 << DEDUPE_WINDOW) - 1) if shift < DEDUPE_WINDOW else 1
+            self.high = sequence
+        else:
+            self.seen |= 1 << (self.high - sequence)
+        self.last_active = time.time()
+
+    def unmark(self, sequence):
+        if self.high - DEDUPE_WINDOW < sequence <= self.high:
+            self.seen &= ~(1 << (self.high - sequence))
+
+# Memory is bounded by the clients that made a PUT in the last CLIENT_EXPIRY seconds. Starts from the checkpointed
+# entries, older checkpoints only hold the highest sequence of each client, and replays the sequences logged afterwards.
+class ClientSequences:
+    def __init__(self, entries={}, logged=[]):
+        self.clients = {}
+        for client_id, entry in entries.items():
+            self.clients[client_id] = ClientSequence(*entry) if isinstance(entry, tuple) else ClientSequence(entry, 1)
+        for client_id, sequence in logged:
+            self.mark(client_id, sequence)
+
+    def __contains__(self, client_id):
+        return client_id in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def register(self, client_id):
+        self.clients[client_id] = ClientSequence()
+
+    def check(self, client_id, sequence):
+        client = self.clients.get(client_id)
+        return client.check(sequence) if client else None
+
+    def mark(self, client_id, sequence):
+        self.clients.setdefault(client_id, ClientSequence()).mark(sequence)
+
+    def unmark(self, client_id, sequence):
+        if client_id in self.clients:
+            self.clients[client_id].unmark(sequence)
+
+    # Returns the number of clients forgotten
+    def expire(self, max_age=CLIENT_EXPIRY):
+        oldest = time.time() - max_age
+        expired = [client_id for client_id, client in self.clients.items() if client.last_active < oldest]
+        for client_id in expired:
+            del self.clients[client_id]
+        return len(expired)
+
+    def entries(self):
+        return {client_id: (client.high, client.seen, int(client.last_active)) for client_id, client in self.clients.items()}
@@ -0,0 +1,83 @@
+import re
+
+LEASE_TIMEOUT = 30      # seconds a member has to acknowledge a publication before it is handed to another member
+GROUP_NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+# A consumer group is a single subscriber of its topic, under its own subscriber id, so its cursor is kept, garbage
+# collected and reported like any other
+def group_subscriber(group_id):
+    return f"group:{group_id}"
+
+def group_of(subscriber_id):
+    return subscriber_id[len("group:"):] if subscriber_id.startswith("group:") else None
+
+def valid_group(group_id):
+    return isinstance(group_id, str) and GROUP_NAME.fullmatch(group_id) != None
+
+# Each publication of the topic is leased to one member of the group at a time. A publication whose lease expires
+# before the member acknowledges it, e.g. because the member crashed, is leased again to the next member that reads.
+# The cursor of the group only moves over acknowledged publications, so after a restart of the server every
+# publication that was not acknowledged is delivered again.
+# Runs on the worker of the topic, like every other request on it.
+class ConsumerGroup:
+    def __init__(self, cursor, members=(), lease_timeout=LEASE_TIMEOUT):
+        self.cursor = cursor            # every publication up to it was acknowledged
+        self.next_id = cursor + 1       # first publication never leased
+        self.leases = {}                # publication id -> (member, deadline)
+        self.acked = set()              # acknowledged publications after the cursor
+        self.members = set(members)
+        self.lease_timeout = lease_timeout
+
+    # Returns the ids of the publications leased to the member, expired leases first and then new publications
+    def lease(self, member, max_count, head_id, now):
+        expired = sorted(publication_id for publication_id, (_, deadline) in self.leases.items() if deadline <= now)[:max_count]
+        fresh = list(range(self.next_id, min(head_id + 1, self.next_id + max_count - len(expired))))
+        self.next_id += len(fresh)
+        for publication_id in expired + fresh:
+            self.leases[publication_id] = (member, now + self.lease_timeout)
+        return sorted(expired + fresh)
+
+    # Acknowledgements of publications that are no longer leased, e.g. sent again with a retried request, are ignored.
+    # Returns whether the cursor moved.
+    def ack(self, publication_ids):
+        for publication_id in publication_ids:
+            if self.leases.pop(publication_id, None) != None:
+                self.acked.add(publication_id)
+        return self.advance()
+
+    def advance(self):
+        cursor = self.cursor
+        while self.cursor + 1 in self.acked:
+            self.cursor += 1
+            self.acked.discard(self.cursor)
+        return self.cursor != cursor
+
+    # The publications leased to a member that leaves go to the next member that reads
+    def release(self, member):
+        for publication_id, (lease_member, _) in list(self.leases.items()):
+            if lease_member == member:
+                self.leases[publication_id] = (member, 0)
+
+    # Publications dropped by the retention of the topic are skipped as if acknowledged
+    def skip_to(self, first_publication_id):
+        if self.cursor + 1 >= first_publication_id:
+            return False
+        self.cursor = first_publication_id - 1
+        self.next_id = max(self.next_id, first_publication_id)
+        self.leases = {publication_id: lease for publication_id, lease in self.leases.items() if publication_id >= first_publication_id}
+        self.acked = {publication_id for publication_id in self.acked if publication_id >= first_publication_id}
+        self.advance()
+        return True
+
+    def stats(self, head_id):
+        return {"cursor": self.cursor, "lag": max(head_id - self.cursor, 0), "members": len(self.members), "in_flight": len(self.leases)}
+
+# Groups are kept in memory per topic: {topic_id: {group_id: ConsumerGroup}}
+def load_groups(subscribers, members, lease_timeout=LEASE_TIMEOUT):
+    groups = {}
+    for topic_id, topic_subscribers in subscribers.items():
+        for subscriber_id, cursor in topic_subscribers.items():
+            group_id = group_of(subscriber_id)
+            if group_id != None:
+                groups.setdefault(topic_id, {})[group_id] = ConsumerGroup(cursor, members.get(topic_id, {}).get(group_id, ()), lease_timeout)
+    return groups
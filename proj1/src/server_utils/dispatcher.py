@@ -0,0 +1,48 @@
+import logging
+import queue
+import threading
+import zlib
+import zmq
+
+REPLIES_ENDPOINT = "inproc://replies"
+N_WORKERS = 8
+
+class Worker(threading.Thread):
+    def __init__(self, index):
+        super().__init__(name=f"worker-{index}", daemon=True)
+        self.tasks = queue.Queue()
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                task()
+            except Exception:
+                logging.exception(f"Unexpected error in {self.name}")
+
+class Dispatcher:
+    def __init__(self, context, n_workers=N_WORKERS):
+        self.context = context
+        self.sockets = threading.local()
+        self.workers = [Worker(i) for i in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def bind(self):
+        replies = self.context.socket(zmq.PULL)
+        replies.bind(REPLIES_ENDPOINT)
+        return replies
+
+    # Every task with the same key runs on the same worker, so tasks on the same topic keep their order
+    def dispatch(self, key, task):
+        self.workers[zlib.crc32(key.encode()) % len(self.workers)].tasks.put(task)
+
+    # ZMQ sockets are not thread safe, so each thread pushes its replies to the router thread through its own socket.
+    # Frames following the reply are handed to ZMQ without copying them, they must not change until they are sent.
+    def send(self, envelope, reply, frames=()):
+        socket = getattr(self.sockets, "socket", None)
+        if socket is None:
+            socket = self.context.socket(zmq.PUSH)
+            socket.connect(REPLIES_ENDPOINT)
+            self.sockets.socket = socket
+        socket.send_multipart(envelope + [b"", reply] + list(frames), copy=False)
@@ -0,0 +1,79 @@
+from collections import deque
+import logging
+import threading
+import time
+
+GARBAGE_COLLECT_DELAY = 5*60    # seconds between two rounds over every topic
+GARBAGE_COLLECT_RETRY = 1       # seconds between two passes of an unfinished round
+GARBAGE_COLLECT_BUDGET = 0.05   # seconds a single pass may spend collecting topics
+GARBAGE_COLLECT_HISTORY = 100   # passes kept in the statistics
+CHECKPOINT_LOG_SIZE = 64*1024   # bytes a log may grow before it is checkpointed even if the low watermark did not move
+
+# Runs on its own thread and collects one topic at a time on the worker that owns the topic, so a pass only pauses
+# the requests of the topic being collected. A pass stops once its time budget is spent and the next pass resumes
+# the round where it stopped. Topics whose low watermark (the lowest subscriber cursor) did not move are skipped,
+# unless their subscribers log grew enough to be worth checkpointing.
+class GarbageCollector(threading.Thread):
+    def __init__(self, server, delay=GARBAGE_COLLECT_DELAY, budget=GARBAGE_COLLECT_BUDGET):
+        super().__init__(name="garbage-collector", daemon=True)
+        self.server = server
+        self.delay = delay
+        self.budget = budget
+        self.round = deque()
+        self.watermarks = {}
+        self.passes = deque(maxlen=GARBAGE_COLLECT_HISTORY)
+
+    def run(self):
+        while True:
+            time.sleep(GARBAGE_COLLECT_RETRY if self.round else self.delay)
+            try:
+                self.collect()
+            except Exception:
+                logging.exception("Unexpected error during garbage collection")
+
+    def collect(self):
+        started = time.perf_counter()
+        stats = {"started": time.time(), "topics": 0, "skipped": 0, "reclaimed": 0, "pauses": []}
+
+        if not self.round:
+            self.round.extend(list(self.server.subscribers))
+            self.watermarks = {topic_id: watermark for topic_id, watermark in self.watermarks.items() if topic_id in self.round}
+            pause, reclaimed = self.timed(self.server.collect_client_counters)
+            stats["pauses"].append(pause)
+            stats["reclaimed"] += reclaimed or 0
+
+        while self.round and time.perf_counter() - started < self.budget:
+            topic_id = self.round.popleft()
+            pause, result = self.on_worker(topic_id, lambda: self.server.collect_topic(topic_id, self.watermarks.get(topic_id)))
+            if result == None:
+                stats["skipped"] += 1
+                continue
+
+            self.watermarks[topic_id], reclaimed = result
+            stats["topics"] += 1
+            stats["reclaimed"] += reclaimed
+            stats["pauses"].append(pause)
+
+        stats["duration"] = time.perf_counter() - started
+        stats["max_pause"] = max(stats["pauses"], default=0)
+        stats["remaining"] = len(self.round)
+        self.passes.append(stats)
+        logging.info(f"Garbage collection pass: {stats['topics']} topics collected, {stats['skipped']} skipped, {stats['reclaimed']} bytes reclaimed, max pause {stats['max_pause'] * 1000:.2f}ms, {stats['remaining']} topics left in this round")
+
+    def timed(self, task):
+        started = time.perf_counter()
+        result = task()
+        return time.perf_counter() - started, result
+
+    # Runs the task on the worker that owns the topic and waits for it, the pause is the time the worker spent on it
+    def on_worker(self, topic_id, task):
+        done = threading.Event()
+        results = []
+        def run():
+            try:
+                results.append(self.timed(task))
+            finally:
+                done.set()
+        self.server.dispatcher.dispatch(topic_id, run)
+        done.wait()
+        return results[0] if results else (0, None)
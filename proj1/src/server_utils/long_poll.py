@@ -0,0 +1,72 @@
+import heapq
+import itertools
+import threading
+import time
+from communication.request import RequestType
+
+MAX_WAIT = 30000    # miliseconds
+
+class ParkedRequest:
+    def __init__(self, envelope, request, codec, deadline):
+        self.envelope = envelope
+        self.request = request
+        self.codec = codec
+        self.deadline = deadline
+
+# GET requests of caught up subscribers wait here until a publication arrives on their topic or their deadline passes.
+# Parking and waking a topic happen on the worker that owns it. The router thread schedules the deadline of every
+# waiting GET when it receives it, so its poll timeout never overshoots, and hands expired topics back to their workers.
+class LongPoll:
+    def __init__(self):
+        self.parked = {}
+        self.deadlines = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    # Returns the deadline of a GET with a valid wait_ms, None for any other request
+    def schedule(self, request):
+        try:
+            wait_ms = int(request.body.get('wait_ms', 0))
+        except (ValueError, TypeError, AttributeError):
+            return None
+        if request.request_type != RequestType.GET or wait_ms <= 0:
+            return None
+
+        deadline = time.monotonic() + min(wait_ms, MAX_WAIT) / 1000
+        with self.lock:
+            heapq.heappush(self.deadlines, (deadline, next(self.sequence), request.topic))
+        return deadline
+
+    def park(self, envelope, request, codec, deadline):
+        with self.lock:
+            self.parked.setdefault(request.topic, []).append(ParkedRequest(envelope, request, codec, deadline))
+
+    # Removes and returns every request parked on the topic
+    def wake(self, topic_id):
+        with self.lock:
+            return self.parked.pop(topic_id, [])
+
+    # Removes and returns the requests of the topic whose deadline has passed
+    def expire(self, topic_id):
+        now = time.monotonic()
+        with self.lock:
+            parked = self.parked.get(topic_id, [])
+            expired = [request for request in parked if request.deadline <= now]
+            if expired:
+                self.parked[topic_id] = [request for request in parked if request.deadline > now]
+            return expired
+
+    # Topics with a parked request past its deadline, for the router thread
+    def expired_topics(self):
+        now, topics = time.monotonic(), set()
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                topics.add(heapq.heappop(self.deadlines)[2])
+        return topics
+
+    # Miliseconds until the next deadline, capped by `timeout`
+    def next_timeout(self, timeout):
+        with self.lock:
+            if not self.deadlines:
+                return timeout
+            return max(min(timeout, (self.deadlines[0][0] - time.monotonic()) * 1000), 0)
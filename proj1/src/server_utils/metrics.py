@@ -0,0 +1,129 @@
+import bisect
+import json
+import logging
+import threading
+import time
+import zmq
+from communication.request import REQUEST_TYPES
+from io_utils.server_io import ServerIO
+
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]   # upper bounds in miliseconds
+PERCENTILES = [50, 99, 99.9]
+INVALID_TYPE = "INVALID"    # requests of an unknown type, answered with a NAK
+
+# Counts of request latencies per bucket, the last bucket holds everything above the highest bound
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def record(self, latency_ms):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, latency_ms)] += 1
+        self.count += 1
+        self.sum += latency_ms
+
+    # Upper bound of the bucket holding the percentile, None above the highest bound
+    def percentile(self, p):
+        rank, seen = self.count * p / 100, 0
+        for bound, count in zip(LATENCY_BUCKETS + [None], self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count, 3) if self.count else None,
+            "buckets": {f"le_{bound:g}" if bound else "inf": count for bound, count in zip(LATENCY_BUCKETS + [None], self.buckets)},
+            **{f"p{p:g}_ms": self.percentile(p) for p in PERCENTILES},
+        }
+
+# Requests are counted by the router thread when received, their latency is recorded when the reply is released,
+# from the time the request was received. GET requests that wait for a publication and requests on topic patterns,
+# answered once every matching topic was visited, are counted but not timed.
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.request_types = [request_type.value for request_type in REQUEST_TYPES] + [INVALID_TYPE]
+        self.requests = {request_type: 0 for request_type in self.request_types}
+        self.naks = {request_type: 0 for request_type in self.request_types}
+        self.latencies = {request_type: Histogram() for request_type in self.request_types}
+        self.lock = threading.Lock()
+
+    def request_type(self, request):
+        return request.request_type if request.request_type in self.requests else INVALID_TYPE
+
+    def received(self, request):
+        self.requests[self.request_type(request)] += 1
+
+    def replied(self, request, received, nak):
+        latency_ms = (time.perf_counter() - received) * 1000
+        with self.lock:
+            self.latencies[self.request_type(request)].record(latency_ms)
+            if nak:
+                self.naks[self.request_type(request)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {request_type: {"count": self.requests[request_type], "naks": self.naks[request_type],
+                                   "latency": self.latencies[request_type].snapshot()} for request_type in self.request_types}
+
+# Answers every request on a REP socket with a JSON snapshot of the server. The lag of a subscriber is the number of
+# publications of the topic it has not read yet, the backlog of a topic the lag of its slowest subscriber.
+# The state of the server is only copied, never locked, so a snapshot may mix values from consecutive requests. Only
+# memory is read, files belong to the workers of their topics.
+class MetricsEndpoint(threading.Thread):
+    def __init__(self, server, endpoint):
+        super().__init__(name="metrics", daemon=True)
+        self.server = server
+        self.endpoint = endpoint
+
+    def run(self):
+        socket = self.server.context.socket(zmq.REP)
+        socket.bind(self.endpoint)
+        logging.info(f"Serving metrics on {self.endpoint}")
+        while True:
+            socket.recv()
+            try:
+                reply = json.dumps(self.snapshot())
+            except Exception as e:
+                logging.exception("Unable to collect metrics")
+                reply = json.dumps({"error": str(e)})
+            socket.send_string(reply)
+
+    def snapshot(self):
+        server = self.server
+        return {
+            "uptime": round(time.time() - server.metrics.started, 3),
+            "requests": server.metrics.snapshot(),
+            "topics": {topic_id: self.topic(topic_id, subscribers) for topic_id, subscribers in list(server.subscribers.items())},
+            "cache": server.publications.stats(),
+            "clients": len(server.client_sequences),
+            "garbage_collection": self.garbage_collection(),
+            "replication": server.replicator.stats() if server.replicator else None,
+        }
+
+    def topic(self, topic_id, subscribers):
+        head_id = self.server.publications.head_id(topic_id)
+        lags = {client_id: max(head_id - cursor, 0) for client_id, cursor in dict(subscribers).items()}
+        return {
+            "head_id": head_id,
+            "first_id": ServerIO.loaded_first_id(topic_id),
+            "backlog": max(lags.values(), default=0),
+            "log_bytes": ServerIO.loaded_log_bytes(topic_id),
+            "subscribers": lags,
+            "groups": {group_id: group.stats(head_id) for group_id, group in list(self.server.groups.get(topic_id, {}).items())},
+        }
+
+    def garbage_collection(self):
+        passes = list(self.server.garbage_collector.passes)
+        pauses = sorted(pause for stats in passes for pause in stats["pauses"])
+        return {
+            "passes": len(passes),
+            "reclaimed_bytes": sum(stats["reclaimed"] for stats in passes),
+            "max_pause_ms": round(pauses[-1] * 1000, 3) if pauses else None,
+            "p99_pause_ms": round(pauses[min(int(len(pauses) * 0.99), len(pauses) - 1)] * 1000, 3) if pauses else None,
+            "last_pass": passes[-1]["started"] if passes else None,
+        }
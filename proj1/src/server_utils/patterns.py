@@ -0,0 +1,75 @@
+import threading
+from server_utils.topic_trie import matches
+
+# A client subscribed to a pattern is a subscriber of every matching topic under its own subscriber id, so its cursors
+# are kept, garbage collected and reported like any other, separately from a subscription of the client to the topic
+def pattern_subscriber(client_id, pattern):
+    return f"{client_id}@{pattern}"
+
+# Clients subscribed to each pattern, to subscribe them to the matching topics created later
+class PatternSubscriptions:
+    def __init__(self, patterns={}):
+        self.patterns = {pattern: set(client_ids) for pattern, client_ids in patterns.items()}
+        self.lock = threading.Lock()
+
+    def __contains__(self, subscription):
+        pattern, client_id = subscription
+        with self.lock:
+            return client_id in self.patterns.get(pattern, ())
+
+    def add(self, pattern, client_id):
+        with self.lock:
+            self.patterns.setdefault(pattern, set()).add(client_id)
+
+    def remove(self, pattern, client_id):
+        with self.lock:
+            client_ids = self.patterns.get(pattern)
+            if client_ids is not None:
+                client_ids.discard(client_id)
+                if not client_ids:
+                    del self.patterns[pattern]
+
+    # Returns the (pattern, client_id) subscriptions that match the topic
+    def matching(self, topic_id):
+        with self.lock:
+            return [(pattern, client_id) for pattern, client_ids in self.patterns.items() if matches(pattern, topic_id) for client_id in client_ids]
+
+# Runs a task on the worker of each topic, without blocking any worker, and calls done with the results of every topic
+# on the worker that finished last
+class FanOut:
+    def __init__(self, dispatcher, topic_ids, task, done):
+        self.remaining = len(topic_ids)
+        self.results = {}
+        self.done = done
+        self.lock = threading.Lock()
+        if not topic_ids:
+            done(self.results)
+        for topic_id in topic_ids:
+            dispatcher.dispatch(topic_id, lambda topic_id=topic_id: self.run(topic_id, task))
+
+    def run(self, topic_id, task):
+        result = None
+        try:
+            result = task(topic_id)
+        finally:
+            with self.lock:
+                self.results[topic_id] = result
+                self.remaining -= 1
+                finished = self.remaining == 0
+            if finished:
+                self.done(self.results)
+
+# Interleaves the publications read from each topic, the first of every topic before the second of any, up to the batch
+# limits. Returns the batch of (topic_id, publication_id, publication) and the cursor of every topic after it.
+def interleave(reads, max_count, max_bytes):
+    cursors = {topic_id: cursor for topic_id, (cursor, _) in reads.items()}
+    ordered = sorted((i, topic_id, publication_id, publication) for topic_id, (_, publications) in reads.items()
+                     for i, (publication_id, publication) in enumerate(publications))
+    batch, batch_bytes = [], 0
+    for _, topic_id, publication_id, publication in ordered:
+        batch_bytes += len(publication)
+        if len(batch) >= max_count or (batch and batch_bytes > max_bytes):
+            break
+        batch.append((topic_id, publication_id, publication))
+        cursors[topic_id] = publication_id
+    return batch, cursors
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import threading
+from io_utils.server_io import *
+from communication.compression import to_payload
+from server_utils.topic_store import *
+from server_utils.topic_trie import *
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024     # bytes
+
+# Keeps the tail of the most recently used topics in memory, up to max_bytes. When full, the oldest publications
+# of the least recently used topic are evicted first. Reads below the cached window of a topic go to its log.
+# The window of each topic is an instance of `store`, one of the TOPIC_STORES. Topic ids are also kept in a trie to
+# find the topics matching a pattern.
+class PublicationCache:
+    def __init__(self, head_ids, max_bytes=CACHE_MAX_BYTES, store=TopicWindow):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.head_ids = dict(head_ids)
+        self.trie = TopicTrie(self.head_ids)
+        self.cached = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, topic_id):
+        return topic_id in self.head_ids
+
+    def __len__(self):
+        return len(self.head_ids)
+
+    def topics(self):
+        return list(self.head_ids)
+
+    def head_id(self, topic_id):
+        return self.head_ids.get(topic_id, 0)
+
+    def match(self, pattern):
+        return self.trie.match(pattern)
+
+    def create(self, topic_id, head_id=0):
+        with self.lock:
+            self.head_ids.setdefault(topic_id, head_id)
+        self.trie.insert(topic_id)
+
+    def remove(self, topic_id):
+        self.trie.remove(topic_id)
+        with self.lock:
+            self.head_ids.pop(topic_id, None)
+            window = self.cached.pop(topic_id, None)
+            if window is not None:
+                self.size -= window.nbytes
+
+    def append(self, topic_id, publications):
+        with self.lock:
+            window = self.cached.setdefault(topic_id, self.store())
+            self.cached.move_to_end(topic_id)
+            self.size -= window.nbytes
+            for publication_id, publication in publications:
+                window.append(publication_id, publication)
+            self.size += window.nbytes
+            self.head_ids[topic_id] = publications[-1][0]
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.cached:
+            topic_id, window = next(iter(self.cached.items()))
+            if len(window) == 0:
+                del self.cached[topic_id]
+                continue
+            self.size -= window.pop_first()
+
+    # Drops cached publications every subscriber has already read
+    def trim(self, topic_id, last_publication_id):
+        with self.lock:
+            window = self.cached.get(topic_id)
+            while window is not None and len(window) > 0 and window.first_id <= last_publication_id:
+                self.size -= window.pop_first()
+
+    # Returns up to max_count contiguous publications after last_publication_id, at least one even if above max_bytes
+    def read(self, topic_id, last_publication_id, max_count=1, max_bytes=float("inf")):
+        publications = self.read_cached(topic_id, last_publication_id, max_count, max_bytes)
+        if publications is not None:
+            return publications
+
+        return read_log(ServerIO.read_publications, topic_id, last_publication_id, max_count, max_bytes)
+
+    # Same as read, as (id, payload, compressed) triples. Payloads read from the log are slices of its mapped segments,
+    # so a catch-up read far behind the head neither copies nor decodes them.
+    def read_payloads(self, topic_id, last_publication_id, max_count=1, max_bytes=float("inf")):
+        publications = self.read_cached(topic_id, last_publication_id, max_count, max_bytes)
+        if publications is not None:
+            return [(publication_id, *to_payload(publication)) for publication_id, publication in publications]
+
+        return read_log(ServerIO.read_payloads, topic_id, last_publication_id, max_count, max_bytes)
+
+    # None when the publications are not all cached
+    def read_cached(self, topic_id, last_publication_id, max_count, max_bytes):
+        with self.lock:
+            head_id = self.head_ids.get(topic_id, 0)
+            if last_publication_id >= head_id:
+                return []
+
+            window = self.cached.get(topic_id)
+            if window is not None and len(window) > 0 and window.first_id <= last_publication_id + 1:
+                self.hits += 1
+                self.cached.move_to_end(topic_id)
+                return limit(window.after(last_publication_id), max_count, max_bytes)
+            self.misses += 1
+            return None
+
+    def stats(self):
+        return {"bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "topics": len(self.cached)}
+
+# Publications may have been evicted before reaching the disk. The log is a prefix of the publications appended, so it
+# is only flushed when it does not have the one after last_publication_id yet.
+def read_log(read, topic_id, last_publication_id, max_count, max_bytes):
+    publications = limit(read(topic_id, last_publication_id), max_count, max_bytes)
+    if not publications:
+        FileIO.flush()
+        publications = limit(read(topic_id, last_publication_id), max_count, max_bytes)
+    return publications
+
+# Publications are (id, publication) pairs or (id, payload, compressed) triples
+def limit(publications, max_count, max_bytes):
+    batch, batch_bytes = [], 0
+    for publication in publications:
+        batch_bytes += len(publication[1])
+        if len(batch) >= max_count or (batch and batch_bytes > max_bytes):
+            break
+        batch.append(publication)
+    return batch
@@ -0,0 +1,60 @@
+from communication.reply import *
+from communication.compression import for_client
+from io_utils.file_io import FileIO
+
+PUSH_MAX_BATCH = 100            # publications per push message
+PUSH_MAX_BYTES = 256 * 1024     # bytes per push message
+
+# A subscriber in push mode may have up to `window` publications sent but not yet acknowledged.
+# Its cursor only moves when it acknowledges, so publications lost in transit are sent again when it reconnects.
+class PushSubscription:
+    def __init__(self, envelope, codec, last_publication_id, window, accepts_compressed=False):
+        self.envelope = envelope
+        self.codec = codec
+        self.accepts_compressed = accepts_compressed
+        self.acked = last_publication_id
+        self.sent = last_publication_id
+        self.window = window
+
+    @property
+    def credit(self):
+        return self.acked + self.window - self.sent
+
+# Every method of a topic must run on the worker that owns the topic
+class PushManager:
+    def __init__(self, publications, dispatcher):
+        self.publications = publications
+        self.dispatcher = dispatcher
+        self.subscriptions = {}
+
+    def start(self, topic_id, client_id, envelope, codec, last_publication_id, window, accepts_compressed=False):
+        self.subscriptions.setdefault(topic_id, {})[client_id] = PushSubscription(envelope, codec, last_publication_id, window, accepts_compressed)
+
+    def ack(self, topic_id, client_id, last_publication_id, window):
+        subscription = self.subscriptions.get(topic_id, {}).get(client_id)
+        if subscription == None:
+            return False
+        subscription.acked = max(subscription.acked, last_publication_id)
+        subscription.sent = max(subscription.sent, subscription.acked)
+        subscription.window = window
+        return True
+
+    def stop(self, topic_id, client_id):
+        self.subscriptions.get(topic_id, {}).pop(client_id, None)
+
+    def remove_topic(self, topic_id):
+        self.subscriptions.pop(topic_id, None)
+
+    # Sends every publication a subscriber has credit for, once everything written before is durable
+    def deliver(self, topic_id):
+        for subscription in self.subscriptions.get(topic_id, {}).values():
+            while subscription.credit > 0:
+                try:
+                    publications = self.publications.read(topic_id, subscription.sent, min(subscription.credit, PUSH_MAX_BATCH), PUSH_MAX_BYTES)
+                except IOError:
+                    break
+                if not publications:
+                    break
+                subscription.sent = publications[-1][0]
+                message = create_push_delivery(topic_id, for_client(publications, subscription.accepts_compressed)).encode(subscription.codec)
+                FileIO.after_flush(lambda success, envelope=subscription.envelope, message=message: self.dispatcher.send(envelope, message) if success else None)
@@ -0,0 +1,47 @@
+RETENTION_LIMITS = ["max_bytes", "max_age", "max_count"]
+
+# Limits on what a topic keeps on disk whether or not its subscribers read it: bytes of its log, age in seconds of its
+# publications and number of publications, None for no limit. Publications are dropped in whole segments, oldest
+# first, and the active segment is always kept, so a topic holds at most max_bytes, or a single segment when smaller.
+class Retention:
+    def __init__(self, max_bytes=None, max_age=None, max_count=None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_count = max_count
+
+    def limited(self):
+        return any(limit != None for limit in self.limits())
+
+    def limits(self):
+        return [self.max_bytes, self.max_age, self.max_count]
+
+    # Raises ValueError unless every limit is missing or a positive number
+    def from_dict(limits):
+        if not isinstance(limits, dict) or not set(limits) <= set(RETENTION_LIMITS):
+            raise ValueError("Invalid retention")
+        for name, limit in limits.items():
+            if limit != None and (isinstance(limit, bool) or not isinstance(limit, (int, float)) or not limit > 0):
+                raise ValueError(f"Invalid retention limit {name}")
+        return Retention(*[limits.get(name) for name in RETENTION_LIMITS])
+
+    def to_dict(self):
+        return dict(zip(RETENTION_LIMITS, self.limits()))
+
+    # Stored as "max_bytes,max_age,max_count", missing limits are empty
+    def decode(line):
+        values = line.strip().split(",")
+        if len(values) != len(RETENTION_LIMITS):
+            raise ValueError(f"Invalid retention '{line}'")
+        return Retention(*[Retention.decode_limit(value) for value in values])
+
+    # Limits are written with str(), floats may use an exponent, e.g. 1e-05
+    def decode_limit(value):
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    def encode(self):
+        return ",".join("" if limit == None else str(limit) for limit in self.limits())
@@ -0,0 +1,115 @@
+from array import array
+
+ENTRY_OVERHEAD = 60     # approximate bytes used by a python string and its list slot besides the publication itself
+
+# Publication ids of a topic are dense and monotonic, so the cached window of a topic is a list where the publication
+# with id `first_id + i` is at position `start + i`. Seeking to an id is a subtraction and trimming the oldest
+# publications advances `start`, the list is only compacted once most of it is unused.
+class TopicWindow:
+    def __init__(self):
+        self.first_id = 1
+        self.start = 0
+        self.publications = []
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.publications) - self.start
+
+    @property
+    def head_id(self):
+        return self.first_id + len(self) - 1
+
+    def append(self, publication_id, publication):
+        if len(self) == 0 or publication_id != self.head_id + 1:
+            self.clear()
+            self.first_id = publication_id
+        self.publications.append(publication)
+        self.nbytes += len(publication) + ENTRY_OVERHEAD
+
+    # Returns the bytes released from the window
+    def pop_first(self):
+        publication = self.publications[self.start]
+        self.publications[self.start] = None
+        self.start += 1
+        self.first_id += 1
+        if self.start > len(self.publications) // 2:
+            del self.publications[:self.start]
+            self.start = 0
+        self.nbytes -= len(publication) + ENTRY_OVERHEAD
+        return len(publication) + ENTRY_OVERHEAD
+
+    def clear(self):
+        self.first_id += len(self)
+        self.start = 0
+        self.publications = []
+        self.nbytes = 0
+
+    # Yields the (id, publication) pairs after last_publication_id, starting right at its position
+    def after(self, last_publication_id):
+        position = self.start + max(last_publication_id + 1 - self.first_id, 0)
+        for i in range(position, len(self.publications)):
+            yield self.first_id + i - self.start, self.publications[i]
+
+# Same window, but the publications of a topic are encoded one after the other in a single bytearray and an
+# array of offsets marks where each one ends, with a flag marking the compressed ones, so a publication costs its
+# encoded size plus 9 bytes.
+class ArenaTopicWindow:
+    def __init__(self):
+        self.first_id = 1
+        self.start = 0
+        self.arena = bytearray()
+        self.ends = array('q')
+        self.compressed = array('b')
+
+    def __len__(self):
+        return len(self.ends) - self.start
+
+    @property
+    def head_id(self):
+        return self.first_id + len(self) - 1
+
+    @property
+    def nbytes(self):
+        return len(self.arena) - self.offset(self.start) + len(self) * (self.ends.itemsize + self.compressed.itemsize)
+
+    def offset(self, position):
+        return self.ends[position - 1] if position > 0 else 0
+
+    def append(self, publication_id, publication):
+        if len(self) == 0 or publication_id != self.head_id + 1:
+            self.clear()
+            self.first_id = publication_id
+        compressed = isinstance(publication, bytes)
+        self.arena += publication if compressed else publication.encode()
+        self.ends.append(len(self.arena))
+        self.compressed.append(compressed)
+
+    def pop_first(self):
+        released = self.ends[self.start] - self.offset(self.start) + self.ends.itemsize + self.compressed.itemsize
+        self.start += 1
+        self.first_id += 1
+        if self.start > len(self.ends) // 2:
+            self.compact()
+        return released
+
+    def compact(self):
+        offset = self.offset(self.start)
+        del self.arena[:offset]
+        self.ends = array('q', (end - offset for end in self.ends[self.start:]))
+        self.compressed = self.compressed[self.start:]
+        self.start = 0
+
+    def clear(self):
+        self.first_id += len(self)
+        self.start = 0
+        self.arena = bytearray()
+        self.ends = array('q')
+        self.compressed = array('b')
+
+    def after(self, last_publication_id):
+        position = self.start + max(last_publication_id + 1 - self.first_id, 0)
+        for i in range(position, len(self.ends)):
+            data = self.arena[self.offset(i):self.ends[i]]
+            yield self.first_id + i - self.start, bytes(data) if self.compressed[i] else data.decode()
+
+TOPIC_STORES = {"list": TopicWindow, "arena": ArenaTopicWindow}
@@ -0,0 +1,80 @@
+import threading
+from communication.request import TOPIC_SEPARATOR, ANY_LEVEL, ANY_LEVELS
+
+# Topic ids are split in levels by TOPIC_SEPARATOR. In a pattern, ANY_LEVEL matches exactly one level and ANY_LEVELS,
+# only allowed as the last level, matches one or more levels: "sensor.*.temp" matches "sensor.eu.temp" and
+# "sensor.eu.**" matches "sensor.eu.de" and "sensor.eu.de.berlin".
+# Patterns can not contain commas or line breaks, their subscribers are stored in csv files with the pattern in their id.
+def valid_pattern(pattern):
+    if any(char in pattern for char in ",\r\n"):
+        return False
+    levels = pattern.split(TOPIC_SEPARATOR)
+    for i, level in enumerate(levels):
+        if "*" in level and level != ANY_LEVEL and not (level == ANY_LEVELS and i == len(levels) - 1):
+            return False
+    return True
+
+def matches(pattern, topic_id):
+    levels, topic_levels = pattern.split(TOPIC_SEPARATOR), topic_id.split(TOPIC_SEPARATOR)
+    if levels[-1] == ANY_LEVELS:
+        return len(topic_levels) >= len(levels) and all(level in (ANY_LEVEL, topic_level) for level, topic_level in zip(levels[:-1], topic_levels))
+    return len(topic_levels) == len(levels) and all(level in (ANY_LEVEL, topic_level) for level, topic_level in zip(levels, topic_levels))
+
+# Every node is a dict of its child levels, the id of a topic ending at a node is stored under the None key
+class TopicTrie:
+    def __init__(self, topic_ids=[]):
+        self.root = {}
+        self.lock = threading.Lock()
+        for topic_id in topic_ids:
+            self.insert(topic_id)
+
+    def insert(self, topic_id):
+        with self.lock:
+            node = self.root
+            for level in topic_id.split(TOPIC_SEPARATOR):
+                node = node.setdefault(level, {})
+            node[None] = topic_id
+
+    def remove(self, topic_id):
+        with self.lock:
+            path, node = [], self.root
+            for level in topic_id.split(TOPIC_SEPARATOR):
+                if level not in node:
+                    return
+                path.append((node, level))
+                node = node[level]
+            node.pop(None, None)
+            for parent, level in reversed(path):  # prune the levels left without topics
+                if parent[level]:
+                    break
+                del parent[level]
+
+    def match(self, pattern):
+        topic_ids = []
+        with self.lock:
+            self.collect(self.root, pattern.split(TOPIC_SEPARATOR), topic_ids)
+        return topic_ids
+
+    def collect(self, node, levels, topic_ids):
+        if not levels:
+            if None in node:
+                topic_ids.append(node[None])
+            return
+        level, rest = levels[0], levels[1:]
+        if level == ANY_LEVELS:
+            for child_level, child in node.items():
+                if child_level is not None:
+                    self.collect_all(child, topic_ids)
+        elif level == ANY_LEVEL:
+            for child_level, child in node.items():
+                if child_level is not None:
+                    self.collect(child, rest, topic_ids)
+        elif level in node:
+            self.collect(node[level], rest, topic_ids)
+
+    def collect_all(self, node, topic_ids):
+        for level, child in node.items():
+            if level is None:
+                topic_ids.append(child)
+            else:
+                self.collect_all(child, topic_ids)
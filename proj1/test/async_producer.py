@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from async_client import AsyncClient
+
+# Publishes from a single process with many PUTs in flight, to a server already running, and checks a subscriber reads
+# every publication once
+parser = argparse.ArgumentParser(description='Single process producer on the asyncio client')
+parser.add_argument('--messages', help='Number of publications to send', type=int, default=2000)
+parser.add_argument('--concurrency', help='PUT requests in flight', type=int, default=32)
+parser.add_argument('--topic', help='Topic to publish to', type=str, default='async')
+parser.add_argument('--data-dir', help='Directory for the client data', type=str, default='test/data')
+
+async def main():
+    args = parser.parse_args()
+    logging.disable()
+
+    async with AsyncClient(f"{args.data_dir}/async_producer", max_pending_puts=args.concurrency) as producer, \
+               AsyncClient(f"{args.data_dir}/async_consumer") as consumer:
+        await consumer.subscribe(args.topic)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async def put(i):
+            async with semaphore:
+                return await producer.put(args.topic, f"publication{i}")
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(put(i) for i in range(args.messages)))
+        elapsed = time.perf_counter() - started
+        failed = [error for succ, error in results if not succ]
+        print(f"PUT {args.messages - len(failed)}/{args.messages} in {elapsed:.2f}s ({(args.messages - len(failed)) / elapsed:.0f} msgs/s)")
+
+        received = []
+        while True:
+            succ, publications = await consumer.get_batch(args.topic, 1000)
+            if not succ:
+                break
+            received += publications
+        missing = args.messages - len(set(received))
+        print(f"GET {len(received)} publications, {missing} missing, {len(received) - len(set(received))} duplicated")
+        await consumer.unsubscribe(args.topic)
+
+    if failed or missing or len(received) != len(set(received)):
+        print("Async producer test failed")
+        sys.exit(1)
+    print("Async producer test passed")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from async_client import AsyncClient
+from client import set_server_endpoints
+from communication.codec import CODECS, JSON
+
+# Runs producers and consumers against a server started by the benchmark, optionally killing and restarting it while
+# they run, and reports throughput and latency percentiles of every operation. PUT latency is measured by the
+# producer, GET latency per request (a long-polled GET includes the wait) and end-to-end latency from the time a
+# publication was sent to the time a consumer read it.
+parser = argparse.ArgumentParser(description='Load generator and latency benchmark')
+parser.add_argument('--producers', help='Number of producer clients', type=int, default=4)
+parser.add_argument('--consumers', help='Number of consumer clients, each subscribed to every topic', type=int, default=2)
+parser.add_argument('--topics', help='Number of topics, publications are spread evenly over them', type=int, default=4)
+parser.add_argument('--messages', help='Publications sent by each producer', type=int, default=1000)
+parser.add_argument('--size', help='Publication size in bytes', type=int, default=100)
+parser.add_argument('--batch', help='Publications per PUT request', type=int, default=1)
+parser.add_argument('--in-flight', help='PUT requests in flight per producer', type=int, default=8)
+parser.add_argument('--group', help='Consumer group the consumers join, so each publication is read by a single consumer', type=str)
+parser.add_argument('--codec', help='Message encoding of the clients', choices=CODECS, default=JSON)
+parser.add_argument('--kill-every', help='Seconds between kills of the server (SIGKILL), 0 to never kill it', type=float, default=0)
+parser.add_argument('--down-time', help='Seconds the server stays down after being killed', type=float, default=1)
+parser.add_argument('--port', help='Port the server binds to', type=int, default=9201)
+parser.add_argument('--data-dir', help='Directory for the server and client data, erased first', type=str, default='test/data/benchmark')
+parser.add_argument('--json', help='File where the results are written as JSON, - for stdout', type=str)
+parser.add_argument('server_args', help='Options given to the server, after --, e.g. -- --durability interval', nargs='*')
+
+WAIT_MS = 1000          # long poll of the consumers
+GROUP_POLL = 0.01       # seconds a member of a consumer group waits after reading an empty topic, group reads do not long poll
+DRAIN_TIMEOUT = 10      # seconds consumers keep reading after the producers finish
+PERCENTILES = [50, 99, 99.9]
+
+def percentile(samples, p):
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+def summarize(samples, elapsed):
+    samples = sorted(samples)
+    summary = {"count": len(samples), "per_second": round(len(samples) / elapsed, 1) if elapsed > 0 else 0}
+    for p in PERCENTILES:
+        summary[f"p{p:g}_ms"] = round(percentile(samples, p) * 1000, 3) if samples else None
+    summary["max_ms"] = round(samples[-1] * 1000, 3) if samples else None
+    return summary
+
+class ServerProcess:
+    def __init__(self, args):
+        self.command = [sys.executable, "src/server.py", "--endpoint", f"tcp://*:{args.port}",
+                        "--data-dir", f"{args.data_dir}/server"] + args.server_args
+        self.kills = 0
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+
+    async def inject_faults(self, interval, down_time):
+        while True:
+            await asyncio.sleep(interval)
+            self.stop()
+            self.kills += 1
+            await asyncio.sleep(down_time)
+            self.start()
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.topics = [f"topic{i}" for i in range(args.topics)]
+        self.latencies = {"PUT": [], "GET": [], "end_to_end": []}
+        self.errors = {}
+        self.sent = {topic: set() for topic in self.topics}
+        self.received = {}
+        self.producers_done = None
+
+    def error(self, operation, message):
+        key = f"{operation}: {message}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    # The send time leads the publication so consumers can measure the end-to-end latency
+    def publication(self, producer, i):
+        header = f"{time.time():.6f} {producer} {i} "
+        return header + "x" * max(self.args.size - len(header), 0)
+
+    async def produce(self, index):
+        args = self.args
+        async with AsyncClient(f"{args.data_dir}/producer{index}", args.codec, args.in_flight) as producer:
+            async def put(topic, publications):
+                started = time.perf_counter()
+                keys = [tuple(publication.split(" ", 3)[1:3]) for publication in publications]
+                while True:
+                    succ, error = await producer.put_batch(topic, publications)
+                    if succ or error == "Duplicated message":
+                        break
+                    self.error("PUT", error)
+                    if error != "Server is offline":
+                        return
+                self.latencies["PUT"].append(time.perf_counter() - started)
+                self.sent[topic].update(keys)
+
+            semaphore = asyncio.Semaphore(args.in_flight)
+            async def limited(start):
+                async with semaphore:
+                    topic = self.topics[start // args.batch % len(self.topics)]
+                    await put(topic, [self.publication(index, i) for i in range(start, min(start + args.batch, args.messages))])
+            await asyncio.gather(*(limited(start) for start in range(0, args.messages, args.batch)))
+
+    async def subscribe(self, index):
+        consumer = await AsyncClient(f"{self.args.data_dir}/consumer{index}", self.args.codec).connect()
+        for topic in self.topics:
+            while True:
+                succ, error = await consumer.subscribe(topic, self.args.group)
+                if succ:
+                    break
+                self.error("SUB", error)
+        return consumer
+
+    async def consume(self, index, consumer):
+        async def read(topic):
+            received = self.received.setdefault(index, {}).setdefault(topic, set())
+            drain_deadline = None
+            while True:
+                if self.producers_done.is_set():
+                    drain_deadline = drain_deadline or time.perf_counter() + DRAIN_TIMEOUT
+                    if self.sent[topic] <= self.read_by(index, topic) or time.perf_counter() > drain_deadline:
+                        return
+                started = time.perf_counter()
+                succ, publications = await consumer.get_batch(topic, 1000, wait_ms=WAIT_MS)
+                self.latencies["GET"].append(time.perf_counter() - started)
+                if not succ:
+                    if not publications.startswith("All publications"):
+                        self.error("GET", publications)
+                    elif self.args.group:
+                        await asyncio.sleep(GROUP_POLL)
+                    continue
+                now = time.time()
+                for publication in publications:
+                    sent, producer, i, _ = publication.split(" ", 3)
+                    if (producer, i) not in received:   # publications are read again after a server restart
+                        self.latencies["end_to_end"].append(now - float(sent))
+                        received.add((producer, i))
+        try:
+            await asyncio.gather(*(read(topic) for topic in self.topics))
+        finally:
+            await consumer.close()
+
+    # Publications of a topic read by the consumer, or by any consumer of the group
+    def read_by(self, index, topic):
+        if not self.args.group:
+            return self.received.get(index, {}).get(topic, set())
+        return set().union(*(topics.get(topic, set()) for topics in self.received.values()))
+
+    async def run(self):
+        args = self.args
+        self.producers_done = asyncio.Event()
+        consumers = [await self.subscribe(i) for i in range(args.consumers)]
+        consuming = [asyncio.create_task(self.consume(i, consumer)) for i, consumer in enumerate(consumers)]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(self.produce(i) for i in range(args.producers)))
+        produced = time.perf_counter() - started
+        self.producers_done.set()
+        await asyncio.gather(*consuming)
+        consumed = time.perf_counter() - started
+        return produced, consumed
+
+    def results(self, produced, consumed, kills):
+        expected = sum(len(keys) for keys in self.sent.values())
+        received = [sum(len(keys) for keys in topics.values()) for topics in self.received.values()]
+        readers = [0] if self.args.group else list(self.received)
+        missing = sum(len(keys - self.read_by(index, topic)) for topic, keys in self.sent.items() for index in readers)
+        return {
+            "config": {key: value for key, value in vars(self.args).items() if key not in ("json", "data_dir")},
+            "publications": {"sent": expected, "received_per_consumer": received,
+                             "missing": missing},
+            "server_kills": kills,
+            "produce_seconds": round(produced, 3),
+            "consume_seconds": round(consumed, 3),
+            "throughput": {"put_msgs_per_second": round(expected / produced, 1),
+                           "get_msgs_per_second": round(sum(received) / consumed, 1)},
+            "latency": {
+                "PUT": summarize(self.latencies["PUT"], produced),
+                "GET": summarize(self.latencies["GET"], consumed),
+                "end_to_end": summarize(self.latencies["end_to_end"], consumed),
+            },
+            "errors": self.errors,
+        }
+
+def print_results(results):
+    throughput = results["throughput"]
+    publications = results["publications"]
+    print(f"Sent {publications['sent']} publications in {results['produce_seconds']}s ({throughput['put_msgs_per_second']} msgs/s), "
+          f"read {sum(publications['received_per_consumer'])} in {results['consume_seconds']}s ({throughput['get_msgs_per_second']} msgs/s)")
+    print(f"{'operation':<12}{'count':>10}{'ops/s':>10}" + "".join(f"{f'p{p:g} (ms)':>12}" for p in PERCENTILES) + f"{'max (ms)':>12}")
+    for operation, summary in results["latency"].items():
+        print(f"{operation:<12}{summary['count']:>10}{summary['per_second']:>10}"
+              + "".join(f"{str(summary[f'p{p:g}_ms']):>12}" for p in PERCENTILES) + f"{str(summary['max_ms']):>12}")
+    print(f"Acknowledged publications missed by a consumer: {publications['missing']}, server kills: {results['server_kills']}")
+    for error, count in results["errors"].items():
+        print(f"  {count} x {error}")
+
+async def main():
+    args = parser.parse_args()
+    logging.disable()
+    shutil.rmtree(args.data_dir, ignore_errors=True)
+    set_server_endpoints([f"tcp://localhost:{args.port}"])
+
+    server = ServerProcess(args)
+    faults = asyncio.create_task(server.inject_faults(args.kill_every, args.down_time)) if args.kill_every > 0 else None
+    try:
+        benchmark = Benchmark(args)
+        produced, consumed = await benchmark.run()
+    finally:
+        if faults:
+            faults.cancel()
+        server.stop()
+
+    results = benchmark.results(produced, consumed, server.kills)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+        return
+    print_results(results)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+import argparse
+import sys
+import timeit
+
+sys.path.append('src')
+
+from communication.request import *
+from communication.reply import *
+
+parser = argparse.ArgumentParser(description='Compare the encoding and decoding cost of the message codecs')
+parser.add_argument('-n', '--iterations', help='Iterations per measurement', type=int, default=20000)
+parser.add_argument('-s', '--size', help='Publication size in bytes', type=int, default=100)
+
+def messages(size):
+    publication = "x" * size
+    client_id = "0123456789abcdef0123456789abcdef"
+    return {
+        "PUT request": create_put_request("topic", client_id, 1234567, publication),
+        "PUT batch request": create_put_batch_request("topic", client_id, 1234567, [publication] * 100),
+        "GET request": create_get_request("topic", client_id, 1234),
+        "GET reply": create_get_ack(publication, 1235),
+        "GET batch reply": create_get_batch_ack([(i, publication) for i in range(100)], 99),
+    }
+
+def main():
+    args = parser.parse_args()
+    print(f"{'message':<20}{'codec':<10}{'bytes':>10}{'encode (us)':>14}{'decode (us)':>14}")
+    for name, message in messages(args.size).items():
+        decode = Request.decode if isinstance(message, Request) else Reply.decode
+        for codec in CODECS:
+            data = message.encode(codec)
+            encode_time = timeit.timeit(lambda: message.encode(codec), number=args.iterations) / args.iterations
+            decode_time = timeit.timeit(lambda: decode(data), number=args.iterations) / args.iterations
+            print(f"{name:<20}{codec:<10}{len(data):>10}{encode_time * 1e6:>14.2f}{decode_time * 1e6:>14.2f}")
+
+if __name__ == '__main__':
+    main()
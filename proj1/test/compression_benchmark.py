@@ -0,0 +1,45 @@
+import argparse
+import json
+import random
+import sys
+import timeit
+
+sys.path.append('src')
+
+from communication.compression import *
+
+parser = argparse.ArgumentParser(description='Compare the compression ratio and cost of the zlib levels on JSON publications')
+parser.add_argument('-n', '--iterations', help='Iterations per measurement', type=int, default=2000)
+parser.add_argument('-s', '--size', help='Approximate publication size in bytes', type=int, default=4096)
+parser.add_argument('-l', '--levels', help='Comma separated zlib levels', type=str, default="1,6,9")
+
+# Several KB of JSON records sharing their keys and most of their values, like the events of a real topic
+def publication(size, seed=0):
+    rng = random.Random(seed)
+    records = []
+    while len(json.dumps(records)) < size:
+        records.append({
+            "device": f"sensor-{rng.randint(0, 20):03d}",
+            "region": rng.choice(["eu-west", "eu-central", "us-east"]),
+            "status": rng.choice(["ok", "ok", "ok", "degraded"]),
+            "temperature": round(rng.uniform(15, 30), 2),
+            "timestamp": 1700000000 + rng.randint(0, 86400),
+        })
+    return json.dumps(records)
+
+def main():
+    args = parser.parse_args()
+    text = publication(args.size)
+    size = len(text.encode())
+    print(f"Publication of {size} bytes")
+    print(f"{'level':<8}{'bytes':>10}{'ratio':>8}{'compress (us)':>16}{'MB/s':>8}{'decompress (us)':>18}{'MB/s':>8}")
+    for level in [int(level) for level in args.levels.split(",")]:
+        compressed = compress(text, level)
+        compress_time = timeit.timeit(lambda: compress(text, level), number=args.iterations) / args.iterations
+        decompress_time = timeit.timeit(lambda: decompress(compressed), number=args.iterations) / args.iterations
+        compressed_size = len(compressed) if isinstance(compressed, bytes) else size
+        print(f"{level:<8}{compressed_size:>10}{size / compressed_size:>8.2f}{compress_time * 1e6:>16.1f}{size / compress_time / 1e6:>8.1f}"
+              f"{decompress_time * 1e6:>18.1f}{size / decompress_time / 1e6:>8.1f}")
+
+if __name__ == '__main__':
+    main()
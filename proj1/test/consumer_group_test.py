@@ -0,0 +1,100 @@
+import argparse
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from client import Client
+
+# Publishes to a topic read by the members of a consumer group, each a separate process. One member crashes right
+# after its first read, without acknowledging it, and the test checks every publication is read by some member, the
+# ones leased to the crashed member after its lease expired, and that the others split the topic between them
+parser = argparse.ArgumentParser(description='Consumer group test')
+parser.add_argument('--messages', help='Number of publications to send', type=int, default=500)
+parser.add_argument('--members', help='Number of members of the group that keep reading', type=int, default=3)
+parser.add_argument('--batch', help='Publications per read of a member', type=int, default=10)
+parser.add_argument('--lease-timeout', help='Lease timeout of the server in seconds', type=float, default=2)
+parser.add_argument('--data-dir', help='Directory for the server and client data', type=str, default='test/data')
+parser.add_argument('--member', help=argparse.SUPPRESS, type=str)
+parser.add_argument('--crash', help=argparse.SUPPRESS, action='store_true')
+
+ENDPOINT = "tcp://localhost:9301"
+TOPIC = "orders"
+GROUP = "billing"
+
+# Prints every publication it reads and stops once the topic stayed empty for twice the lease timeout
+def member(args):
+    client = Client(f"{args.data_dir}/{args.member}", endpoints=[ENDPOINT])
+    client.subscribe(TOPIC, GROUP)
+    print("joined", flush=True)
+    idle_since = None
+    while idle_since == None or time.monotonic() - idle_since < 2 * args.lease_timeout:
+        succ, publications = client.get_batch(TOPIC, args.batch)
+        if not succ:
+            idle_since = idle_since or time.monotonic()
+            time.sleep(0.1)
+            continue
+        idle_since = None
+        print("\n".join(publications), flush=True)
+        if args.crash:
+            os._exit(1)
+        time.sleep(0.01)    # processing
+    client.unsubscribe(TOPIC)
+
+def start_member(args, name, crash=False):
+    return subprocess.Popen([sys.executable, __file__, "--member", name, "--data-dir", args.data_dir, "--batch", str(args.batch),
+                             "--lease-timeout", str(args.lease_timeout)] + (["--crash"] if crash else []), stdout=subprocess.PIPE, text=True)
+
+def main():
+    args = parser.parse_args()
+    logging.disable()
+    if args.member:
+        return member(args)
+    shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    server = subprocess.Popen([sys.executable, "src/server.py", "--endpoint", "tcp://*:9301", "--data-dir", f"{args.data_dir}/server",
+                               "--lease-timeout", str(args.lease_timeout)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2)
+
+    members = []
+    try:
+        names = [f"member{i}" for i in range(args.members)]
+        members = [start_member(args, name) for name in names] + [start_member(args, "crashing", True)]
+        for process in members:
+            process.stdout.readline()   # every member joined before the first publication
+
+        producer = Client(f"{args.data_dir}/producer", endpoints=[ENDPOINT])
+        sent = [f"publication{i}" for i in range(args.messages)]
+        for start in range(0, args.messages, 50):
+            while True:
+                succ, error = producer.put_batch(TOPIC, sent[start:start + 50])
+                if succ or error == "Duplicated message":
+                    break
+
+        received = {}
+        for name, process in zip(names + ["crashing"], members):
+            output, _ = process.communicate(timeout=60)
+            received[name] = output.split()
+    finally:
+        for process in members:
+            process.kill()
+        server.kill()
+
+    read = [publication for publications in received.values() for publication in publications]
+    missing = set(sent) - set(read)
+    redelivered = set(received["crashing"]) & {publication for name in names for publication in received[name]}
+    duplicates = len(read) - len(set(read))
+    print(f"Read per member: {', '.join(f'{name} {len(publications)}' for name, publications in received.items())}")
+    print(f"Publications read by the crashed member and redelivered: {len(redelivered)} of {len(received['crashing'])}")
+    print(f"Publications read more than once: {duplicates}, missing: {len(missing)}")
+    if missing or len(redelivered) != len(received["crashing"]) or duplicates != len(received["crashing"]):
+        print("Consumer group test failed")
+        sys.exit(1)
+    print("Consumer group test passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import logging
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from client import Client, REQUEST_TIMEOUT, REQUEST_RETRIES
+
+# Starts a primary and a backup, kills the primary while a client publishes and checks the backup takes over without
+# losing any acknowledged publication, within the time a client keeps retrying a request
+parser = argparse.ArgumentParser(description='Primary/backup failover test')
+parser.add_argument('--messages', help='Number of publications to send', type=int, default=200)
+parser.add_argument('--kill-after', help='Publications acknowledged before the primary is killed', type=int, default=100)
+parser.add_argument('--data-dir', help='Directory for the server and client data', type=str, default='test/data')
+
+PRIMARY = ["--endpoint", "tcp://*:9001", "--replication-endpoint", "tcp://*:9002"]
+BACKUP = ["--endpoint", "tcp://*:9011", "--backup-of", "tcp://localhost:9002"]
+ENDPOINTS = ["tcp://localhost:9001", "tcp://localhost:9011"]
+
+def start_server(args, data_dir):
+    return subprocess.Popen([sys.executable, "src/server.py", "--data-dir", data_dir] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def main():
+    args = parser.parse_args()
+    logging.disable()
+    shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    primary = start_server(PRIMARY, f"{args.data_dir}/primary")
+    backup = start_server(BACKUP, f"{args.data_dir}/backup")
+    time.sleep(2)
+
+    try:
+        consumer = Client(f"{args.data_dir}/consumer", endpoints=ENDPOINTS)
+        consumer.subscribe("failover")
+        producer = Client(f"{args.data_dir}/producer")
+
+        acknowledged, longest_pause, last_ack = [], 0, time.perf_counter()
+        for i in range(args.messages):
+            if len(acknowledged) == args.kill_after and primary.poll() == None:
+                primary.kill()
+                print(f"Primary killed after {len(acknowledged)} publications")
+            while True:
+                succ, error = producer.put("failover", f"publication{i}")
+                if succ or error == "Duplicated message":
+                    break
+            acknowledged.append(f"publication{i}")
+            longest_pause = max(longest_pause, time.perf_counter() - last_ack)
+            last_ack = time.perf_counter()
+        print(f"Longest time without an acknowledged publication: {longest_pause:.2f}s")
+
+        received = []
+        while True:
+            succ, publications = consumer.get_batch("failover", 1000)
+            if not succ:
+                break
+            received += publications
+        missing = [publication for publication in acknowledged if publication not in received]
+        print(f"Received {len(received)} of {len(acknowledged)} acknowledged publications, {len(missing)} missing")
+        failed = len(missing) > 0 or longest_pause > REQUEST_TIMEOUT * REQUEST_RETRIES / 1000
+    finally:
+        primary.kill()
+        backup.kill()
+
+    if failed:
+        print("Failover test failed")
+        sys.exit(1)
+    print("Failover test passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import logging
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+import zmq
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from communication.codec import encode_binary
+from communication.reply import Reply, ReplyType
+
+# Sends requests no client would send and checks the server answers each with a NAK, or discards it when it can not
+# even be decoded (expected error None), and keeps serving. Requests given as bytes are sent as they are.
+parser = argparse.ArgumentParser(description='Malformed request test')
+parser.add_argument('--data-dir', help='Directory for the server data', type=str, default='test/data')
+
+ENDPOINT = "tcp://localhost:9501"
+TIMEOUT_MS = 3000
+
+CASES = [
+    ("unknown request type", {"type": "FOO", "topic": "topic", "client_id": "client", "body": {}}, "Invalid operation type"),
+    ("null topic", {"type": "GET", "topic": None, "client_id": "client", "body": {"last_publication_id": 0}}, "Topic not found"),
+    ("numeric topic", {"type": "PUT", "topic": 1, "client_id": "client", "body": {"client_counter": 1, "publication": "x"}}, "Topic not found"),
+    ("GET without cursor", {"type": "GET", "topic": "topic", "client_id": "client", "body": {}}, "Invalid message format"),
+    ("GET with a null cursor", {"type": "GET", "topic": "topic", "client_id": "client", "body": {"last_publication_id": None}}, "Invalid message format"),
+    ("GET with a null body", {"type": "GET", "topic": "topic", "client_id": "client", "body": None}, "Invalid message format"),
+    ("batch GET with a text count", {"type": "GET", "topic": "topic", "client_id": "client", "body": {"last_publication_id": 0, "max_count": "many"}}, "Invalid message format"),
+    ("group GET with a list as group", {"type": "GET", "topic": "topic", "client_id": "client", "body": {"last_publication_id": 0, "group": []}}, "Invalid consumer group"),
+    ("pattern with a comma", {"type": "SUB", "topic": "news,*", "client_id": "client", "body": {}}, "Invalid topic pattern"),
+    ("pattern with a newline", {"type": "SUB", "topic": "news\n*", "client_id": "client", "body": {}}, "Invalid topic pattern"),
+    ("PUSH without window", {"type": "PUSH", "topic": "topic", "client_id": "client", "body": {"last_publication_id": 0}}, "Invalid message format"),
+    ("PUSH with a null body", {"type": "PUSH", "topic": "topic", "client_id": "client", "body": None}, "Invalid message format"),
+    ("PUT without publication", {"type": "PUT", "topic": "topic", "client_id": "client", "body": {"counter": 1}}, "Invalid message format"),
+    ("PUT with a null body", {"type": "PUT", "topic": "topic", "client_id": "client", "body": None}, "Invalid message format"),
+    ("PUT without counter", {"type": "PUT", "topic": "topic", "client_id": "client", "body": {"publication": "x"}}, "Invalid message format"),
+    ("binary magic byte only", b"\xb1", None),
+    ("truncated binary request", encode_binary(0, ["topic", "client", {"last_publication_id": 0}])[:-4], None),
+]
+
+def send(context, request):
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, TIMEOUT_MS)
+    socket.connect(ENDPOINT)
+    try:
+        socket.send(request if isinstance(request, bytes) else json.dumps(request).encode())
+        return Reply.decode(socket.recv())
+    except zmq.Again:
+        return None
+    finally:
+        socket.close()
+
+def main():
+    args = parser.parse_args()
+    logging.disable()
+    shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    server = subprocess.Popen([sys.executable, "src/server.py", "--endpoint", "tcp://*:9501", "--data-dir", f"{args.data_dir}/server"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2)
+
+    context = zmq.Context()
+    failed = False
+    try:
+        for name, request, error in CASES:
+            reply = send(context, request)
+            if error == None and reply != None:
+                print(f"{name}: expected no reply, got {reply.body}")
+                failed = True
+            elif error != None and (reply == None or reply.reply_type != ReplyType.NAK or reply.body["error_message"] != error):
+                print(f"{name}: expected NAK '{error}', got {reply.body if reply else 'no reply'}")
+                failed = True
+            reply = send(context, {"type": "SUB", "topic": "topic", "client_id": "client", "body": {}})
+            if reply == None or reply.reply_type != ReplyType.ACK:
+                print(f"{name}: the server stopped serving, SUB got {reply.body if reply else 'no reply'}")
+                failed = True
+                break
+    finally:
+        server.kill()
+        context.destroy()
+
+    if failed:
+        print("Malformed request test failed")
+        sys.exit(1)
+    print("Malformed request test passed")
+
+if __name__ == "__main__":
+    main()
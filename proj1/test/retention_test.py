@@ -0,0 +1,34 @@
+import math
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+from server_utils.retention import Retention
+
+# Every retention a CONFIG request can set must be read back unchanged from retention.txt, or the server does not start
+ACCEPTED = [{}, {"max_bytes": 1}, {"max_bytes": 10 ** 20}, {"max_bytes": 1e20}, {"max_age": 1e-05}, {"max_age": 0.5},
+            {"max_age": 86400}, {"max_age": math.inf}, {"max_count": 3, "max_age": 2.5}, {"max_bytes": 2 ** 64, "max_age": 1.5e300, "max_count": 7}]
+REJECTED = [{"max_bytes": 0}, {"max_age": -1}, {"max_count": math.nan}, {"max_count": True}, {"max_count": "1"}, {"max_size": 1}, []]
+
+def main():
+    failed = False
+    for limits in ACCEPTED:
+        retention = Retention.from_dict(limits)
+        decoded = Retention.decode(retention.encode())
+        if [(type(limit), limit) for limit in decoded.limits()] != [(type(limit), limit) for limit in retention.limits()]:
+            print(f"{limits}: stored as '{retention.encode()}', read back as {decoded.to_dict()}")
+            failed = True
+    for limits in REJECTED:
+        try:
+            Retention.from_dict(limits)
+            print(f"{limits}: accepted")
+            failed = True
+        except ValueError:
+            pass
+    if failed:
+        print("Retention test failed")
+        sys.exit(1)
+    print("Retention test passed")
+
+if __name__ == "__main__":
+    main()